@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import django_smalluuid.models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('housemates', '0002_auto_20161001_1707'),
+        ('billing_cycle', '0007_billingcycle_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', django_smalluuid.models.SmallUUIDField(default=django_smalluuid.models.UUIDDefault(), editable=False, unique=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('billing_cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statement_snapshots', to='billing_cycle.BillingCycle')),
+                ('housemate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statement_snapshots', to='housemates.Housemate')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='statementsnapshot',
+            unique_together=set([('housemate', 'billing_cycle')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def delete_statement_snapshots(apps, schema_editor):
+    # Snapshots are now stored in a different format. They will be rebuilt upon next use.
+    StatementSnapshot = apps.get_model('accounts', 'StatementSnapshot')
+    StatementSnapshot.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_statement_snapshots, migrations.RunPython.noop),
+    ]
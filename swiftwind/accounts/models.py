@@ -1,6 +1,205 @@
-from uuid import uuid4
-from django.conf import settings
-from django.db import models
+import operator
+import threading
+from datetime import date
+from functools import reduce
 
-# Create your models here.
-from model_utils.models import TimeStampedModel
+from django.contrib.postgres.fields import JSONField
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django_smalluuid.models import SmallUUIDField, uuid_default
+from hordak.models import Transaction, Leg
+
+# Per-thread ledger changes awaiting invalidation, see invalidate_on_commit()
+_pending = threading.local()
+
+
+class StatementSnapshotQuerySet(models.QuerySet):
+
+    def get_statements(self, billing_cycle, housemates):
+        """Get the statements of many housemates for a single billing cycle
+
+        Stored snapshots are used where available. Any missing statements are
+        built, and stored if StatementSnapshot.should_store() the billing cycle.
+
+        Args:
+            billing_cycle (BillingCycle):
+            housemates (list[Housemate]): Housemates, with their accounts loaded
+
+        Returns:
+            dict: Housemate primary keys mapped to statements, as built by build_statements()
+        """
+        from swiftwind.accounts.statements import build_statements
+        from swiftwind.billing_cycle.models import BillingCycle
+
+        store = StatementSnapshot.should_store(billing_cycle)
+        statements = {}
+        if store:
+            statements = dict(
+                self.filter(billing_cycle=billing_cycle, housemate__in=housemates).values_list('housemate_id', 'data')
+            )
+
+        missing = [housemate for housemate in housemates if housemate.pk not in statements]
+        if missing:
+            if store:
+                # Must be read before building, see below
+                version = BillingCycle.objects.filter(pk=billing_cycle.pk).values_list(
+                    'statements_version', flat=True
+                ).get()
+
+            built = build_statements(billing_cycle, missing)
+            statements.update(built)
+            if store:
+                try:
+                    with transaction.atomic():
+                        # The ledger may have changed while we were building. Locking the billing
+                        # cycle means any concurrent invalidation has either committed (so changed
+                        # the version, and we don't store), or will wait for us (so will delete
+                        # what we store).
+                        unchanged = BillingCycle.objects.select_for_update().filter(
+                            pk=billing_cycle.pk, statements_version=version
+                        ).exists()
+                        if unchanged:
+                            self.bulk_create([
+                                StatementSnapshot(housemate_id=housemate_id, billing_cycle=billing_cycle, data=data)
+                                for housemate_id, data in built.items()
+                            ])
+                except IntegrityError:
+                    # Stored concurrently by another process. Ours is equally good.
+                    pass
+
+        return statements
+
+    def get_statement(self, housemate, billing_cycle):
+        """Get the statement of a single housemate. See get_statements()"""
+        return self.get_statements(billing_cycle, [housemate])[housemate.pk]
+
+    def invalidate(self, billing_cycle):
+        """Delete the snapshots for the given billing cycle, as its ledger has changed"""
+        from swiftwind.billing_cycle.models import BillingCycle
+        return self._invalidate_billing_cycles(BillingCycle.objects.filter(pk=billing_cycle.pk))
+
+    def invalidate_date(self, date):
+        """Delete the snapshots for the billing cycle containing the given date"""
+        return self.invalidate_dates([date])
+
+    def invalidate_dates(self, dates):
+        """Delete the snapshots for the billing cycles containing any of the given dates"""
+        from swiftwind.billing_cycle.models import BillingCycle
+
+        if not dates:
+            return
+        condition = reduce(operator.or_, [Q(date_range__contains=date) for date in dates])
+        return self._invalidate_billing_cycles(BillingCycle.objects.filter(condition))
+
+    def _invalidate_billing_cycles(self, billing_cycles):
+        # Change the version first, so that statements being built concurrently
+        # will not be stored. See get_statements()
+        billing_cycles.update(statements_version=F('statements_version') + 1)
+        return self.filter(billing_cycle__in=billing_cycles).delete()
+
+
+class StatementSnapshot(models.Model):
+    """A housemate's statement for a billing cycle
+
+    Past statements rarely change, so are stored rather than rebuilt upon every
+    view. Snapshots are deleted whenever the billing cycle's ledger changes (see the
+    receivers below, and BillingCycle.statements_version), and rebuilt upon next use.
+    See StatementSnapshotQuerySet.get_statements().
+    """
+    uuid = SmallUUIDField(default=uuid_default(), editable=False)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    housemate = models.ForeignKey('housemates.Housemate', related_name='statement_snapshots')
+    billing_cycle = models.ForeignKey('billing_cycle.BillingCycle', related_name='statement_snapshots')
+    data = JSONField()
+
+    objects = StatementSnapshotQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (
+            ('housemate', 'billing_cycle'),
+        )
+
+    def __str__(self):
+        return 'Statement for {} for {}'.format(self.housemate, self.billing_cycle)
+
+    @staticmethod
+    def should_store(billing_cycle):
+        """Should statements for the given billing cycle be stored?
+
+        Statements are stored once they have been sent, or once the billing cycle
+        has ended. Until then they are likely to change.
+        """
+        return billing_cycle.statements_sent or billing_cycle.date_range.upper <= date.today()
+
+
+class _PendingInvalidation(object):
+    """Ledger changes made within the current transaction, invalidated upon commit"""
+
+    def __init__(self):
+        self.dates = set()
+        self.transaction_ids = set()
+
+    def __call__(self):
+        if getattr(_pending, 'invalidation', None) is self:
+            _pending.invalidation = None
+        _invalidate(self.dates, self.transaction_ids)
+
+
+def _invalidate(dates, transaction_ids):
+    dates = set(dates)
+    if transaction_ids:
+        dates.update(Transaction.objects.filter(pk__in=transaction_ids).values_list('date', flat=True))
+    StatementSnapshot.objects.invalidate_dates(dates)
+
+
+def invalidate_on_commit(dates=(), transaction_ids=()):
+    """Invalidate the snapshots affected by a ledger change once the current transaction commits
+
+    Changes are collected, so that however many transactions & legs are
+    changed, the snapshots are invalidated using a constant number of queries.
+    Outside of a transaction the snapshots are invalidated immediately.
+
+    Args:
+        dates (iterable[date]): Dates of the changed transactions
+        transaction_ids (iterable[int]): IDs of transactions whose date is not to hand
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        _invalidate(dates, transaction_ids)
+        return
+
+    pending = getattr(_pending, 'invalidation', None)
+    if pending is None or not any(callback is pending for _, callback in connection.run_on_commit):
+        # Any previous changes have been invalidated, or rolled back
+        pending = _pending.invalidation = _PendingInvalidation()
+        transaction.on_commit(pending)
+    pending.dates.update(dates)
+    pending.transaction_ids.update(transaction_ids)
+
+
+def _as_date(value):
+    return parse_date(value) if isinstance(value, str) else value
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_for_transaction(sender, instance, **kwargs):
+    # Transactions created when enacting billing cycles are handled by
+    # BillingCycle, as they are bulk created. This catches all others.
+    invalidate_on_commit(dates=[_as_date(instance.date)])
+
+
+@receiver(post_save, sender=Leg)
+def invalidate_for_leg(sender, instance, **kwargs):
+    # Legs are deleted along with their transaction (handled above), or by
+    # BillingCycle, which invalidates explicitly. There is deliberately no
+    # post_delete receiver, as it would prevent legs being fast-deleted.
+    transaction_cache = Leg._meta.get_field('transaction').get_cache_name()
+    if hasattr(instance, transaction_cache):
+        invalidate_on_commit(dates=[_as_date(instance.transaction.date)])
+    else:
+        invalidate_on_commit(transaction_ids=[instance.transaction_id])
@@ -0,0 +1,329 @@
+"""Rendering of statement emails without going through the view layer
+
+Rendering StatementEmailView for each housemate runs the full view stack and
+around half a dozen queries per housemate. StatementRenderer instead loads
+the data for all housemates in a billing cycle up-front using a constant
+number of queries, and renders each statement using a single compiled template.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Prefetch, Q, Sum
+from django.template.loader import get_template
+from hordak.models import Account, Leg
+from hordak.utilities.currency import Balance
+from moneyed import Money
+
+from swiftwind.accounts.models import StatementSnapshot
+from swiftwind.housemates.models import Housemate
+from swiftwind.settings.models import Settings
+from swiftwind.utilities.pagination import DEFAULT_PAGE_SIZE, filter_before_cursor, paginate_legs
+from swiftwind.utilities.site import get_site_root
+
+
+def get_balances(accounts):
+    """Get the balance of many accounts, including child accounts, using two queries
+
+    Equivalent to calling Account.balance() for each account.
+
+    Args:
+        accounts (list[Account]):
+
+    Returns:
+        dict: Account primary keys mapped to Balances
+    """
+    if not accounts:
+        return {}
+
+    descendants = list(
+        Account.objects.filter(reduce(or_, [
+            Q(tree_id=account.tree_id, lft__gte=account.lft, rght__lte=account.rght)
+            for account in accounts
+        ]))
+    )
+    leg_totals = (
+        Leg.objects
+        .filter(account__in=descendants)
+        .order_by()
+        .values_list('account_id', 'amount_currency')
+        .annotate(total=Sum('amount'))
+    )
+
+    simple_balances = {descendant.pk: Balance() for descendant in descendants}
+    for account_id, currency, total in leg_totals:
+        simple_balances[account_id] += Balance([Money(total, currency)])
+
+    balances = {}
+    for account in accounts:
+        balances[account.pk] = sum((
+            simple_balances[descendant.pk] * descendant.sign
+            for descendant in descendants
+            if descendant.tree_id == account.tree_id and account.lft <= descendant.lft <= account.rght
+        ), Balance())
+    return balances
+
+
+def get_payment_history(account, cursor=None, page_size=DEFAULT_PAGE_SIZE, balance=None):
+    """Get a page of an account's legs, newest first, each with the account's balance following it
+
+    Rather than calling Leg.account_balance_after() for every leg, the balance following
+    the newest leg on the page is found from the account's current balance, less the legs
+    on earlier pages. The balances following the remaining legs on the page are then found
+    by subtracting each leg in turn. The first page therefore needs no aggregate beyond the
+    current balance, and later pages only aggregate the legs which precede them. Legs are
+    ordered by transaction date, then transaction. Child accounts are not included.
+
+    Each leg has the following attributes set:
+
+        balance_after (Balance): The account's balance following the leg
+        counterpart_legs (list[Leg]): The transaction's legs on the opposite side to this
+            leg, with their accounts loaded
+
+    Args:
+        account (Account):
+        cursor (str): The page to get. See swiftwind.utilities.pagination.
+        page_size (int): The maximum number of legs to get
+        balance (Balance): The account's current balance, excluding child accounts, if
+            already known. Defaults to Account.simple_balance().
+
+    Returns:
+        LegPage
+    """
+    page = paginate_legs(
+        account.legs
+        .select_related('transaction')
+        .prefetch_related(Prefetch('transaction__legs', queryset=Leg.objects.select_related('account'))),
+        cursor=cursor,
+        page_size=page_size,
+    )
+    if not page:
+        return page
+
+    if balance is None:
+        balance = account.simple_balance()
+
+    # Unsigned totals of the legs up to & including the newest leg on the page
+    running_totals = defaultdict(Decimal)
+    for money in balance.monies():
+        running_totals[money.currency.code] = money.amount * account.sign
+    if cursor:
+        preceding_totals = (
+            filter_before_cursor(account.legs.all(), cursor)
+            .order_by()
+            .values_list('amount_currency')
+            .annotate(total=Sum('amount'))
+        )
+        for currency, total in preceding_totals:
+            running_totals[currency] -= total
+
+    for leg in page:
+        currency = leg.amount_currency
+        leg.balance_after = Balance([Money(running_totals[currency], currency)]) * account.sign
+        running_totals[currency] -= leg.amount.amount
+        leg.counterpart_legs = [
+            other_leg for other_leg in leg.transaction.legs.all()
+            if (other_leg.amount.amount > 0) != (leg.amount.amount > 0)
+        ]
+    return page
+
+
+def _dump_money(money):
+    return [str(money.amount), str(money.currency)]
+
+
+def _load_money(value):
+    amount, currency = value
+    return Money(amount, currency)
+
+
+def build_statements(billing_cycle, housemates):
+    """Build the statements of many housemates for a single billing cycle using a constant number of queries
+
+    Legs created by enacting the billing cycle are split into recurring & one-off
+    costs. Any other legs dated within the billing cycle are other transactions.
+
+    The statements are JSON serialisable, so may be stored as StatementSnapshots.
+    They therefore only hold what is determined by the billing cycle's ledger.
+    Accounts are referenced by primary key, as they may be renamed, and the
+    billing cycle's dates are left to get_statement_context().
+
+    Args:
+        billing_cycle (BillingCycle):
+        housemates (list[Housemate]): Housemates, with their accounts loaded
+
+    Returns:
+        dict: Housemate primary keys mapped to statements
+    """
+    statements = {
+        housemate.pk: dict(recurring=[], one_off=[], other=[])
+        for housemate in housemates
+    }
+    housemate_ids = {housemate.account.pk: housemate.pk for housemate in housemates}
+    if not housemate_ids:
+        return statements
+
+    legs = Leg.objects.filter(
+        Q(transaction__recurred_cost__billing_cycle=billing_cycle) |
+        Q(
+            transaction__date__gte=billing_cycle.date_range.lower,
+            transaction__date__lt=billing_cycle.date_range.upper,
+        ),
+        account__in=list(housemate_ids),
+    ).order_by('-transaction__date', '-pk').select_related(
+        'transaction__recurred_cost__recurring_cost',
+    ).prefetch_related(
+        'transaction__legs',
+    )
+
+    for leg in legs:
+        statement = statements[housemate_ids[leg.account_id]]
+        try:
+            recurred_cost = leg.transaction.recurred_cost
+        except ObjectDoesNotExist:
+            recurred_cost = None
+
+        if recurred_cost and recurred_cost.billing_cycle_id == billing_cycle.pk:
+            recurring_cost = recurred_cost.recurring_cost
+            statement['one_off' if recurring_cost.is_one_off() else 'recurring'].append(dict(
+                account=recurring_cost.to_account_id,
+                amount=_dump_money(leg.amount),
+            ))
+        else:
+            statement['other'].append(dict(
+                accounts=[other_leg.account_id for other_leg in leg.transaction.legs.all() if other_leg.pk != leg.pk],
+                description=leg.transaction.description,
+                amount=_dump_money(leg.amount),
+            ))
+
+    return statements
+
+
+def get_account_names(statements):
+    """Get the names of the accounts referenced by the given statements using a single query
+
+    Args:
+        statements (iterable[dict]): Statements built by build_statements()
+
+    Returns:
+        dict: Account primary keys mapped to names
+    """
+    account_ids = set()
+    for statement in statements:
+        account_ids.update(item['account'] for item in statement['recurring'] + statement['one_off'])
+        for item in statement['other']:
+            account_ids.update(item['accounts'])
+    if not account_ids:
+        return {}
+    return dict(Account.objects.filter(pk__in=account_ids).values_list('pk', 'name'))
+
+
+def get_statement_context(statement, billing_cycle, account_names):
+    """Get the template context for a statement built by build_statements()
+
+    Args:
+        statement (dict): The statement
+        billing_cycle (BillingCycle): The billing cycle the statement was built for
+        account_names (dict): The names of the accounts referenced, see get_account_names()
+
+    Returns:
+        dict
+    """
+    recurring_costs = [
+        dict(name=account_names.get(item['account'], ''), amount=_load_money(item['amount']))
+        for item in statement['recurring']
+    ]
+    one_off_costs = [
+        dict(name=account_names.get(item['account'], ''), amount=_load_money(item['amount']))
+        for item in statement['one_off']
+    ]
+    other_transactions = [
+        dict(
+            accounts=[account_names.get(account_id, '') for account_id in item['accounts']],
+            description=item['description'],
+            amount=_load_money(item['amount']),
+        )
+        for item in statement['other']
+    ]
+
+    # From the calendar, so no queries are needed
+    previous = billing_cycle.get_previous()
+    next = billing_cycle.get_next()
+
+    recurring_total = sum(item['amount'] for item in recurring_costs)
+    one_off_total = sum(item['amount'] for item in one_off_costs)
+    return dict(
+        start_date=billing_cycle.date_range.lower,
+        end_date=billing_cycle.date_range.upper - timedelta(days=1),
+        recurring_costs=recurring_costs,
+        one_off_costs=one_off_costs,
+        other_transactions=other_transactions,
+        recurring_total=recurring_total,
+        one_off_total=one_off_total,
+        other_total=sum(item['amount'] for item in other_transactions),
+        total=recurring_total + one_off_total,
+        previous_date=previous.date_range.lower if previous else None,
+        next_date=next.date_range.lower if next else None,
+    )
+
+
+class StatementRenderer(object):
+    """Render statement emails for many housemates for a single billing cycle
+
+    Usage::
+
+        renderer = StatementRenderer(billing_cycle)
+        for housemate in renderer.housemates:
+            html = renderer.render(housemate)
+
+    Args:
+        billing_cycle (BillingCycle): The billing cycle to render statements for
+        housemates (QuerySet): The housemates to render statements for. Defaults
+            to all active housemates.
+    """
+    template_name = 'accounts/statement_email.html'
+
+    def __init__(self, billing_cycle, housemates=None):
+        if housemates is None:
+            housemates = Housemate.objects.filter(user__is_active=True)
+        self.billing_cycle = billing_cycle
+        self.housemates = list(housemates.select_related('account', 'user'))
+        self.template = get_template(self.template_name)
+        self.load()
+
+    def load(self):
+        self.site_root = get_site_root()
+        self.payment_information = Settings.objects.get().payment_information
+        self.balances = get_balances([housemate.account for housemate in self.housemates])
+        self.statements = StatementSnapshot.objects.get_statements(self.billing_cycle, self.housemates)
+        self.account_names = get_account_names(self.statements.values())
+
+    def get_context(self, housemate):
+        return dict(
+            get_statement_context(self.statements[housemate.pk], self.billing_cycle, self.account_names),
+            housemate=housemate,
+            balance=self.balances[housemate.account_id],
+            billing_cycle=self.billing_cycle,
+            payment_information=self.payment_information,
+            site_root=self.site_root,
+        )
+
+    def render(self, housemate):
+        """Render the statement email for the given housemate
+
+        Returns:
+            str: The email's HTML
+        """
+        return self.template.render(self.get_context(housemate))
+
+
+def render_reconciliation_required_email():
+    """Render the reconciliation required email, which is identical for all housemates
+
+    Returns:
+        str: The email's HTML
+    """
+    return get_template('accounts/reconciliation_required_email.html').render(dict(site_root=get_site_root()))
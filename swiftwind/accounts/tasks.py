@@ -1,3 +1,5 @@
+import logging
+
 from celery import shared_task
 from django.db import transaction
 
@@ -5,13 +7,61 @@ from hordak.data_sources import tellerio
 from hordak.models.core import Account
 from swiftwind.billing_cycle.models import BillingCycle
 from swiftwind.settings.models import Settings
+from swiftwind.utilities.locks import try_advisory_xact_lock
+
+logger = logging.getLogger(__name__)
+
+
+#: The advisory lock held while notifying the housemates of a single billing cycle
+NOTIFY_LOCK_NAME = 'billing_cycle_notify'
 
 
 @shared_task
-@transaction.atomic()
 def notify_housemates():
-    for billing_cycle in BillingCycle.objects.filter(transactions_created=True, statements_sent=False):
-        billing_cycle.notify_housemates()
+    """Notify housemates of each billing cycle which has not yet had its statements sent
+
+    Each billing cycle is notified in its own transaction, under its own advisory
+    lock. Cycles currently being notified by another worker are skipped rather
+    than waited upon, so overlapping runs may process different cycles in parallel
+    without notifying anyone twice.
+
+    Returns:
+        list[int]: The primary keys of the billing cycles notified
+    """
+    billing_cycle_ids = list(
+        BillingCycle.objects
+        .filter(transactions_created=True, statements_sent=False)
+        .values_list('pk', flat=True)
+    )
+    notified = []
+    for billing_cycle_id in billing_cycle_ids:
+        try:
+            if notify_billing_cycle(billing_cycle_id):
+                notified.append(billing_cycle_id)
+        except Exception:
+            # Carry on with the other cycles. This one will be retried upon the next run.
+            logger.exception('Failed to notify housemates of billing cycle {}'.format(billing_cycle_id))
+    return notified
+
+
+@transaction.atomic()
+def notify_billing_cycle(billing_cycle_id):
+    """Notify the housemates of a single billing cycle, unless another worker is already doing so
+
+    Returns:
+        bool: True if the housemates were notified
+    """
+    if not try_advisory_xact_lock(NOTIFY_LOCK_NAME, billing_cycle_id):
+        return False
+
+    # The statements may have been sent since the cycle was listed, by a worker
+    # which has since committed and released the lock
+    billing_cycle = BillingCycle.objects.filter(pk=billing_cycle_id, statements_sent=False).first()
+    if billing_cycle is None:
+        return False
+
+    billing_cycle.notify_housemates()
+    return True
 
 
 @shared_task
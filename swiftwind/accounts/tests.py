@@ -1,7 +1,21 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest.mock import patch
 
+from django.db import connection, transaction
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from hordak.models import Account, Transaction, Leg
+from moneyed import Money
+
+from swiftwind.accounts import tasks
+from swiftwind.accounts.models import StatementSnapshot
+from swiftwind.accounts.statements import StatementRenderer, get_balances, get_payment_history, \
+    get_statement_context, get_account_names, build_statements
 from swiftwind.accounts.views import StatementEmailView
 from swiftwind.billing_cycle.models import BillingCycle
+from swiftwind.core.models import OutboxEmail
+from swiftwind.utilities.pagination import InvalidCursor
 from swiftwind.utilities.testing import DataProvider
 
 
@@ -18,3 +32,342 @@ class StatementEmailViewTestCase(DataProvider, TestCase):
         billing_cycle.refresh_from_db()
         html = StatementEmailView.get_html(uuid=housemate.uuid, date='2000-01-01')
         self.assertIn('<html>', html)
+
+
+class StatementRendererTestCase(DataProvider, TestCase):
+
+    def setUp(self):
+        self.bank = self.account(type=Account.TYPES.asset)
+        self.billing_cycle = BillingCycle.objects.create(date_range=['2000-01-01', '2000-02-01'])
+        self.billing_cycle.refresh_from_db()
+
+    def create_housemate(self):
+        housemate = self.housemate()
+        self.bank.transfer_to(housemate.account, Money(10, 'EUR'), date='2000-01-10')
+        self.bank.transfer_to(housemate.account, Money(5, 'EUR'), date='2000-03-10')
+        return housemate
+
+    def test_context_matches_view(self):
+        housemate = self.create_housemate()
+        renderer = StatementRenderer(self.billing_cycle)
+
+        request = RequestFactory().get('/foo')
+        response = StatementEmailView.as_view()(request, uuid=housemate.uuid, date='2000-01-01')
+        view_context = response.context_data
+        context = renderer.get_context(renderer.housemates[0])
+
+        self.assertEqual(context['balance'], housemate.account.balance())
+        self.assertEqual(context['other_total'], Money(10, 'EUR'))
+        for key in ('balance', 'start_date', 'end_date', 'recurring_total', 'one_off_total',
+                    'other_total', 'total', 'payment_information', 'site_root'):
+            self.assertEqual(context[key], view_context[key], key)
+
+    def test_render(self):
+        housemate = self.create_housemate()
+        html = StatementRenderer(self.billing_cycle).render(housemate)
+        self.assertIn('<html>', html)
+        self.assertIn(str(housemate.uuid), html)
+
+    def test_constant_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                renderer = StatementRenderer(self.billing_cycle)
+                for housemate in renderer.housemates:
+                    renderer.render(housemate)
+            return len(context.captured_queries)
+
+        self.create_housemate()
+        one_housemate_queries = count_queries()
+        self.create_housemate()
+        self.create_housemate()
+        self.assertEqual(count_queries(), one_housemate_queries)
+
+    def test_get_balances(self):
+        parent = self.account(type=Account.TYPES.income)
+        child = self.account(parent=parent)
+        self.bank.transfer_to(parent, Money(10, 'EUR'))
+        self.bank.transfer_to(child, Money(5, 'EUR'))
+
+        balances = get_balances([parent, child, self.bank])
+        for account in (parent, child, self.bank):
+            self.assertEqual(balances[account.pk], account.balance())
+
+
+class PaymentHistoryTestCase(DataProvider, TestCase):
+
+    def setUp(self):
+        self.bank = self.account(type=Account.TYPES.asset)
+        self.housemate_account = self.housemate().account
+        # Created out of date order, so transaction ids do not follow dates
+        self.bank.transfer_to(self.housemate_account, Money(10, 'EUR'), date='2000-01-10')
+        self.housemate_account.transfer_to(self.bank, Money(3, 'EUR'), date='2000-01-20')
+        self.bank.transfer_to(self.housemate_account, Money(5, 'EUR'), date='2000-01-05')
+
+    def test_balances(self):
+        legs = get_payment_history(self.housemate_account).object_list
+        self.assertEqual([str(leg.transaction.date) for leg in legs], ['2000-01-20', '2000-01-10', '2000-01-05'])
+        self.assertEqual(
+            [leg.balance_after for leg in legs],
+            [
+                self.housemate_account.balance(as_of='2000-01-20'),
+                self.housemate_account.balance(as_of='2000-01-10'),
+                self.housemate_account.balance(as_of='2000-01-05'),
+            ]
+        )
+        self.assertEqual(legs[0].balance_after, self.housemate_account.balance())
+
+    def test_counterpart_legs(self):
+        for leg in get_payment_history(self.housemate_account):
+            self.assertEqual([l.account for l in leg.counterpart_legs], [self.bank])
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(3):
+            for leg in get_payment_history(self.housemate_account):
+                leg.counterpart_legs[0].account.name
+
+        self.bank.transfer_to(self.housemate_account, Money(1, 'EUR'), date='2000-01-25')
+        with self.assertNumQueries(3):
+            for leg in get_payment_history(self.housemate_account):
+                leg.counterpart_legs[0].account.name
+
+    def test_pagination(self):
+        legs = get_payment_history(self.housemate_account).object_list
+
+        first_page = get_payment_history(self.housemate_account, page_size=2)
+        self.assertEqual(first_page.object_list, legs[:2])
+        self.assertTrue(first_page.has_next)
+
+        last_page = get_payment_history(self.housemate_account, cursor=first_page.next_cursor, page_size=2)
+        self.assertEqual(last_page.object_list, legs[2:])
+        self.assertFalse(last_page.has_next)
+        # Balances are unaffected by the legs on later pages being excluded
+        self.assertEqual(last_page.object_list[0].balance_after, legs[2].balance_after)
+
+    def test_given_balance(self):
+        balance = self.housemate_account.balance()
+        # No aggregate is needed for the first page
+        with self.assertNumQueries(2):
+            first_page = get_payment_history(self.housemate_account, page_size=2, balance=balance)
+        self.assertEqual(first_page.object_list[0].balance_after, balance)
+
+        # Only the legs on earlier pages are aggregated for later pages
+        with self.assertNumQueries(3):
+            last_page = get_payment_history(
+                self.housemate_account, cursor=first_page.next_cursor, page_size=2, balance=balance
+            )
+        self.assertEqual(last_page.object_list[0].balance_after, self.housemate_account.balance(as_of='2000-01-05'))
+
+    def test_invalid_cursor(self):
+        cursor = get_payment_history(self.housemate_account, page_size=1).next_cursor
+        with self.assertRaises(InvalidCursor):
+            get_payment_history(self.housemate_account, cursor=cursor + 'x')
+        with self.assertRaises(InvalidCursor):
+            get_payment_history(self.housemate_account, cursor='foo')
+
+    def test_json_view(self):
+        self.login()
+        url = reverse('accounts:account_transactions_json', args=[self.housemate_account.uuid])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result['date'] for result in data['results']], ['2000-01-20', '2000-01-10', '2000-01-05'])
+        self.assertEqual(data['results'][0]['balance'], str(self.housemate_account.balance()['EUR'].amount))
+        self.assertEqual(data['results'][0]['accounts'], [dict(uuid=str(self.bank.uuid), name=self.bank.name)])
+        self.assertIsNone(data['next'])
+
+        response = self.client.get(url, dict(cursor='foo'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_housemate_json_view(self):
+        self.login()
+        housemate = self.housemate_account.housemate
+        url = reverse('accounts:housemate_payment_history_json', args=[housemate.uuid])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_account_transactions_view(self):
+        self.login()
+        response = self.client.get(reverse('hordak:accounts_transactions', args=[self.housemate_account.uuid]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['legs']), 3)
+        self.assertEqual(response.context['next_url'], '')
+
+
+class StatementSnapshotTestCase(DataProvider, TestCase):
+
+    def setUp(self):
+        self.bank = self.account(type=Account.TYPES.asset)
+        self.housemate_ = self.housemate()
+        self.billing_cycle = BillingCycle.objects.create(date_range=['2000-01-01', '2000-02-01'])
+        self.billing_cycle.refresh_from_db()
+        self.bank.transfer_to(self.housemate_.account, Money(10, 'EUR'), date='2000-01-10', description='Rent')
+
+    def test_stored_for_past_cycle(self):
+        statement = StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.assertEqual(StatementSnapshot.objects.get().data, statement)
+        self.assertEqual(statement['other'], [dict(accounts=[self.bank.pk], description='Rent', amount=['10.00', 'EUR'])])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle), statement)
+
+    def test_account_renamed(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.bank.name = 'Renamed'
+        self.bank.save()
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+        self.assertEqual(self.get_context()['other_transactions'][0]['accounts'], ['Renamed'])
+
+    def test_navigation_dates_not_stored(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.assertIsNone(self.get_context()['next_date'])
+
+        BillingCycle.objects.create(date_range=['2000-02-01', '2000-03-01'])
+        self.assertEqual(self.get_context()['next_date'], date(2000, 2, 1))
+
+    def test_not_stored_for_current_cycle(self):
+        today = date.today()
+        billing_cycle = BillingCycle.objects.create(date_range=[today, today + timedelta(days=1)])
+        billing_cycle.refresh_from_db()
+        StatementSnapshot.objects.get_statement(self.housemate_, billing_cycle)
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+        billing_cycle.statements_sent = True
+        StatementSnapshot.objects.get_statement(self.housemate_, billing_cycle)
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+
+    def get_context(self):
+        statement = StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        return get_statement_context(statement, self.billing_cycle, get_account_names([statement]))
+
+    def run_commit_hooks(self):
+        # TestCase never commits, so on_commit() callbacks must be run manually
+        hooks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in hooks:
+            callback()
+
+    def test_invalidated_by_transaction(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.bank.transfer_to(self.housemate_.account, Money(5, 'EUR'), date='2000-01-20')
+        # Not until commit
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+        self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+        context = self.get_context()
+        self.assertEqual(context['other_total'], Money(15, 'EUR'))
+
+    def test_not_invalidated_by_other_cycle(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.bank.transfer_to(self.housemate_.account, Money(5, 'EUR'), date='2000-02-20')
+        self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+
+    def test_invalidated_by_transaction_deletion(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        Transaction.objects.get().delete()
+        self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+        statement = StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.assertEqual(statement['other'], [])
+
+    def test_invalidated_by_leg_change(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        with self.assertNumQueries(3):
+            # Loading & saving only. The transactions' dates are loaded upon commit.
+            for leg in Leg.objects.all():
+                leg.amount *= 2
+                leg.save()
+        self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+        context = self.get_context()
+        self.assertEqual(context['other_total'], Money(20, 'EUR'))
+
+    def test_invalidated_once_per_transaction(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.bank.transfer_to(self.housemate_.account, Money(5, 'EUR'), date='2000-01-20')
+        self.bank.transfer_to(self.housemate_.account, Money(5, 'EUR'), date='2000-02-20')
+        self.assertEqual(len(connection.run_on_commit), 1)
+        with self.assertNumQueries(2):
+            self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+    def test_rolled_back_changes_not_invalidated(self):
+        self.run_commit_hooks()
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.bank.transfer_to(self.housemate_.account, Money(5, 'EUR'), date='2000-01-20')
+                raise ValueError()
+        self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+
+        # Later changes are still invalidated
+        self.bank.transfer_to(self.housemate_.account, Money(5, 'EUR'), date='2000-01-20')
+        self.run_commit_hooks()
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+    def test_not_stored_if_invalidated_while_building(self):
+        def build_and_invalidate(*args):
+            built = build_statements(*args)
+            # As if the ledger were changed by another process
+            StatementSnapshot.objects.invalidate(self.billing_cycle)
+            return built
+
+        with patch('swiftwind.accounts.statements.build_statements', side_effect=build_and_invalidate):
+            StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+
+    def test_invalidated_by_unenactment(self):
+        StatementSnapshot.objects.get_statement(self.housemate_, self.billing_cycle)
+        self.billing_cycle.unenact_all_costs()
+        self.assertEqual(StatementSnapshot.objects.count(), 0)
+
+    def test_view_uses_snapshot(self):
+        self.login()
+        url = reverse('accounts:housemate_statement_historical', args=[self.housemate_.uuid, '2000-01-01'])
+        self.client.get(url)
+        self.assertEqual(StatementSnapshot.objects.count(), 1)
+        StatementSnapshot.objects.update(data=dict(
+            StatementSnapshot.objects.get().data,
+            other=[dict(accounts=[self.bank.pk], description='', amount=['1.00', 'EUR'])],
+        ))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['other_total'], Money(1, 'EUR'))
+        self.assertEqual(response.context['start_date'], date(2000, 1, 1))
+        self.assertEqual(response.context['end_date'], date(2000, 1, 31))
+
+
+class NotifyHousematesTaskTestCase(DataProvider, TestCase):
+
+    def setUp(self):
+        self.housemate(user_kwargs=dict(email='user@example.com'))
+        self.billing_cycle = BillingCycle.objects.create(
+            date_range=['2000-01-01', '2000-02-01'],
+            transactions_created=True,
+        )
+        BillingCycle.objects.create(date_range=['2000-02-01', '2000-03-01'])
+
+    def test_notify_housemates(self):
+        self.assertEqual(tasks.notify_housemates(), [self.billing_cycle.pk])
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_notify_housemates_locked(self):
+        # Another worker is notifying this cycle
+        with patch('swiftwind.accounts.tasks.try_advisory_xact_lock', return_value=False):
+            self.assertEqual(tasks.notify_housemates(), [])
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+
+    def test_notify_billing_cycle_already_sent(self):
+        BillingCycle.objects.filter(pk=self.billing_cycle.pk).update(statements_sent=True)
+        self.assertFalse(tasks.notify_billing_cycle(self.billing_cycle.pk))
+        self.assertEqual(OutboxEmail.objects.count(), 0)
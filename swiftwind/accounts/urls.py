@@ -6,6 +6,8 @@ urlpatterns = [
     url(r'^$', views.OverviewView.as_view(), name='overview'),
     url(r'^housemate/(?P<uuid>[^/]*)/$', views.HousemateStatementView.as_view(), name='housemate_statement'),
     url(r'^housemate/(?P<uuid>.*)/(?P<date>\d{4}-\d{2}-\d{2})/$', views.HousemateStatementView.as_view(), name='housemate_statement_historical'),
+    url(r'^housemate/(?P<uuid>[^/]*)/payment-history\.json$', views.HousematePaymentHistoryJsonView.as_view(), name='housemate_payment_history_json'),
+    url(r'^account/(?P<uuid>[^/]*)/transactions\.json$', views.PaymentHistoryJsonView.as_view(), name='account_transactions_json'),
     url(r'^email/statement/(?P<uuid>.*)/(?P<date>\d{4}-\d{2}-\d{2})/$', views.StatementEmailView.as_view(), name='housemate_statement_email'),
     url(r'^email/reminder/$', views.ReconciliationRequiredEmailView.as_view(), name='housemate_reconciliation_required_email'),
 ]
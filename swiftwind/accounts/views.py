@@ -1,20 +1,25 @@
 import datetime
-from datetime import timedelta
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.sites.models import Site
 from django.db import models
 from django.db.models import Q, Sum, When, Case, Value, Subquery, OuterRef, Exists
 from django.db.models.functions import Cast
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.test import RequestFactory
 from django.urls.base import reverse
+from django.utils.http import urlencode
 from django.views import View
 from django.views.generic.base import TemplateView
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
 from djmoney.models.fields import MoneyField
 
-from hordak.models.core import Account, Transaction, Leg
+from hordak import views as hordak_views
+from hordak.models.core import Account, Transaction
+from swiftwind.accounts.models import StatementSnapshot
+from swiftwind.accounts.statements import get_account_names, get_payment_history, get_statement_context
 from swiftwind.billing_cycle.models import BillingCycle
 from swiftwind.settings.models import Settings
 from swiftwind.costs.models import RecurringCostSplit
@@ -72,6 +77,26 @@ class OverviewView(LoginRequiredMixin, ListView):
             .select_related('housemate')
 
 
+def get_next_page_url(request, page):
+    """Get the URL of the page of legs following the given LegPage, or an empty string"""
+    if not page.has_next:
+        return ''
+    return '{}?{}'.format(request.path, urlencode(dict(cursor=page.next_cursor)))
+
+
+def serialize_leg(leg):
+    """Serialize a leg returned by get_payment_history() for use in a JSON response"""
+    return dict(
+        uuid=str(leg.uuid),
+        date=str(leg.transaction.date),
+        description=leg.transaction.description,
+        accounts=[dict(uuid=str(l.account.uuid), name=l.account.name) for l in leg.counterpart_legs],
+        amount=str(leg.amount.amount),
+        currency=leg.amount_currency,
+        balance=str(leg.balance_after[leg.amount_currency].amount),
+    )
+
+
 class AbstractHousemateStatementView(DetailView):
     template_name = 'accounts/housemate_statement.html'
     slug_url_kwarg = 'uuid'
@@ -87,57 +112,41 @@ class AbstractHousemateStatementView(DetailView):
             date=datetime.date(*map(int, date.split('-'))) if date else datetime.date.today()
         )
 
-        legs = Leg.objects.filter(
-            transaction__recurred_cost__billing_cycle=billing_cycle,
-            account=housemate.account,
-        ).order_by('-transaction__date', '-pk').select_related(
-            'transaction',
-            'transaction__recurred_cost__recurring_cost__to_account',
+        # Served from a stored snapshot where possible
+        statement = StatementSnapshot.objects.get_statement(housemate, billing_cycle)
+        statement = get_statement_context(statement, billing_cycle, get_account_names([statement]))
+        # Housemate accounts have no child accounts, so the balance can be shared
+        balance = housemate.account.balance()
+        payment_history = get_payment_history(
+            housemate.account, cursor=self.request.GET.get('cursor'), balance=balance
         )
-        recurring_legs = [l for l in legs if not l.transaction.recurred_cost.recurring_cost.is_one_off()]
-        one_off_legs = [l for l in legs if l.transaction.recurred_cost.recurring_cost.is_one_off()]
-        other_legs = Leg.objects.filter(
-            transaction__date__gte=billing_cycle.date_range.lower,
-            transaction__date__lt=billing_cycle.date_range.upper,
-            account=housemate.account,
-        ).exclude(
-            pk__in=[l.pk for l in legs]
-        ).order_by('-transaction__date', '-pk').select_related('transaction')
-
-        recurring_total = sum(l.amount for l in recurring_legs)
-        one_off_total = sum(l.amount for l in one_off_legs)
 
         # Previous & next URLs
         # Not a pretty way to generate URLs, but parsing the date to reverse the
         # historical URL would be pretty onerous.
-        previous = billing_cycle.get_previous()
-        next = billing_cycle.get_next()
+        previous_date = statement.pop('previous_date')
+        next_date = statement.pop('next_date')
 
-        if previous:
-            previous_url = '{}{}/'.format(reverse('accounts:housemate_statement', args=[housemate.uuid]), str(previous.start_date))
+        if previous_date:
+            previous_url = '{}{}/'.format(reverse('accounts:housemate_statement', args=[housemate.uuid]), str(previous_date))
         else:
             previous_url = ''
 
-        if next and next.start_date <= datetime.date.today():
-            next_url = '{}{}/'.format(reverse('accounts:housemate_statement', args=[housemate.uuid]), str(next.start_date))
+        if next_date and next_date <= datetime.date.today():
+            next_url = '{}{}/'.format(reverse('accounts:housemate_statement', args=[housemate.uuid]), str(next_date))
         else:
             next_url = ''
 
+        context = dict(statement, **kwargs)
         return super().get_context_data(
             billing_cycle=billing_cycle,
-            start_date=billing_cycle.date_range.lower,
-            end_date=billing_cycle.date_range.upper - timedelta(days=1),
-            recurring_legs=recurring_legs,
-            one_off_legs=one_off_legs,
-            other_legs=other_legs,
-            recurring_total=recurring_total,
-            one_off_total=one_off_total,
-            total=recurring_total + one_off_total,
-            payment_history=housemate.account.legs.all().order_by('-transaction__date', '-transaction__pk'),
+            balance=balance,
+            payment_history=payment_history,
+            payment_history_next_url=get_next_page_url(self.request, payment_history),
             payment_information=Settings.objects.get().payment_information,
             next_url=next_url,
             previous_url=previous_url,
-            **kwargs
+            **context
         )
 
 
@@ -151,3 +160,43 @@ class StatementEmailView(EmailViewMixin, AbstractHousemateStatementView):
 
 class ReconciliationRequiredEmailView(EmailViewMixin, TemplateView):
     template_name = 'accounts/reconciliation_required_email.html'
+
+
+class AccountTransactionsView(LoginRequiredMixin, hordak_views.AccountTransactionsView):
+    """Hordak's account transactions view, paginated by cursor"""
+
+    def get_queryset(self):
+        self.page = get_payment_history(self.object, cursor=self.request.GET.get('cursor'))
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        return super(AccountTransactionsView, self).get_context_data(
+            next_url=get_next_page_url(self.request, self.page),
+            **kwargs
+        )
+
+
+class PaymentHistoryJsonView(LoginRequiredMixin, View):
+    """Get a page of an account's legs as JSON
+
+    The account is given by the ``uuid`` URL kwarg. The response contains the legs
+    as ``results``, and the URL of the following page as ``next`` (which will be null
+    upon the last page).
+    """
+
+    def get_account(self):
+        return get_object_or_404(Account, uuid=self.kwargs['uuid'])
+
+    def get(self, request, *args, **kwargs):
+        page = get_payment_history(self.get_account(), cursor=request.GET.get('cursor'))
+        return JsonResponse(dict(
+            results=[serialize_leg(leg) for leg in page],
+            next=get_next_page_url(request, page) or None,
+        ))
+
+
+class HousematePaymentHistoryJsonView(PaymentHistoryJsonView):
+    """As PaymentHistoryJsonView, but the ``uuid`` URL kwarg is that of a housemate"""
+
+    def get_account(self):
+        return get_object_or_404(Housemate.objects.select_related('account'), uuid=self.kwargs['uuid']).account
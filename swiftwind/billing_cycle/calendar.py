@@ -0,0 +1,163 @@
+"""An in-process cache of all billing cycles
+
+Billing cycles rarely change, yet are looked up many times per request. The
+calendar holds every billing cycle in date order, allowing lookups by date
+and next/previous lookups to be done in memory using bisection.
+
+Each process keeps its own copy of the calendar. Staleness is detected using
+a version number held in the database, which is changed by a trigger whenever
+billing cycles are created, deleted or changed (including by ``QuerySet.update()``).
+See migrations 0009 & 0010.
+
+Checking the version costs a query, so within a :func:`checked_once` block
+(such as every request) it is only checked upon the first lookup. Changes made
+through BillingCycle.save(), delete() and populate() call :func:`invalidate`,
+so are seen immediately by the process making them. Outside of such a block
+the version is checked upon every lookup.
+"""
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from copy import copy
+
+from django.core.signals import request_started, request_finished
+from django.db import connection
+from django.dispatch import receiver
+
+_calendar = None
+
+# Per-thread state of checked_once()
+_local = threading.local()
+
+
+def get_version():
+    """Get the current version of the billing cycles, as maintained by the database
+
+    The version is taken from a sequence, so is never reused, even should the
+    transaction which changed it be rolled back.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT version FROM billing_cycle_calendarversion')
+        return cursor.fetchone()[0]
+
+
+def invalidate():
+    """Discard this process' calendar, forcing it to be reloaded upon next use
+
+    Only needed for changes to be seen within the current checked_once() block.
+    Other processes will notice the changed version once committed.
+    """
+    global _calendar
+    _calendar = None
+
+
+def _begin_check_once():
+    _local.checking_once = True
+    _local.checked = False
+
+
+def _end_check_once():
+    _local.checking_once = False
+
+
+@contextmanager
+def checked_once():
+    """Check the calendar's version at most once within this block
+
+    Used for every request, and may be used by long running tasks which
+    look up many billing cycles. Changes made by other processes during
+    the block will not be seen.
+    """
+    if getattr(_local, 'checking_once', False):
+        # Within an enclosing checked_once()
+        yield
+        return
+
+    _begin_check_once()
+    try:
+        yield
+    finally:
+        _end_check_once()
+
+
+@receiver(request_started)
+def _request_started(sender, **kwargs):
+    _begin_check_once()
+
+
+@receiver(request_finished)
+def _request_finished(sender, **kwargs):
+    _end_check_once()
+
+
+def get_calendar():
+    """Get the current calendar, reloading it if it is stale
+
+    Returns:
+        Calendar
+    """
+    global _calendar
+    calendar = _calendar
+    if calendar is not None and getattr(_local, 'checking_once', False) and _local.checked:
+        return calendar
+
+    version = get_version()
+    if calendar is None or calendar.version != version:
+        calendar = _calendar = Calendar.load(version)
+    _local.checked = True
+    return calendar
+
+
+class Calendar(object):
+    """All billing cycles in date order
+
+    Lookups return copies of the cached billing cycles, so they may be
+    modified by the caller without affecting the calendar.
+
+    Args:
+        billing_cycles (list[BillingCycle]): All billing cycles, in date order
+        version (int): The version number the calendar was loaded at
+    """
+
+    def __init__(self, billing_cycles, version=None):
+        self.billing_cycles = billing_cycles
+        self.version = version
+        self.start_dates = [billing_cycle.date_range.lower for billing_cycle in billing_cycles]
+        self.positions = {billing_cycle.pk: i for i, billing_cycle in enumerate(billing_cycles)}
+
+    @classmethod
+    def load(cls, version=None):
+        from .models import BillingCycle
+        return cls(list(BillingCycle.objects.order_by('date_range')), version)
+
+    def _get(self, position):
+        if not 0 <= position < len(self.billing_cycles):
+            return None
+        billing_cycle = copy(self.billing_cycles[position])
+        billing_cycle._state = copy(billing_cycle._state)
+        return billing_cycle
+
+    def as_of(self, date):
+        """Get the billing cycle containing the given date
+
+        Returns:
+            BillingCycle: The billing cycle, or None if no cycle contains the date
+        """
+        position = bisect_right(self.start_dates, date) - 1
+        if position < 0 or date >= self.billing_cycles[position].date_range.upper:
+            return None
+        return self._get(position)
+
+    def get_next(self, billing_cycle):
+        """Get the billing cycle after the given cycle. May return None"""
+        position = self.positions.get(billing_cycle.pk)
+        if position is None:
+            return None
+        return self._get(position + 1)
+
+    def get_previous(self, billing_cycle):
+        """Get the billing cycle prior to the given cycle. May return None"""
+        position = self.positions.get(billing_cycle.pk)
+        if position is None:
+            return None
+        return self._get(position - 1)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing_cycle', '0006_billingcycle_statements_sent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingcycle',
+            name='sequence',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE billing_cycle_billingcycle AS cycle
+            SET sequence = numbered.sequence
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY date_range) AS sequence FROM billing_cycle_billingcycle
+            ) AS numbered
+            WHERE cycle.id = numbered.id
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing_cycle', '0007_billingcycle_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingcycle',
+            name='statements_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
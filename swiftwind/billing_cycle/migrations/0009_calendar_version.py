@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 13:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# The version used to detect stale billing cycle calendars (see swiftwind.billing_cycle.calendar).
+# It is bumped by triggers so that all changes are caught, including those made by QuerySet.update().
+# Updates which only change a cycle's state (e.g. transactions_created) are ignored, as the calendar
+# does not hold this state. Versions are taken from a sequence so they are never reused, even
+# should the transaction which took one be rolled back.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing_cycle', '0008_billingcycle_statements_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE SEQUENCE billing_cycle_calendarversion_seq;
+            CREATE TABLE billing_cycle_calendarversion (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version BIGINT NOT NULL
+            );
+            INSERT INTO billing_cycle_calendarversion (id, version)
+                VALUES (1, nextval('billing_cycle_calendarversion_seq'));
+            """,
+            """
+            DROP TABLE billing_cycle_calendarversion;
+            DROP SEQUENCE billing_cycle_calendarversion_seq;
+            """
+        ),
+        migrations.RunSQL(
+            """
+            CREATE OR REPLACE FUNCTION bump_billing_cycle_calendar_version()
+              RETURNS trigger AS
+            $$
+            BEGIN
+              UPDATE billing_cycle_calendarversion SET version = nextval('billing_cycle_calendarversion_seq');
+              RETURN NULL;
+            END;
+            $$
+            LANGUAGE plpgsql
+            """,
+            "DROP FUNCTION bump_billing_cycle_calendar_version()"
+        ),
+        migrations.RunSQL(
+            """
+            CREATE TRIGGER bump_billing_cycle_calendar_version_trigger
+            AFTER INSERT OR DELETE OR TRUNCATE ON billing_cycle_billingcycle
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_billing_cycle_calendar_version()
+            """,
+            "DROP TRIGGER bump_billing_cycle_calendar_version_trigger ON billing_cycle_billingcycle"
+        ),
+        migrations.RunSQL(
+            """
+            CREATE TRIGGER bump_billing_cycle_calendar_version_update_trigger
+            AFTER UPDATE ON billing_cycle_billingcycle
+            FOR EACH ROW
+            WHEN (
+              OLD.uuid IS DISTINCT FROM NEW.uuid OR
+              OLD.date_range IS DISTINCT FROM NEW.date_range OR
+              OLD.sequence IS DISTINCT FROM NEW.sequence
+            )
+            EXECUTE PROCEDURE bump_billing_cycle_calendar_version()
+            """,
+            "DROP TRIGGER bump_billing_cycle_calendar_version_update_trigger ON billing_cycle_billingcycle"
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The calendar now holds each cycle's state as well as its dates, so changes
+# to the state must also change the calendar version
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing_cycle', '0009_calendar_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            DROP TRIGGER bump_billing_cycle_calendar_version_update_trigger ON billing_cycle_billingcycle;
+            CREATE TRIGGER bump_billing_cycle_calendar_version_update_trigger
+            AFTER UPDATE ON billing_cycle_billingcycle
+            FOR EACH ROW
+            WHEN (
+              OLD.uuid IS DISTINCT FROM NEW.uuid OR
+              OLD.date_range IS DISTINCT FROM NEW.date_range OR
+              OLD.sequence IS DISTINCT FROM NEW.sequence OR
+              OLD.transactions_created IS DISTINCT FROM NEW.transactions_created OR
+              OLD.statements_sent IS DISTINCT FROM NEW.statements_sent
+            )
+            EXECUTE PROCEDURE bump_billing_cycle_calendar_version()
+            """,
+            """
+            DROP TRIGGER bump_billing_cycle_calendar_version_update_trigger ON billing_cycle_billingcycle;
+            CREATE TRIGGER bump_billing_cycle_calendar_version_update_trigger
+            AFTER UPDATE ON billing_cycle_billingcycle
+            FOR EACH ROW
+            WHEN (
+              OLD.uuid IS DISTINCT FROM NEW.uuid OR
+              OLD.date_range IS DISTINCT FROM NEW.date_range OR
+              OLD.sequence IS DISTINCT FROM NEW.sequence
+            )
+            EXECUTE PROCEDURE bump_billing_cycle_calendar_version()
+            """
+        ),
+    ]
@@ -1,28 +1,114 @@
+from bisect import bisect_left
+
 from dateutil.relativedelta import relativedelta
 from django.contrib.postgres.fields import DateRangeField
-from django.core.mail import send_mail
-from django.db import models, transaction
+from django.core.mail import EmailMultiAlternatives
+from django.db import models, transaction, connection
 from django.db import transaction as db_transaction
 from django.db.models.functions import Lower, Upper
 from django.urls.base import reverse
-from django.utils import formats
+from django.utils import formats, timezone
 from django.utils.datetime_safe import datetime, date
 from django_smalluuid.models import uuid_default, SmallUUIDField
 from django.conf import settings
 from pytz import UTC
 
 from hordak.models import Transaction
+from swiftwind.accounts.models import StatementSnapshot
 from swiftwind.billing_cycle.exceptions import CannotPopulateForDateOutsideExistingCycles
 from swiftwind.costs.exceptions import CannotEnactUnenactableRecurringCostError, \
     RecurringCostAlreadyEnactedForBillingCycle
+from swiftwind.core.models import OutboxEmail
 from swiftwind.settings.models import Settings
 from swiftwind.housemates.models import Housemate
+from swiftwind.utilities.locks import advisory_xact_lock
 from swiftwind.utilities.site import get_site_root
 
+from . import calendar
+from .calendar import get_calendar
 from .cycles import get_billing_cycle
 
 
-class BillingCycleManager(models.Manager):
+def _reconciliation_since(billing_cycle):
+    # A statement import must have been done since the start of the billing cycle
+    start_date = billing_cycle.date_range.lower
+    return datetime(start_date.year, start_date.month, start_date.day, tzinfo=UTC)
+
+
+def load_reconciliation_state(billing_cycles):
+    """Calculate the reconciliation state of many billing cycles using two queries
+
+    Sets the values returned by is_reconciled() and can_create_transactions() (and
+    therefore can_send_statements()) upon each billing cycle, so they do not need to
+    query the database. Used by BillingCycleQuerySet.with_reconciliation().
+
+    Args:
+        billing_cycles (list[BillingCycle]):
+    """
+    from hordak.models import StatementImport, StatementLine
+
+    if not billing_cycles:
+        return
+
+    calendar = get_calendar()
+    previous_cycles = {billing_cycle.pk: calendar.get_previous(billing_cycle) for billing_cycle in billing_cycles}
+    all_cycles = list(billing_cycles) + [cycle for cycle in previous_cycles.values() if cycle]
+
+    latest_import = StatementImport.objects.aggregate(latest=models.Max('timestamp'))['latest']
+    unreconciled_dates = sorted(
+        StatementLine.objects
+        .filter(
+            transaction__isnull=True,
+            date__gte=min(cycle.date_range.lower for cycle in all_cycles),
+            date__lt=max(cycle.date_range.upper for cycle in all_cycles),
+        )
+        .order_by()
+        .values_list('date', flat=True)
+        .distinct()
+    )
+
+    def is_reconciled(billing_cycle):
+        # Mirrors BillingCycle.is_reconciled()
+        if latest_import is None or latest_import < _reconciliation_since(billing_cycle):
+            return False
+        i = bisect_left(unreconciled_dates, billing_cycle.date_range.lower)
+        return i == len(unreconciled_dates) or unreconciled_dates[i] >= billing_cycle.date_range.upper
+
+    for billing_cycle in billing_cycles:
+        previous = previous_cycles[billing_cycle.pk]
+        billing_cycle._is_reconciled = is_reconciled(billing_cycle)
+        billing_cycle._can_create_transactions = not previous or is_reconciled(previous)
+
+
+class BillingCycleQuerySet(models.QuerySet):
+
+    def __init__(self, *args, **kwargs):
+        super(BillingCycleQuerySet, self).__init__(*args, **kwargs)
+        self._with_reconciliation = False
+
+    def _clone(self, **kwargs):
+        clone = super(BillingCycleQuerySet, self)._clone(**kwargs)
+        clone._with_reconciliation = self._with_reconciliation
+        return clone
+
+    def _fetch_all(self):
+        load = self._result_cache is None and self._with_reconciliation
+        super(BillingCycleQuerySet, self)._fetch_all()
+        if load:
+            load_reconciliation_state(self._result_cache)
+
+    def with_reconciliation(self):
+        """Load the reconciliation state of the billing cycles in constant queries
+
+        Similar to prefetch_related(), this is done upon evaluation of the queryset.
+        See load_reconciliation_state().
+        """
+        clone = self._clone()
+        clone._with_reconciliation = True
+        return clone
+
+
+class BillingCycleManager(models.Manager.from_queryset(BillingCycleQuerySet)):
 
     def get_queryset(self):
         queryset = super(BillingCycleManager, self).get_queryset()
@@ -42,7 +128,70 @@ class BillingCycleManager(models.Manager):
         )
 
     def as_of(self, date):
-        return self.get(start_date__lte=date, end_date__gt=date)
+        """Get the billing cycle containing `date`, using the in-memory calendar
+
+        Raises:
+            BillingCycle.DoesNotExist: No billing cycle contains the date
+        """
+        billing_cycle = get_calendar().as_of(date)
+        if billing_cycle is None:
+            raise self.model.DoesNotExist('No billing cycle exists for {}'.format(date))
+        return billing_cycle
+
+    def insert_date_ranges(self, date_ranges, first_sequence):
+        """Create billing cycles for the given date ranges using a single INSERT
+
+        Date ranges which overlap an existing billing cycle are skipped (courtesy of
+        the non-overlapping exclusion constraint) rather than raising an error.
+
+        Args:
+            date_ranges (list[(date, date)]): The start & end date of each billing cycle, in date order
+            first_sequence (int): The sequence number of the first new cycle
+
+        Returns:
+            int: The number of billing cycles created
+        """
+        if not date_ranges:
+            return 0
+
+        uuid_field = self.model._meta.get_field('uuid')
+        rows = []
+        params = []
+        for sequence, (start_date, end_date) in enumerate(date_ranges, start=first_sequence):
+            rows.append('(%s, daterange(%s, %s), false, false, %s)')
+            params.extend([
+                uuid_field.get_db_prep_value(uuid_field.get_default(), connection),
+                start_date,
+                end_date,
+                sequence,
+            ])
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO {table} (uuid, date_range, transactions_created, statements_sent, sequence)
+                VALUES {rows}
+                ON CONFLICT DO NOTHING
+            """.format(
+                table=self.model._meta.db_table,
+                rows=', '.join(rows),
+            ), params)
+            return cursor.rowcount
+
+    def renumber(self):
+        """Set the sequence number of every billing cycle according to date order
+
+        Only rows with an incorrect sequence number will be updated.
+        """
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE {table} AS cycle
+                SET sequence = numbered.sequence
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY date_range) AS sequence FROM {table}
+                ) AS numbered
+                WHERE cycle.id = numbered.id AND cycle.sequence IS DISTINCT FROM numbered.sequence
+            """.format(table=table))
 
 
 class BillingCycle(models.Model):
@@ -62,6 +211,14 @@ class BillingCycle(models.Model):
         default=False,
         help_text='Have we sent housemates their statements for this billing cycle?'
     )
+    #: The 1-indexed position of this billing cycle when ordered by date. As billing
+    #: cycles are always adjacent this allows next/previous cycles to be found, and
+    #: cycles to be counted, using simple indexed lookups. Maintained by _populate() and save().
+    sequence = models.PositiveIntegerField(null=True, editable=False, db_index=True)
+    #: Incremented whenever this cycle's statement snapshots are invalidated, so that
+    #: statements built from a since-changed ledger are not stored. Updated in-database
+    #: only, see StatementSnapshotQuerySet.
+    statements_version = models.PositiveIntegerField(default=0, editable=False)
 
     objects = BillingCycleManager()
 
@@ -74,6 +231,29 @@ class BillingCycle(models.Model):
     def __repr__(self):
         return 'BillingCycle <{}>'.format(self.date_range)
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        renumber = self.sequence is None
+        if update_fields is None and not force_insert and not self._state.adding and self.pk is not None:
+            # Don't overwrite statements_version with a potentially stale value
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'statements_version'
+            ]
+        super(BillingCycle, self).save(
+            force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields
+        )
+        if renumber:
+            # Billing cycle created outside of _populate(), so we don't
+            # know where it sits relative to the other cycles
+            BillingCycle.objects.renumber()
+            self.sequence = BillingCycle.objects.filter(pk=self.pk).values_list('sequence', flat=True).get()
+        calendar.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super(BillingCycle, self).delete(*args, **kwargs)
+        calendar.invalidate()
+        return result
+
     @classmethod
     def populate(cls, as_of=None):
         """Ensure the next X years of billing cycles exist
@@ -92,76 +272,82 @@ class BillingCycle(models.Model):
     def _populate(cls, as_of=None, delete=False):
         """Populate the table with billing cycles starting from `as_of`
 
+        All date ranges are generated up-front and inserted using a single query.
+        Concurrent calls are serialised using an advisory lock, and any cycles which
+        nonetheless already exist are skipped.
+
         Args:
             as_of (date): The date at which to begin the populating
             delete (bool): Should future billing cycles be deleted?
-
-
         """
         billing_cycle_helper = get_billing_cycle()
-        billing_cycles_exist = BillingCycle.objects.exists()
 
-        try:
-            current_billing_cycle = BillingCycle.objects.as_of(date=as_of)
-        except BillingCycle.DoesNotExist:
-            current_billing_cycle = None
+        with db_transaction.atomic():
+            advisory_xact_lock('billing_cycle_populate')
 
-        # If no cycles exist then disable the deletion logic
-        if not billing_cycles_exist:
-            delete = False
+            billing_cycles_exist = cls.objects.exists()
 
-        # Cycles exist, but a date has been specified outside of them
-        if billing_cycles_exist and not current_billing_cycle:
-            raise CannotPopulateForDateOutsideExistingCycles()
+            # Bypass the calendar, as we need to see any cycles just created elsewhere
+            current_billing_cycle = cls.objects.filter(start_date__lte=as_of, end_date__gt=as_of).first()
 
-        # Omit the current billing cycle if we are deleting (as
-        # deleting the current billing cycle will be a Bad Idea)
-        omit_current = (current_billing_cycle and delete)
+            # If no cycles exist then disable the deletion logic
+            if not billing_cycles_exist:
+                delete = False
 
-        stop_date = as_of + relativedelta(years=settings.SWIFTWIND_BILLING_CYCLE_YEARS)
-        date_ranges = billing_cycle_helper.generate_date_ranges(as_of, stop_date=stop_date, omit_current=omit_current)
-        date_ranges = list(date_ranges)
+            # Cycles exist, but a date has been specified outside of them
+            if billing_cycles_exist and not current_billing_cycle:
+                raise CannotPopulateForDateOutsideExistingCycles()
 
-        beginning_date = date_ranges[0][0]
+            # Omit the current billing cycle if we are deleting (as
+            # deleting the current billing cycle will be a Bad Idea)
+            omit_current = (current_billing_cycle and delete)
 
-        with db_transaction.atomic():
+            stop_date = as_of + relativedelta(years=settings.SWIFTWIND_BILLING_CYCLE_YEARS)
+            date_ranges = billing_cycle_helper.generate_date_ranges(
+                as_of, stop_date=stop_date, omit_current=omit_current
+            )
+            date_ranges = list(date_ranges)
+
+            beginning_date = date_ranges[0][0]
 
             if delete:
                 # Delete all the future unused transactions
                 cls.objects.filter(start_date__gte=beginning_date).delete()
 
-            for start_date, end_date in date_ranges:
-                exists = BillingCycle.objects.filter(date_range=(start_date, end_date)).exists()
-                if exists:
-                    if delete:
-                        raise Exception(
-                            'It should not be possible to get here as future billing cycles have just been deleted'
-                        )
-                    else:
-                        # We're updating, so we can just ignore cycles that already exist
-                        pass
-                else:
-                    BillingCycle.objects.create(
-                        date_range=(start_date, end_date),
-                    )
+            # We're updating, so we can just ignore cycles that already exist
+            existing = {
+                (date_range.lower, date_range.upper)
+                for date_range
+                in cls.objects.filter(
+                    date_range__overlap=(beginning_date, date_ranges[-1][1])
+                ).values_list('date_range', flat=True)
+            }
+            date_ranges = [date_range for date_range in date_ranges if tuple(date_range) not in existing]
+
+            last_sequence = cls.objects.aggregate(last_sequence=models.Max('sequence'))['last_sequence'] or 0
+            cls.objects.insert_date_ranges(date_ranges, first_sequence=last_sequence + 1)
+
+            # New cycles are normally appended to the end of the existing cycles, in which case
+            # the above numbering will already be correct and this will be a no-op
+            cls.objects.renumber()
+            calendar.invalidate()
 
     def get_next(self):
         """Get the billing cycle after this one. May return None"""
-        return BillingCycle.objects.filter(date_range__gt=self.date_range).order_by('date_range').first()
+        return get_calendar().get_next(self)
 
     def get_previous(self):
         """Get the billing cycle prior to this one. May return None"""
-        return BillingCycle.objects.filter(date_range__lt=self.date_range).order_by('date_range').last()
+        return get_calendar().get_previous(self)
 
     def is_reconciled(self):
         """Have transactions been imported and reconciled for this billing cycle?"""
         from hordak.models import StatementImport, StatementLine
-        since = datetime(
-            self.date_range.lower.year,
-            self.date_range.lower.month,
-            self.date_range.lower.day,
-            tzinfo=UTC
-        )
+        if hasattr(self, '_is_reconciled'):
+            # Loaded by BillingCycleQuerySet.with_reconciliation()
+            return self._is_reconciled
+
+        since = _reconciliation_since(self)
         if not StatementImport.objects.filter(timestamp__gte=since).exists():
             # No import done since the end of the above billing cycle, and reconciliation
             # requires an import. Therefore reconciliation can not have been done
@@ -188,21 +374,41 @@ class BillingCycle(models.Model):
         else:
             self.send_reconciliation_required()
 
+    @transaction.atomic()
     def send_reconciliation_required(self):
-        from swiftwind.accounts.views import ReconciliationRequiredEmailView
-
-        for housemate in Housemate.objects.filter(user__is_active=True):
-            html = ReconciliationRequiredEmailView.get_html()
-            send_mail(
-                subject='Reconciliation required'.format(),
-                message='See {}{}'.format(
-                    get_site_root(),
-                    reverse('accounts:housemate_reconciliation_required_email')
-                ),
-                from_email=Settings.objects.get().email_from_address,
-                recipient_list=[housemate.user.email],
-                html_message=html,
+        """Tell housemates that reconciliation is required before statements can be sent
+
+        The emails are added to the outbox, to be sent by swiftwind.core.outbox. At most
+        one email will be sent to each housemate per billing cycle per day.
+
+        Returns:
+            list[OutboxEmail]: The newly enqueued emails
+        """
+        from swiftwind.accounts.statements import render_reconciliation_required_email
+
+        # The email is the same for every housemate, so only render it once
+        html = render_reconciliation_required_email()
+        message = 'See {}{}'.format(
+            get_site_root(),
+            reverse('accounts:housemate_reconciliation_required_email')
+        )
+        from_email = Settings.objects.get().email_from_address
+
+        enqueued = []
+        for housemate in Housemate.objects.filter(user__is_active=True).select_related('user'):
+            email = EmailMultiAlternatives(
+                subject='Reconciliation required',
+                body=message,
+                from_email=from_email,
+                to=[housemate.user.email],
             )
+            email.attach_alternative(html, 'text/html')
+            idempotency_key = 'reconciliation_required:{}:{}:{}'.format(self.uuid, housemate.uuid, date.today())
+            outbox_email, created = OutboxEmail.objects.enqueue(idempotency_key, email)
+            if created:
+                enqueued.append(outbox_email)
+
+        return enqueued
 
     def can_create_transactions(self):
         """Can we create the transactions
@@ -210,6 +416,10 @@ class BillingCycle(models.Model):
         We can only do this if the previous cycle has been reconciled,
         as some costs may depend upon it to calculate their amounts.
         """
+        if hasattr(self, '_can_create_transactions'):
+            # Loaded by BillingCycleQuerySet.with_reconciliation()
+            return self._can_create_transactions
+
         previous = self.get_previous()
         return not previous or previous.is_reconciled()
 
@@ -218,89 +428,183 @@ class BillingCycle(models.Model):
 
     @transaction.atomic()
     def send_statements(self, force=False):
-        from swiftwind.accounts.views import StatementEmailView
+        """Send each housemate their statement for this billing cycle
+
+        The emails are added to the outbox, to be sent by swiftwind.core.outbox, and
+        the billing cycle is marked as having had its statements sent.
+
+        Args:
+            force (bool): Send the statements again, even if they have already been sent
+
+        Returns:
+            list[OutboxEmail]: The newly enqueued emails, or False if statements
+            should not be sent for this billing cycle
+        """
+        from swiftwind.accounts.statements import StatementRenderer
 
         should_send = force or (not self.statements_sent and self.transactions_created)
         if not should_send:
             return False
 
-        for housemate in Housemate.objects.filter(user__is_active=True):
-            html = StatementEmailView.get_html(
-                uuid=housemate.uuid,
-                date=str(self.date_range.lower)
-            )
-            send_mail(
+        # Set first, so the statements being sent are stored as snapshots
+        self.statements_sent = True
+        self.save(update_fields=['statements_sent'])
+
+        renderer = StatementRenderer(self)
+        from_email = Settings.objects.get().email_from_address
+        # Forced sends are deliberate resends, so should not be deduplicated against earlier sends
+        resend = timezone.now().isoformat() if force else 'initial'
+
+        enqueued = []
+        for housemate in renderer.housemates:
+            html = renderer.render(housemate)
+            email = EmailMultiAlternatives(
                 subject='{}, your house statement for {}'.format(
                     housemate.user.first_name or housemate.user.username,
                     # TODO: Assumes monthly billing cycles
                     self.date_range.lower.strftime('%B %Y'),
                 ),
-                message='See {}{}'.format(
-                    get_site_root(),
+                body='See {}{}'.format(
+                    renderer.site_root,
                     reverse('accounts:housemate_statement_email',
                             args=[housemate.uuid, str(self.date_range.lower)]
                             )
                 ),
-                from_email=Settings.objects.get().email_from_address,
-                recipient_list=[housemate.user.email],
-                html_message=html,
+                from_email=from_email,
+                to=[housemate.user.email],
             )
+            email.attach_alternative(html, 'text/html')
+            idempotency_key = 'statement:{}:{}:{}'.format(self.uuid, housemate.uuid, resend)
+            outbox_email, created = OutboxEmail.objects.enqueue(idempotency_key, email)
+            if created:
+                enqueued.append(outbox_email)
 
-    def enact_all_costs(self):
-        from swiftwind.costs.models import RecurringCost
-
-        with transaction.atomic():
-            for recurring_cost in RecurringCost.objects.all():
-                try:
-                    recurring_cost.enact(self)
-                except (CannotEnactUnenactableRecurringCostError, RecurringCostAlreadyEnactedForBillingCycle):
-                    pass
+        return enqueued
 
-            self.transactions_created = True
-            self.save()
+    def enact_all_costs(self, batch=True):
+        """Enact all recurring costs for this billing cycle
 
-        for recurring_cost in RecurringCost.objects.all():
-            recurring_cost.disable_if_done()
+        Args:
+            batch (bool): Use the BatchEnactor to enact all costs using a constant number
+                          of queries. If False, each cost will be enacted individually
+                          using RecurringCost.enact().
+        """
+        from swiftwind.costs.models import RecurringCost, SplitPlanCache, EnactmentRun, EnactmentRunCost
+        from swiftwind.costs.enactment import BatchEnactor
+        from swiftwind.costs.instrumentation import EnactmentRecorder
+
+        mode = EnactmentRun.MODES.batch if batch else EnactmentRun.MODES.per_cost
+        with EnactmentRecorder(self, mode) as recorder:
+            with transaction.atomic():
+                if batch:
+                    enactor = BatchEnactor(self)
+                    planned = enactor.plan()
+                    enactor.write(planned)
+                    recorder.record_batch(enactor, planned)
+                else:
+                    recurring_costs = list(
+                        RecurringCost.objects.select_related('to_account', 'initial_billing_cycle').order_by('pk')
+                    )
+                    split_plans = SplitPlanCache(recurring_costs)
+                    for recurring_cost in recurring_costs:
+                        with recorder.time_cost(recurring_cost) as cost_record:
+                            try:
+                                recurring_cost.enact(self, split_plans=split_plans)
+                            except CannotEnactUnenactableRecurringCostError:
+                                cost_record.skip_reason = recurring_cost.get_unenactable_reason(self.date_range.lower)
+                            except RecurringCostAlreadyEnactedForBillingCycle:
+                                cost_record.skip_reason = EnactmentRunCost.SKIP_REASONS.already_enacted
+
+                self.transactions_created = True
+                self.save()
+                StatementSnapshot.objects.invalidate(self)
+
+        RecurringCost.objects.disable_if_done()
+
+    def preview_costs(self):
+        """Calculate the charges enact_all_costs() would create, without writing anything
+
+        Returns:
+            EnactmentPreview
+        """
+        from swiftwind.costs.enactment import EnactmentPreview
+        return EnactmentPreview(self)
 
     def unenact_all_costs(self):
-        from swiftwind.costs.models import RecurringCost, RecurredCost
+        """Delete all transactions created for this billing cycle
+
+        All costs are re-enabled, other than those which have still completed
+        their billing. This uses a constant number of queries.
+        """
+        from swiftwind.costs.models import RecurringCost
 
         with transaction.atomic():
-            transaction_ids = list(Transaction.objects.filter(recurred_cost__billing_cycle=self).values_list('pk', flat=True))
-            RecurredCost.objects.filter(billing_cycle=self).delete()
-            Transaction.objects.filter(pk__in=transaction_ids).delete()
+            self._delete_recurred_costs()
 
             self.transactions_created = False
-            for recurring_cost in RecurringCost.objects.all():
-                recurring_cost.disabled = False
-                recurring_cost.save()
-                recurring_cost.disable_if_done()
+            RecurringCost.objects.filter(disabled=True).update(disabled=False)
+            RecurringCost.objects.disable_if_done()
             self.save()
+            StatementSnapshot.objects.invalidate(self)
 
-    def reenact_all_costs(self):
-        from swiftwind.costs.models import RecurringCost, RecurredCost
+    def delete_partial_enactment(self, recurred_cost_ids):
+        """Delete the transactions created by a partial enactment of this billing cycle
+
+        Used when enacting in parallel (see swiftwind.costs.tasks), should a chunk fail.
+        Unlike unenact_all_costs(), no costs are re-enabled, as costs are only disabled
+        once an enactment is complete.
 
+        Args:
+            recurred_cost_ids (list[int]): The RecurredCosts created by the partial enactment.
+                Any others within this billing cycle are left untouched.
+        """
         with transaction.atomic():
-            # We need to delete the recurred cost before the transactions
-            # otherwise django will complain that the RecurredCost.transaction
-            # field cannot be set to null
-            transaction_ids = list(Transaction.objects.filter(recurred_cost__billing_cycle=self).values_list('pk', flat=True))
-            RecurredCost.objects.filter(billing_cycle=self).delete()
-            Transaction.objects.filter(pk__in=transaction_ids).delete()
+            self._delete_recurred_costs(pk__in=recurred_cost_ids)
+            StatementSnapshot.objects.invalidate(self)
 
-            self.transactions_created = False
-            self.save()
+    def reenact_all_costs(self):
+        """Bring this billing cycle's transactions into line with the current recurring costs
 
-            for recurring_cost in RecurringCost.objects.all():
-                recurring_cost.disabled = False
-                if not recurring_cost.is_enactable(self.start_date):
-                    continue
+        Useful when costs have been corrected after the billing cycle was enacted.
+        Only the transactions & legs which differ are changed, see reconcile_billing_cycle().
 
-                recurring_cost.save()
-                recurring_cost.enact(self, disable_if_done=False)
+        Returns:
+            dict: A summary of the changes made
+        """
+        from swiftwind.costs.models import RecurringCost
+        from swiftwind.costs.enactment import reconcile_billing_cycle
 
+        with transaction.atomic():
+            summary = reconcile_billing_cycle(self)
             self.transactions_created = True
             self.save()
+            StatementSnapshot.objects.invalidate(self)
+
+        RecurringCost.objects.disable_if_done()
+        return summary
+
+    def _delete_recurred_costs(self, **filters):
+        """Delete this billing cycle's RecurredCosts and their transactions
+
+        Also reverses the billing recorded against each recurring cost.
+
+        Args:
+            **filters: Only delete the RecurredCosts matching these filters
+        """
+        from swiftwind.costs.models import RecurringCost, RecurredCost
 
-        for recurring_cost in RecurringCost.objects.all():
-            recurring_cost.disable_if_done()
+        recurred_costs = RecurredCost.objects.filter(billing_cycle=self, **filters)
+        transaction_ids = list(recurred_costs.exclude(transaction=None).values_list('transaction_id', flat=True))
+
+        billed = recurred_costs.billed_totals()
+        RecurringCost.objects.add_billed({
+            recurring_cost_id: (-amount, -cycles)
+            for recurring_cost_id, (amount, cycles)
+            in billed.items()
+        })
+
+        # We need to delete the recurred cost before the transactions
+        # otherwise django will complain that the RecurredCost.transaction
+        # field cannot be set to null
+        recurred_costs.delete()
+        Transaction.objects.filter(pk__in=transaction_ids).delete()
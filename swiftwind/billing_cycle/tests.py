@@ -1,7 +1,9 @@
 import six
-from django.db import transaction
+from decimal import Decimal
+from django.db import transaction, connection
 from django.db.utils import IntegrityError
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.core import mail
 from datetime import date
 from unittest.mock import patch
@@ -9,13 +11,19 @@ from unittest.mock import patch
 from django.urls.base import reverse
 from django.utils.timezone import datetime
 from freezegun.api import freeze_time
+from psycopg2.extras import DateRange
 
 from hordak.models.core import StatementImport, Account, StatementLine, Transaction, Leg
+from hordak.utilities.currency import Balance
 from pytz import UTC
 
+from swiftwind.core.models import OutboxEmail
+from swiftwind.core.outbox import dispatch_outbox
 from swiftwind.costs.models import RecurringCost, RecurringCostSplit, RecurredCost
+from swiftwind.utilities.emails import send_messages
 from swiftwind.utilities.testing import DataProvider
 
+from . import calendar
 from .cycles import Monthly
 from .models import BillingCycle
 
@@ -108,6 +116,157 @@ class BillingCycleTestCase(DataProvider, TransactionTestCase):
         self.assertIn(cycle3, BillingCycle.objects.all())
         self.assertNotIn(cycle4, BillingCycle.objects.all())
 
+    def test_populate_sequence(self):
+        with self.settings(SWIFTWIND_BILLING_CYCLE_YEARS=1):
+            BillingCycle._populate(as_of=date(2016, 6, 1), delete=False)
+            BillingCycle._populate(as_of=date(2016, 6, 15), delete=True)
+
+        self.assertEqual(
+            list(BillingCycle.objects.values_list('sequence', flat=True)),
+            list(range(1, BillingCycle.objects.count() + 1)),
+        )
+
+    def test_populate_constant_queries(self):
+        def count_queries(years):
+            BillingCycle.objects.all().delete()
+            with self.settings(SWIFTWIND_BILLING_CYCLE_YEARS=years), \
+                    CaptureQueriesContext(connection) as context:
+                BillingCycle._populate(as_of=date(2016, 6, 1), delete=False)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(5))
+        self.assertEqual(BillingCycle.objects.count(), 61)
+
+    def test_insert_date_ranges_skips_overlapping(self):
+        BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+        with transaction.atomic():
+            created = BillingCycle.objects.insert_date_ranges([
+                (date(2016, 5, 1), date(2016, 6, 1)),
+                (date(2016, 6, 1), date(2016, 7, 1)),
+            ], first_sequence=2)
+
+        self.assertEqual(created, 1)
+        self.assertEqual(
+            list(BillingCycle.objects.values_list('date_range', 'sequence')),
+            [(DateRange(date(2016, 5, 1), date(2016, 6, 1)), 1), (DateRange(date(2016, 6, 1), date(2016, 7, 1)), 2)],
+        )
+
+    def test_sequence_created_directly(self):
+        cycle2 = BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        cycle2.refresh_from_db()
+
+        self.assertEqual(cycle1.sequence, 1)
+        self.assertEqual(cycle2.sequence, 2)
+
+    def test_as_of(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        cycle2 = BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+
+        self.assertEqual(BillingCycle.objects.as_of(date(2016, 4, 1)), cycle1)
+        self.assertEqual(BillingCycle.objects.as_of(date(2016, 4, 30)), cycle1)
+        self.assertEqual(BillingCycle.objects.as_of(date(2016, 5, 1)), cycle2)
+        with self.assertRaises(BillingCycle.DoesNotExist):
+            BillingCycle.objects.as_of(date(2016, 3, 31))
+        with self.assertRaises(BillingCycle.DoesNotExist):
+            BillingCycle.objects.as_of(date(2016, 6, 1))
+
+    def test_calendar_cached(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+        BillingCycle.objects.as_of(date(2016, 4, 1))
+
+        # The version is only checked upon the first lookup
+        with calendar.checked_once(), self.assertNumQueries(1):
+            cycle2 = BillingCycle.objects.as_of(date(2016, 5, 1))
+            self.assertEqual(cycle2.get_previous(), cycle1)
+            self.assertEqual(cycle1.get_next(), cycle2)
+            self.assertEqual(cycle2.start_date, date(2016, 5, 1))
+            self.assertFalse(cycle2.transactions_created)
+            self.assertFalse(cycle2.statements_sent)
+
+        # Outside of checked_once() the version is checked upon every lookup
+        with self.assertNumQueries(2):
+            BillingCycle.objects.as_of(date(2016, 5, 1))
+            BillingCycle.objects.as_of(date(2016, 4, 1))
+
+    def test_calendar_checked_once_per_request(self):
+        BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        # Sending request_started would also close the database connection
+        calendar._request_started(sender=self.__class__)
+        try:
+            BillingCycle.objects.as_of(date(2016, 4, 1))
+            with self.assertNumQueries(0):
+                BillingCycle.objects.as_of(date(2016, 4, 1))
+
+            # Changes made within the request are seen by it
+            BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+            BillingCycle.objects.as_of(date(2016, 5, 1))
+        finally:
+            calendar._request_finished(sender=self.__class__)
+
+    def test_calendar_invalidated(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        self.assertFalse(BillingCycle.objects.as_of(date(2016, 4, 1)).transactions_created)
+
+        cycle1.transactions_created = True
+        cycle1.save()
+        self.assertTrue(BillingCycle.objects.as_of(date(2016, 4, 1)).transactions_created)
+
+        # Modifying a cycle returned by the calendar does not affect the calendar
+        BillingCycle.objects.as_of(date(2016, 4, 1)).transactions_created = False
+        self.assertTrue(BillingCycle.objects.as_of(date(2016, 4, 1)).transactions_created)
+
+        with self.settings(SWIFTWIND_BILLING_CYCLE_YEARS=1):
+            BillingCycle._populate(as_of=date(2016, 4, 1), delete=False)
+        self.assertIsNotNone(cycle1.get_next())
+
+    def test_calendar_invalidated_by_state_update(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        self.assertFalse(BillingCycle.objects.as_of(date(2016, 4, 1)).statements_sent)
+
+        BillingCycle.objects.filter(pk=cycle1.pk).update(statements_sent=True)
+        self.assertTrue(BillingCycle.objects.as_of(date(2016, 4, 1)).statements_sent)
+
+    def test_calendar_invalidated_by_update(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        with self.assertRaises(BillingCycle.DoesNotExist):
+            BillingCycle.objects.as_of(date(2016, 3, 15))
+
+        # As if by another process, bypassing BillingCycle.save()
+        BillingCycle.objects.filter(pk=cycle1.pk).update(date_range=(date(2016, 3, 1), date(2016, 5, 1)))
+        self.assertEqual(BillingCycle.objects.as_of(date(2016, 3, 15)), cycle1)
+
+    def test_save_keeps_statements_version(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        cycle1.refresh_from_db()
+        BillingCycle.objects.filter(pk=cycle1.pk).update(statements_version=5)
+        cycle1.statements_sent = True
+        cycle1.save()
+        cycle1.refresh_from_db()
+        self.assertEqual(cycle1.statements_version, 5)
+        self.assertTrue(cycle1.statements_sent)
+
+    def test_save_copy(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        cycle1.refresh_from_db()
+        cycle1.pk = None
+        cycle1.sequence = None
+        cycle1.date_range = (date(2016, 5, 1), date(2016, 6, 1))
+        cycle1.save()
+        self.assertEqual(BillingCycle.objects.count(), 2)
+
+    def test_get_next_previous(self):
+        cycle1 = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        cycle2 = BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+        cycle3 = BillingCycle.objects.create(date_range=(date(2016, 6, 1), date(2016, 7, 1)))
+
+        self.assertEqual(cycle1.get_previous(), None)
+        self.assertEqual(cycle1.get_next(), cycle2)
+        self.assertEqual(cycle2.get_previous(), cycle1)
+        self.assertEqual(cycle2.get_next(), cycle3)
+        self.assertEqual(cycle3.get_next(), None)
+
     def test_is_reconciled_true(self):
         bank = self.account(name='Bank', type=Account.TYPES.asset)
         other_account = self.account()
@@ -185,6 +344,8 @@ class BillingCycleTestCase(DataProvider, TransactionTestCase):
         billing_cycle.refresh_from_db()
         self.housemate(user_kwargs=dict(email='user@example.com'))
         billing_cycle.send_reconciliation_required()
+        self.assertEqual(len(mail.outbox), 0)
+        dispatch_outbox()
 
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].recipients(), ['user@example.com'])
@@ -197,6 +358,8 @@ class BillingCycleTestCase(DataProvider, TransactionTestCase):
         billing_cycle.refresh_from_db()
         self.housemate(user_kwargs=dict(email='user@example.com'))
         billing_cycle.send_statements(force=True)
+        self.assertEqual(len(mail.outbox), 0)
+        dispatch_outbox()
 
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].recipients(), ['user@example.com'])
@@ -204,6 +367,34 @@ class BillingCycleTestCase(DataProvider, TransactionTestCase):
         self.assertEqual(mime, 'text/html')
         self.assertIn('<html', content)
 
+    def test_send_statements_once(self):
+        billing_cycle = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)),
+                                                    transactions_created=True)
+        self.housemate(user_kwargs=dict(email='user@example.com'))
+
+        self.assertEqual(len(billing_cycle.send_statements()), 1)
+        billing_cycle.refresh_from_db()
+        self.assertTrue(billing_cycle.statements_sent)
+        self.assertEqual(billing_cycle.send_statements(), False)
+
+        # Forcing resends
+        self.assertEqual(len(billing_cycle.send_statements(force=True)), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+
+class SendMessagesTestCase(TestCase):
+
+    def test_send_messages_batches(self):
+        connection = mail.get_connection()
+        messages = [mail.EmailMessage(to=['user{}@example.com'.format(i)]) for i in range(5)]
+
+        with patch.object(connection, 'open', wraps=connection.open) as open_:
+            failures = send_messages(messages, batch_size=2, connection=connection)
+
+        self.assertEqual(failures, [])
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(open_.call_count, 3)
+
 
 class CycleTestCase(TestCase):
 
@@ -278,6 +469,51 @@ class BillingCycleListViewTestCase(DataProvider, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['billing_cycles']), 3)
 
+    def test_get_constant_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('billing_cycles:list'))
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        BillingCycle.objects.create(date_range=(date(2016, 5, 1), date(2016, 6, 1)))
+        with freeze_time('2016-06-15'):
+            count_queries()  # Warm the calendar cache
+            few_cycles_queries = count_queries()
+
+        for month in range(6, 12):
+            BillingCycle.objects.create(date_range=(date(2016, month, 1), date(2016, month + 1, 1)))
+        with freeze_time('2016-11-15'):
+            count_queries()  # Warm the calendar cache
+            self.assertEqual(count_queries(), few_cycles_queries)
+
+    def test_with_reconciliation(self):
+        bank = self.account(name='Bank', type=Account.TYPES.asset)
+        for month in range(4, 8):
+            BillingCycle.objects.create(date_range=(date(2016, month, 1), date(2016, month + 1, 1)))
+        statement_import = StatementImport.objects.create(
+            timestamp=datetime(2016, 6, 2, 9, 30, 00, tzinfo=UTC),
+            bank_account=bank,
+            source='csv',
+        )
+        StatementLine.objects.create(
+            timestamp=datetime(2016, 6, 2, 9, 30, 00, tzinfo=UTC),
+            date=date(2016, 4, 10),
+            statement_import=statement_import,
+            amount=10,
+        )
+
+        billing_cycles = list(BillingCycle.objects.with_reconciliation())
+        self.assertEqual([cycle.is_reconciled() for cycle in billing_cycles], [False, True, True, False])
+        self.assertEqual([cycle.can_create_transactions() for cycle in billing_cycles], [True, False, True, True])
+
+        # Matches the per-cycle calculation
+        for billing_cycle in BillingCycle.objects.all():
+            self.assertEqual(billing_cycle.is_reconciled(), billing_cycles[billing_cycle.sequence - 1].is_reconciled())
+            self.assertEqual(billing_cycle.can_create_transactions(),
+                             billing_cycles[billing_cycle.sequence - 1].can_create_transactions())
+
 
 class CreateTransactionsViewTestCase(DataProvider, TestCase):
 
@@ -318,6 +554,56 @@ class CreateTransactionsViewTestCase(DataProvider, TestCase):
         self.assertEqual(Transaction.objects.count(), 1)
 
 
+class EnactmentPreviewViewTestCase(DataProvider, TestCase):
+
+    def setUp(self):
+        self.login()
+
+        self.housemate1 = self.housemate(account_kwargs=dict(currencies=['GBP']))
+        self.housemate2 = self.housemate(account_kwargs=dict(currencies=['GBP']))
+
+        self.billing_cycle = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
+        self.billing_cycle.refresh_from_db()
+
+        self.to_account = self.account(currencies=['GBP'])
+        with transaction.atomic():
+            self.recurring_cost = RecurringCost.objects.create(
+                to_account=self.to_account,
+                fixed_amount=100,
+                type=RecurringCost.TYPES.normal,
+                initial_billing_cycle=self.billing_cycle,
+            )
+            RecurringCostSplit.objects.create(recurring_cost=self.recurring_cost, from_account=self.housemate1.account)
+            RecurringCostSplit.objects.create(recurring_cost=self.recurring_cost, from_account=self.housemate2.account)
+
+    def test_get(self):
+        response = self.client.get(reverse('billing_cycles:preview', args=[self.billing_cycle.uuid]))
+        self.assertEqual(response.status_code, 200)
+
+        preview = response.context['preview']
+        self.assertEqual(len(preview.planned), 1)
+        self.assertEqual(preview.total, Balance(100, 'GBP'))
+        self.assertEqual(dict(preview.housemate_totals), {
+            self.housemate1: Balance(50, 'GBP'),
+            self.housemate2: Balance(50, 'GBP'),
+        })
+        self.assertEqual(dict(preview.account_totals), {
+            self.to_account: Balance(100, 'GBP'),
+            self.housemate1.account: Balance(-50, 'GBP'),
+            self.housemate2.account: Balance(-50, 'GBP'),
+        })
+
+        # Nothing was written
+        self.assertEqual(Transaction.objects.count(), 0)
+        self.assertEqual(RecurredCost.objects.count(), 0)
+
+    def test_already_enacted(self):
+        self.billing_cycle.enact_all_costs()
+        response = self.client.get(reverse('billing_cycles:preview', args=[self.billing_cycle.uuid]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['preview'].planned, [])
+
+
 class RecreateTransactionsViewTestCase(DataProvider, TransactionTestCase):
 
     def setUp(self):
@@ -325,6 +611,7 @@ class RecreateTransactionsViewTestCase(DataProvider, TransactionTestCase):
 
         self.housemate1 = self.housemate(account_kwargs=dict(currencies=['GBP']))
         self.housemate2 = self.housemate(account_kwargs=dict(currencies=['GBP']))
+        self.housemate3 = self.housemate(account_kwargs=dict(currencies=['GBP']))
 
         self.billing_cycle = BillingCycle.objects.create(date_range=(date(2016, 4, 1), date(2016, 5, 1)))
         self.billing_cycle.refresh_from_db()
@@ -356,8 +643,41 @@ class RecreateTransactionsViewTestCase(DataProvider, TransactionTestCase):
         self.billing_cycle.refresh_from_db()
         self.assertEqual(self.billing_cycle.transactions_created, True)
 
-        self.assertNotEqual(self.transaction, Transaction.objects.get())
-        self.assertNotEqual(self.recurred_cost, RecurredCost.objects.get())
+        # Nothing changed, so the existing transaction is kept
+        self.assertEqual(self.transaction, Transaction.objects.get())
+        self.assertEqual(self.recurred_cost, RecurredCost.objects.get())
+
+    def test_reenact_changed_amount(self):
+        self.recurring_cost.refresh_from_db()
+        self.recurring_cost.fixed_amount = 60
+        self.recurring_cost.save()
+        RecurringCostSplit.objects.create(recurring_cost=self.recurring_cost, from_account=self.housemate3.account)
+
+        summary = self.billing_cycle.reenact_all_costs()
+
+        self.assertEqual(summary['recurred_costs_updated'], 1)
+        self.assertEqual(summary['legs_created'], 1)
+        self.assertEqual(summary['legs_updated'], 3)
+        self.assertEqual(summary['legs_deleted'], 0)
+
+        # Same transaction, with its legs updated
+        self.assertEqual(self.transaction, Transaction.objects.get())
+        self.assertEqual(self.recurred_cost, RecurredCost.objects.get())
+        self.assertEqual(
+            sorted(leg.amount.amount for leg in Leg.objects.all()),
+            [Decimal('-20'), Decimal('-20'), Decimal('-20'), Decimal('60')]
+        )
+
+    def test_reenact_cost_archived(self):
+        self.recurring_cost.refresh_from_db()
+        self.recurring_cost.archive()
+
+        summary = self.billing_cycle.reenact_all_costs()
+
+        self.assertEqual(summary['recurred_costs_deleted'], 1)
+        self.assertEqual(summary['legs_deleted'], 3)
+        self.assertEqual(Transaction.objects.count(), 0)
+        self.assertEqual(RecurredCost.objects.count(), 0)
 
 
 class UnenactTransactionsViewTestCase(DataProvider, TransactionTestCase):
@@ -4,6 +4,7 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.BillingCycleListView.as_view(), name='list'),
+    url(r'^preview/(?P<uuid>.+)/$', views.EnactmentPreviewView.as_view(), name='preview'),
     url(r'^enact/(?P<uuid>.+)/$', views.CreateTransactionsView.as_view(), name='enact'),
     url(r'^reenact/(?P<uuid>.+)/$', views.RecreateTransactionsView.as_view(), name='reenact'),
     url(r'^unenact/(?P<uuid>.+)/$', views.DeleteTransactionsView.as_view(), name='unenact'),
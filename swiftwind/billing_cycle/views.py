@@ -5,7 +5,7 @@ from django.http.response import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.views import View
-from django.views.generic import ListView
+from django.views.generic import ListView, DetailView
 
 from swiftwind.billing_cycle.models import BillingCycle
 
@@ -17,7 +17,23 @@ class BillingCycleListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return BillingCycle.objects.filter(
             start_date__lte=date.today()
-        ).order_by('-date_range')
+        ).order_by('-date_range').with_reconciliation()
+
+
+class EnactmentPreviewView(LoginRequiredMixin, DetailView):
+    """Show the charges which would be created for a billing cycle, without creating them"""
+    template_name = 'billing_cycle/preview.html'
+    context_object_name = 'billing_cycle'
+    slug_field = 'uuid'
+    slug_url_kwarg = 'uuid'
+
+    def get_queryset(self):
+        return BillingCycle.objects.all()
+
+    def get_context_data(self, **kwargs):
+        context = super(EnactmentPreviewView, self).get_context_data(**kwargs)
+        context['preview'] = self.object.preview_costs()
+        return context
 
 
 class CreateTransactionsView(LoginRequiredMixin, View):
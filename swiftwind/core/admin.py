@@ -8,3 +8,11 @@ from . import models
 @admin.register(swiftwind.settings.models.Settings)
 class SettingsAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(models.OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'timestamp', 'status', 'attempts', 'next_attempt', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['idempotency_key', 'subject']
+    readonly_fields = ['idempotency_key', 'attempts', 'last_error', 'sent_at', 'locked_until']
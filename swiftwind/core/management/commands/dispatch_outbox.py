@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from swiftwind.core.outbox import dispatch_outbox
+from swiftwind.utilities.emails import DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Send all due emails in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=DEFAULT_BATCH_SIZE,
+            help="The number of emails to send over each connection.",
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            dest='max_batches',
+            default=None,
+            help="Stop after sending this many batches.",
+        )
+
+    def handle(self, *args, **options):
+        result = dispatch_outbox(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(str(result))
@@ -4,6 +4,8 @@ import time
 from django.core.management.base import BaseCommand
 
 from swiftwind.accounts.tasks import import_tellerio
+from swiftwind.core.tasks import dispatch_outbox
+from swiftwind.costs.tasks import reap_parallel_enactments
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +16,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
 
         schedule.every().hour.do(import_tellerio)
+        schedule.every().minute.do(dispatch_outbox)
+        schedule.every(10).minutes.do(reap_parallel_enactments)
 
         while True:
             schedule.run_pending()
@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+from django.contrib.postgres.fields import ArrayField
+from django.core.mail import EmailMultiAlternatives
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_smalluuid.models import SmallUUIDField, uuid_default
+from model_utils import Choices
+
+
+class OutboxEmailQuerySet(models.QuerySet):
+
+    def enqueue(self, idempotency_key, message):
+        """Add an email to the outbox, to be sent by swiftwind.core.outbox.dispatch_outbox()
+
+        Should be called within the same database transaction as the changes
+        the email relates to, so the email is only sent if they are committed.
+
+        Args:
+            idempotency_key (str): Uniquely identifies this email. If an email with
+                this key has already been enqueued then it will not be enqueued again.
+            message (EmailMultiAlternatives): The email to send
+
+        Returns:
+            (OutboxEmail, bool): The outbox email, and whether it was created
+        """
+        html_body = ''
+        for content, mimetype in getattr(message, 'alternatives', []):
+            if mimetype == 'text/html':
+                html_body = content
+
+        return self.get_or_create(
+            idempotency_key=idempotency_key,
+            defaults=dict(
+                subject=message.subject,
+                body=message.body,
+                html_body=html_body,
+                from_email=message.from_email or '',
+                to=message.to,
+            )
+        )
+
+    def due(self, as_of=None):
+        """Emails which should be sent (or retried) now
+
+        This includes emails whose lease has expired (see claim()), as the
+        dispatcher sending them presumably died before recording the result.
+        """
+        as_of = as_of or timezone.now()
+        return self.filter(
+            Q(status=OutboxEmail.STATUSES.pending, next_attempt__lte=as_of) |
+            Q(status=OutboxEmail.STATUSES.sending, locked_until__lte=as_of)
+        )
+
+    def claim(self, batch_size):
+        """Lease a batch of due emails for sending
+
+        The emails are marked as sending until `locked_until`, in a short transaction
+        of their own, so that they are not locked while being sent. Other dispatchers
+        will skip them until the lease expires.
+
+        Args:
+            batch_size (int): The maximum number of emails to claim
+
+        Returns:
+            list[OutboxEmail]
+        """
+        with transaction.atomic():
+            ids = list(
+                self.due().select_for_update(skip_locked=True).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            self.filter(pk__in=ids).update(
+                status=OutboxEmail.STATUSES.sending,
+                locked_until=timezone.now() + OutboxEmail.LEASE_DURATION,
+            )
+        return list(self.filter(pk__in=ids).order_by('pk'))
+
+
+class OutboxEmail(models.Model):
+    """An email waiting to be sent, or which has been sent
+
+    Emails are written to the outbox within the database transaction which causes
+    them, and sent later by a background dispatcher. See swiftwind.core.outbox.
+    """
+    STATUSES = Choices(
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    #: Give up on an email after this many failed attempts
+    MAX_ATTEMPTS = 5
+    #: How long a dispatcher may spend sending a claimed email before
+    #: another dispatcher may claim it. See OutboxEmailQuerySet.claim()
+    LEASE_DURATION = timedelta(minutes=10)
+
+    uuid = SmallUUIDField(default=uuid_default(), editable=False)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    idempotency_key = models.CharField(max_length=200, unique=True)
+    subject = models.CharField(max_length=998)
+    body = models.TextField()
+    html_body = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    to = ArrayField(models.CharField(max_length=254))
+    status = models.CharField(max_length=20, choices=STATUSES, default=STATUSES.pending, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboxEmailQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['timestamp']
+
+    def __str__(self):
+        return '{} to {}'.format(self.subject, ', '.join(self.to))
+
+    def to_message(self):
+        """Get the EmailMultiAlternatives for this email"""
+        message = EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email or None,
+            to=self.to,
+        )
+        if self.html_body:
+            message.attach_alternative(self.html_body, 'text/html')
+        return message
+
+    def mark_sent(self):
+        self.status = self.STATUSES.sent
+        self.attempts += 1
+        self.sent_at = timezone.now()
+        self.last_error = ''
+        self.locked_until = None
+
+    def mark_failed(self, error):
+        """Record a failed attempt, scheduling a retry with exponential backoff"""
+        self.attempts += 1
+        self.last_error = str(error)
+        self.locked_until = None
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.STATUSES.failed
+        else:
+            self.status = self.STATUSES.pending
+            self.next_attempt = timezone.now() + timedelta(minutes=2 ** self.attempts)
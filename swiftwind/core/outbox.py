@@ -0,0 +1,118 @@
+"""Sending of emails from the outbox
+
+Emails are added to the outbox using OutboxEmail.objects.enqueue(), within the
+database transaction which causes them. dispatch_outbox() then sends them in
+batches, from either the dispatch_outbox task or management command.
+
+Each batch is first claimed in a short transaction, using SELECT ... FOR UPDATE
+SKIP LOCKED to lease the emails to this dispatcher. The emails are then sent
+outside of any transaction, so no rows are locked while talking to the mail
+server, and the results recorded in a second short transaction. Several
+dispatchers may therefore run concurrently without sending an email twice.
+Should a dispatcher die mid-batch, its emails are claimed again once their
+lease expires.
+
+Failed emails are retried with exponential backoff, up to
+OutboxEmail.MAX_ATTEMPTS times.
+"""
+import logging
+from time import perf_counter
+
+from django.db import transaction
+
+from swiftwind.utilities.emails import send_messages, DEFAULT_BATCH_SIZE
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+#: The fields changed by OutboxEmail.mark_sent() & mark_failed()
+RESULT_FIELDS = ('status', 'attempts', 'sent_at', 'last_error', 'next_attempt', 'locked_until')
+
+
+class DispatchResult(object):
+    """Metrics for a call to dispatch_outbox()"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.duration = 0.0
+
+    @property
+    def per_second(self):
+        return self.sent / self.duration if self.duration else 0.0
+
+    def __str__(self):
+        return 'Sent {} email(s) with {} failure(s) in {} batch(es) over {:.2f}s ({:.2f} emails/second)'.format(
+            self.sent, self.failed, self.batches, self.duration, self.per_second
+        )
+
+
+def dispatch_batch(batch_size=DEFAULT_BATCH_SIZE, connection=None):
+    """Send a single batch of due emails
+
+    Must not be called within a transaction, as the emails would remain
+    locked while being sent.
+
+    Returns:
+        (int, int): The number of emails sent, and the number which failed
+    """
+    emails = OutboxEmail.objects.claim(batch_size)
+    if not emails:
+        return 0, 0
+    leases = {email.pk: email.locked_until for email in emails}
+
+    messages = [email.to_message() for email in emails]
+    try:
+        failures = {
+            id(message): error
+            for message, error in send_messages(messages, batch_size=batch_size, connection=connection)
+        }
+    except Exception as e:
+        # The claim must always be resolved, otherwise the emails remain
+        # 'sending' until their lease expires and the attempt goes unrecorded
+        logger.exception('Failed to send outbox emails')
+        failures = {id(message): e for message in messages}
+
+    with transaction.atomic():
+        for email, message in zip(emails, messages):
+            if id(message) in failures:
+                email.mark_failed(failures[id(message)])
+            else:
+                email.mark_sent()
+            # Only record the result if our lease is still held. Otherwise the
+            # email has since been claimed by another dispatcher.
+            recorded = OutboxEmail.objects.filter(pk=email.pk, locked_until=leases[email.pk]).update(
+                **{field: getattr(email, field) for field in RESULT_FIELDS}
+            )
+            if not recorded:
+                logger.warning('Lease expired while sending outbox email {}'.format(email.pk))
+
+    return len(emails) - len(failures), len(failures)
+
+
+def dispatch_outbox(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, connection=None):
+    """Send all due emails in the outbox
+
+    Args:
+        batch_size (int): The number of emails to lock & send at a time
+        max_batches (int): Stop after this many batches. Defaults to no limit.
+        connection: The email backend to use
+
+    Returns:
+        DispatchResult
+    """
+    result = DispatchResult()
+    started = perf_counter()
+    while max_batches is None or result.batches < max_batches:
+        sent, failed = dispatch_batch(batch_size, connection=connection)
+        if not sent and not failed:
+            break
+        result.sent += sent
+        result.failed += failed
+        result.batches += 1
+
+    result.duration = perf_counter() - started
+    if result.batches:
+        logger.info(str(result))
+    return result
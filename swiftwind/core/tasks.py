@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from swiftwind.core import outbox
+
+
+@shared_task
+def dispatch_outbox():
+    """Send all due emails in the outbox
+
+    Returns:
+        int: The number of emails sent
+    """
+    return outbox.dispatch_outbox().sent
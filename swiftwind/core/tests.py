@@ -1,9 +1,21 @@
+from datetime import timedelta
+from smtplib import SMTPAuthenticationError, SMTPRecipientsRefused
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.test import override_settings
 from django.test.testcases import TestCase
+from django.utils import timezone
 
 from swiftwind.core.exceptions import CannotCreateMultipleSettingsInstances
+from swiftwind.core.management.commands.dispatch_outbox import Command as DispatchOutboxCommand
+from swiftwind.core.models import OutboxEmail
+from swiftwind.core.outbox import dispatch_outbox, dispatch_batch
 from swiftwind.core.management.commands.swiftwind_create_accounts import Command as CreateChartOfAccountsCommand
 from hordak.models.core import Account
 from swiftwind.settings.models import Settings
+from swiftwind.utilities.emails import send_messages
 from swiftwind.utilities.testing import DataProvider
 
 
@@ -47,3 +59,134 @@ class SettingsTestCase(TestCase):
         Settings.objects.get()
         with self.assertRaises(CannotCreateMultipleSettingsInstances):
             Settings.objects.create()
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+    """Fails to send to any address beginning with 'fail'"""
+
+    def send_messages(self, messages):
+        if any(recipient.startswith('fail') for message in messages for recipient in message.recipients()):
+            raise SMTPRecipientsRefused(messages[0].recipients())
+        return super(FailingEmailBackend, self).send_messages(messages)
+
+
+class OutboxTestCase(TestCase):
+
+    def enqueue(self, key, to):
+        message = mail.EmailMultiAlternatives(subject='Subject', body='Body', to=[to])
+        message.attach_alternative('<html></html>', 'text/html')
+        return OutboxEmail.objects.enqueue(key, message)
+
+    def test_enqueue_idempotent(self):
+        email, created = self.enqueue('key1', 'user@example.com')
+        self.assertTrue(created)
+        self.assertEqual(email.html_body, '<html></html>')
+
+        email, created = self.enqueue('key1', 'user@example.com')
+        self.assertFalse(created)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_dispatch(self):
+        for i in range(5):
+            self.enqueue('key{}'.format(i), 'user{}@example.com'.format(i))
+
+        result = dispatch_outbox(batch_size=2)
+        self.assertEqual(result.sent, 5)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].alternatives, [('<html></html>', 'text/html')])
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.STATUSES.sent).count(), 5)
+
+        # Nothing left to send
+        self.assertEqual(dispatch_outbox().sent, 0)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(EMAIL_BACKEND='swiftwind.core.tests.FailingEmailBackend')
+    def test_dispatch_failure(self):
+        self.enqueue('key1', 'user1@example.com')
+        self.enqueue('key2', 'fail@example.com')
+        self.enqueue('key3', 'user2@example.com')
+
+        result = dispatch_outbox()
+        self.assertEqual(result.sent, 2)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(sorted(m.recipients()[0] for m in mail.outbox), ['user1@example.com', 'user2@example.com'])
+
+        failed = OutboxEmail.objects.get(idempotency_key='key2')
+        self.assertEqual(failed.status, OutboxEmail.STATUSES.pending)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('fail@example.com', failed.last_error)
+        self.assertGreater(failed.next_attempt, timezone.now())
+
+        # Retried once due, until the attempts run out
+        for _ in range(OutboxEmail.MAX_ATTEMPTS - 1):
+            OutboxEmail.objects.filter(pk=failed.pk).update(next_attempt=timezone.now() - timedelta(seconds=1))
+            dispatch_outbox()
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, OutboxEmail.STATUSES.failed)
+        self.assertEqual(failed.attempts, OutboxEmail.MAX_ATTEMPTS)
+
+    def test_dispatch_connection_failure(self):
+        self.enqueue('key1', 'user1@example.com')
+        self.enqueue('key2', 'user2@example.com')
+
+        with patch.object(locmem.EmailBackend, 'open', side_effect=SMTPAuthenticationError(535, 'Bad login')):
+            result = dispatch_outbox()
+        self.assertEqual(result.sent, 0)
+        self.assertEqual(result.failed, 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+        for email in OutboxEmail.objects.all():
+            self.assertEqual(email.status, OutboxEmail.STATUSES.pending)
+            self.assertEqual(email.attempts, 1)
+            self.assertIsNone(email.locked_until)
+            self.assertIn('Bad login', email.last_error)
+
+    def test_claim(self):
+        email, _ = self.enqueue('key1', 'user1@example.com')
+        self.assertEqual(OutboxEmail.objects.claim(10), [email])
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUSES.sending)
+        self.assertGreater(email.locked_until, timezone.now())
+        self.assertEqual(OutboxEmail.objects.claim(10), [])
+
+        # Claimable again once the lease expires
+        OutboxEmail.objects.filter(pk=email.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(OutboxEmail.objects.claim(10), [email])
+
+    def test_claimed_emails_not_dispatched_concurrently(self):
+        self.enqueue('key1', 'user1@example.com')
+
+        def send_and_dispatch(messages, connection=None):
+            # As if another dispatcher ran while we were sending
+            self.assertEqual(dispatch_batch(), (0, 0))
+            return send_messages(messages, connection=connection)
+
+        with patch('swiftwind.core.outbox.send_messages', side_effect=send_and_dispatch):
+            self.assertEqual(dispatch_batch(), (1, 0))
+
+        self.assertEqual(len(mail.outbox), 1)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.STATUSES.sent)
+        self.assertIsNone(email.locked_until)
+
+    def test_result_not_recorded_after_lease_lost(self):
+        email, _ = self.enqueue('key1', 'user1@example.com')
+
+        def send_and_lose_lease(messages, connection=None):
+            # As if the lease expired and the email was claimed by another dispatcher
+            OutboxEmail.objects.filter(pk=email.pk).update(locked_until=timezone.now() + timedelta(hours=1))
+            return send_messages(messages, connection=connection)
+
+        with patch('swiftwind.core.outbox.send_messages', side_effect=send_and_lose_lease):
+            dispatch_batch()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUSES.sending)
+        self.assertEqual(email.attempts, 0)
+
+    def test_dispatch_outbox_command(self):
+        self.enqueue('key1', 'user1@example.com')
+        DispatchOutboxCommand().handle(batch_size=10, max_batches=None)
+        self.assertEqual(len(mail.outbox), 1)
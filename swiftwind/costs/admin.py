@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.contrib import admin
 
-from .models import RecurringCost, RecurringCostSplit
+from .models import RecurringCost, RecurringCostSplit, EnactmentRun, EnactmentRunCost
 
 
 class RecurringCostSplitInline(admin.TabularInline):
@@ -14,3 +14,26 @@ class RecurringCostAdmin(admin.ModelAdmin):
     inlines = [
         RecurringCostSplitInline,
     ]
+
+
+class EnactmentRunCostInline(admin.TabularInline):
+    model = EnactmentRunCost
+    fields = readonly_fields = ['recurring_cost', 'duration', 'query_count', 'rows_written', 'skip_reason']
+    ordering = ['-duration', '-query_count']
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(EnactmentRun)
+class EnactmentRunAdmin(admin.ModelAdmin):
+    list_display = ['billing_cycle', 'timestamp', 'mode', 'succeeded', 'duration', 'query_count',
+                    'rows_written', 'costs_enacted', 'costs_skipped']
+    list_filter = ['mode', 'succeeded']
+    readonly_fields = ['billing_cycle', 'mode', 'succeeded', 'duration', 'query_count',
+                       'rows_written', 'costs_enacted', 'costs_skipped']
+    inlines = [
+        EnactmentRunCostInline,
+    ]
@@ -0,0 +1,633 @@
+"""Batch enactment of recurring costs
+
+Enacting costs one at a time via :meth:`RecurringCost.enact()` requires several
+queries per cost (enactability checks, amount calculation, split lookups) plus
+one INSERT per transaction leg. For a billing cycle with many costs this quickly
+adds up to thousands of round trips.
+
+The :class:`BatchEnactor` loads everything it needs for a billing cycle up-front,
+calculates every amount & split in memory, and then writes all ``Transaction``,
+``Leg`` and ``RecurredCost`` rows using bulk inserts. The resulting ledger is
+identical to that produced by the per-cost path.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction as db_transaction
+from django.db.models import Prefetch, Sum, Case, When, Value, DecimalField
+from moneyed import Money
+
+from hordak.models import Account, Transaction, Leg
+from hordak.utilities.currency import Balance
+
+from swiftwind.billing_cycle.models import BillingCycle
+from .models import RecurringCost, RecurringCostSplit, RecurredCost, SplitPlanCache, EnactmentRunCost
+
+
+def get_arrears_amounts(recurring_costs, billing_cycle):
+    """Get the amounts to bill for many arrears costs using a single query over the legs table
+
+    Equivalent to calling :meth:`RecurringCost.get_amount()` for each ``arrears_balance``
+    and ``arrears_transactions`` cost, but rather than calculating one account balance per
+    cost this performs a single ``GROUP BY`` query over the legs of all the costs'
+    ``to_account``s (including child accounts).
+
+    Args:
+        recurring_costs (iterable[RecurringCost]): The costs to calculate amounts for. Costs of
+            type ``normal`` are ignored. The ``to_account`` should ideally be ``select_related()``.
+        billing_cycle (BillingCycle): The billing cycle to calculate amounts for
+
+    Returns:
+        dict: RecurringCost primary keys mapped to the (Decimal) amount to be billed
+    """
+    arrears_types = (RecurringCost.TYPES.arrears_balance, RecurringCost.TYPES.arrears_transactions)
+    recurring_costs = [cost for cost in recurring_costs if cost.type in arrears_types]
+    if not recurring_costs:
+        return {}
+
+    # Account.balance() includes child accounts, so load the full tree for each
+    # to_account in order to find descendants without querying per account
+    to_accounts = {cost.to_account_id: cost.to_account for cost in recurring_costs}
+    tree_accounts = list(Account.objects.filter(tree_id__in={a.tree_id for a in to_accounts.values()}))
+    roots = {account.tree_id: account for account in tree_accounts if account.parent_id is None}
+    descendants = {
+        to_account.pk: [
+            account.pk for account in tree_accounts
+            if account.tree_id == to_account.tree_id and to_account.lft <= account.lft <= to_account.rght
+        ]
+        for to_account in to_accounts.values()
+    }
+
+    previous_billing_cycle = billing_cycle.get_previous()
+    annotations = dict(balance=Sum('amount'))
+    if previous_billing_cycle:
+        annotations['previous_cycle'] = Sum(Case(
+            When(
+                transaction__date__gte=previous_billing_cycle.date_range.lower,
+                transaction__date__lt=previous_billing_cycle.date_range.upper,
+                then='amount',
+            ),
+            default=Value(0),
+            output_field=DecimalField(),
+        ))
+
+    rows = Leg.objects.filter(
+        account_id__in={pk for account_ids in descendants.values() for pk in account_ids},
+        transaction__date__lt=billing_cycle.date_range.lower,
+    ).values('account_id', 'amount_currency').annotate(**annotations)
+
+    rows_by_account = {}
+    for row in rows:
+        rows_by_account.setdefault(row['account_id'], []).append(row)
+
+    amounts = {}
+    for cost in recurring_costs:
+        if cost.type == RecurringCost.TYPES.arrears_balance:
+            column = 'balance'
+        elif previous_billing_cycle:
+            column = 'previous_cycle'
+        else:
+            # No previous billing cycle, so nothing to bill in arrears
+            amounts[cost.pk] = Decimal(0)
+            continue
+
+        monies = [
+            Money(row[column], row['amount_currency'])
+            for account_id in descendants[cost.to_account_id]
+            for row in rows_by_account.get(account_id, [])
+            if row[column]
+        ]
+        # All accounts in a tree share the sign of the tree's root account
+        balance = sum((Balance([money]) for money in monies), Balance()) * roots[cost.to_account.tree_id].sign
+        amounts[cost.pk] = _balance_to_decimal(balance)
+
+    return amounts
+
+
+def _balance_to_decimal(balance):
+    """Convert a balance into a decimal, as per RecurringCost.get_amount()"""
+    monies = balance.monies()
+    assert len(monies) in (0, 1)
+    return monies[0].amount if balance else Decimal('0')
+
+
+class PlannedCost(object):
+    """A RecurredCost (and its transaction) which is yet to be written to the database
+
+    Attributes:
+        recurring_cost (RecurringCost): The cost being enacted
+        billing_cycle (BillingCycle): The billing cycle the cost is being enacted for
+        amount (Decimal): The total amount to be billed. May be zero, in which case
+            no transaction will be created.
+        splits (list[(RecurringCostSplit, Decimal)]): The amount to be billed to each split
+    """
+
+    def __init__(self, recurring_cost, billing_cycle, amount, splits):
+        self.recurring_cost = recurring_cost
+        self.billing_cycle = billing_cycle
+        self.amount = amount
+        self.splits = splits
+
+    def __repr__(self):
+        return 'PlannedCost <{} {}>'.format(self.recurring_cost.pk, self.amount)
+
+    @property
+    def currency(self):
+        return self.recurring_cost.currency
+
+    def make_transaction(self):
+        """Get an unsaved Transaction for this cost, or None if there is nothing to bill"""
+        if not self.amount:
+            return None
+        return Transaction(
+            description='Created by recurring cost',
+            date=self.billing_cycle.date_range.lower,
+        )
+
+    @property
+    def leg_count(self):
+        """The number of legs make_legs() will create"""
+        if not self.amount:
+            return 0
+        return 1 + len([split_amount for _, split_amount in self.splits if split_amount])
+
+    @property
+    def rows_written(self):
+        """The number of rows enacting this cost writes: a RecurredCost, a Transaction and its Legs"""
+        if not self.amount:
+            return 1
+        return 2 + self.leg_count
+
+    def make_legs(self, transaction):
+        """Get the unsaved legs for the given (saved) transaction
+
+        Mirrors the legs created by :meth:`RecurredCost.make_transaction()`
+        """
+        legs = [Leg(
+            transaction=transaction,
+            amount=Money(self.amount, self.currency),
+            account_id=self.recurring_cost.to_account_id,
+        )]
+        for split, split_amount in self.splits:
+            if split_amount:
+                legs.append(Leg(
+                    transaction=transaction,
+                    amount=Money(split_amount * -1, self.currency),
+                    account_id=split.from_account_id,
+                ))
+        return legs
+
+
+class BatchEnactor(object):
+    """Enact many recurring costs for a single billing cycle in a constant number of queries
+
+    Usage::
+
+        BatchEnactor(billing_cycle).enact()
+
+    Args:
+        billing_cycle (BillingCycle): The billing cycle to enact costs for
+        recurring_costs (QuerySet): The costs to consider for enactment. Defaults to all costs.
+            Costs which are not enactable, or which have already been enacted for this
+            billing cycle, will be skipped.
+        include_disabled (bool): Treat disabled costs as enactable. The caller is responsible
+            for re-enabling any such costs before calling write().
+        include_enacted (bool): Plan costs even if they have already been enacted for this
+            billing cycle. Used when reconciling existing enactments, see reconcile_billing_cycle().
+    """
+
+    def __init__(self, billing_cycle, recurring_costs=None, include_disabled=False, include_enacted=False):
+        self.billing_cycle = billing_cycle
+        self.include_disabled = include_disabled
+        self.include_enacted = include_enacted
+        #: Why each cost was not enacted, populated by plan() & write()
+        self.skip_reasons = {}
+        if recurring_costs is None:
+            recurring_costs = RecurringCost.objects.all()
+        self.recurring_costs = recurring_costs
+        self._loaded = False
+
+    def load(self):
+        """Load all data required to plan the enactment"""
+        if self._loaded:
+            return
+
+        self.costs = list(
+            self.recurring_costs
+            .select_related('to_account', 'initial_billing_cycle')
+            .prefetch_related(Prefetch('splits', queryset=RecurringCostSplit.objects.order_by('pk')))
+            .order_by('pk')
+        )
+        cost_ids = [cost.pk for cost in self.costs]
+        self.split_plans = SplitPlanCache(self.costs)
+
+        # The final billing cycle of each one-off cost, used to determine if the cost has finished
+        final_sequences = {
+            self._get_final_sequence(cost) for cost in self.costs if cost.is_one_off()
+        }
+        self.final_cycle_ranges = dict(
+            BillingCycle.objects.filter(sequence__in=final_sequences).values_list('sequence', 'date_range')
+        )
+
+        self.enacted_cost_ids = set(
+            RecurredCost.objects
+            .filter(billing_cycle=self.billing_cycle, recurring_cost_id__in=cost_ids)
+            .values_list('recurring_cost_id', flat=True)
+        )
+
+        self.arrears_amounts = get_arrears_amounts(self.costs, self.billing_cycle)
+
+        self._loaded = True
+
+    # Enactability. These mirror the equivalent methods on RecurringCost, but
+    # use the data loaded by load() rather than querying per-cost.
+
+    def _get_final_sequence(self, recurring_cost):
+        return recurring_cost.initial_billing_cycle.sequence + recurring_cost.total_billing_cycles - 1
+
+    def is_finished(self, recurring_cost, as_of):
+        if not recurring_cost.is_one_off():
+            return False
+        final_cycle_range = self.final_cycle_ranges.get(self._get_final_sequence(recurring_cost))
+        if not final_cycle_range:
+            # The cost extends beyond the billing cycles which currently exist
+            return False
+        return final_cycle_range.upper <= as_of
+
+    def is_billing_complete(self, recurring_cost):
+        if not recurring_cost.is_one_off():
+            return False
+        return recurring_cost.billed_amount >= recurring_cost.fixed_amount
+
+    def is_enactable(self, recurring_cost):
+        return self.get_unenactable_reason(recurring_cost) is None
+
+    def get_unenactable_reason(self, recurring_cost):
+        """Mirrors RecurringCost.get_unenactable_reason()"""
+        as_of = self.billing_cycle.date_range.lower
+        reasons = EnactmentRunCost.SKIP_REASONS
+        if recurring_cost.disabled and not self.include_disabled:
+            return reasons.disabled
+        if recurring_cost.archived:
+            return reasons.archived
+        if self.is_finished(recurring_cost, as_of):
+            return reasons.finished
+        if not recurring_cost._is_ready(as_of):
+            return reasons.not_ready
+        if self.is_billing_complete(recurring_cost):
+            return reasons.billing_complete
+        return None
+
+    def has_enacted(self, recurring_cost):
+        return recurring_cost.pk in self.enacted_cost_ids
+
+    # Amount calculation
+
+    def get_amount(self, recurring_cost):
+        if recurring_cost.type != RecurringCost.TYPES.normal:
+            return self.arrears_amounts[recurring_cost.pk]
+
+        if not recurring_cost.is_one_off():
+            return recurring_cost.fixed_amount
+
+        return recurring_cost.get_installment(recurring_cost._get_billing_cycle_number(self.billing_cycle))
+
+    def split(self, recurring_cost, amount):
+        """Split amount between the cost's splits. Mirrors RecurringCostSplitQuerySet.split()"""
+        return self.split_plans.split(recurring_cost, amount)
+
+    # Planning & writing
+
+    def plan(self):
+        """Calculate the costs to be enacted without writing anything
+
+        Returns:
+            list[PlannedCost]
+        """
+        self.load()
+        planned = []
+        for recurring_cost in self.costs:
+            skip_reason = self.get_unenactable_reason(recurring_cost)
+            if not skip_reason and not self.include_enacted and self.has_enacted(recurring_cost):
+                skip_reason = EnactmentRunCost.SKIP_REASONS.already_enacted
+            if skip_reason:
+                self.skip_reasons[recurring_cost.pk] = skip_reason
+                continue
+
+            amount = self.get_amount(recurring_cost)
+            splits = self.split(recurring_cost, amount) if amount else []
+            planned.append(PlannedCost(recurring_cost, self.billing_cycle, amount, splits))
+        return planned
+
+    def write(self, planned):
+        """Write the given planned costs to the database using bulk inserts
+
+        Each cost's enactment is first claimed using RecurredCostQuerySet.claim(). Any
+        costs which have since been enacted elsewhere (e.g. by a concurrent enactment)
+        are therefore skipped.
+
+        Args:
+            planned (list[PlannedCost]):
+
+        Returns:
+            list[RecurredCost]: The created RecurredCosts
+        """
+        with db_transaction.atomic():
+            recurred_costs = RecurredCost.objects.claim(
+                self.billing_cycle, [planned_cost.recurring_cost for planned_cost in planned]
+            )
+            for planned_cost in planned:
+                if planned_cost.recurring_cost.pk not in recurred_costs:
+                    self.skip_reasons[planned_cost.recurring_cost.pk] = EnactmentRunCost.SKIP_REASONS.already_enacted
+            planned = [
+                planned_cost for planned_cost in planned
+                if planned_cost.recurring_cost.pk in recurred_costs
+            ]
+
+            transactions = {}
+            for planned_cost in planned:
+                transaction = planned_cost.make_transaction()
+                if transaction:
+                    transactions[planned_cost.recurring_cost.pk] = transaction
+
+            # Postgres returns the primary keys of the bulk-inserted rows,
+            # so the legs can reference the transactions directly
+            Transaction.objects.bulk_create(transactions.values())
+
+            legs = []
+            for planned_cost in planned:
+                transaction = transactions.get(planned_cost.recurring_cost.pk)
+                if transaction:
+                    legs.extend(planned_cost.make_legs(transaction))
+            Leg.objects.bulk_create(legs)
+
+            for recurring_cost_id, transaction in transactions.items():
+                recurred_costs[recurring_cost_id].transaction = transaction
+            RecurredCost.objects.set_transactions({
+                recurred_costs[recurring_cost_id].pk: transaction.pk
+                for recurring_cost_id, transaction
+                in transactions.items()
+            })
+
+            RecurringCost.objects.add_billed({
+                planned_cost.recurring_cost.pk: (abs(planned_cost.amount), 1)
+                for planned_cost
+                in planned
+            })
+            for planned_cost in planned:
+                planned_cost.recurring_cost.billed_amount += abs(planned_cost.amount)
+                planned_cost.recurring_cost.billed_cycles += 1
+
+            return [recurred_costs[planned_cost.recurring_cost.pk] for planned_cost in planned]
+
+    def enact(self):
+        """Plan and write the enactment of all enactable costs
+
+        Returns:
+            list[RecurredCost]: The created RecurredCosts
+        """
+        return self.write(self.plan())
+
+
+def _diff_legs(existing_legs, target_legs):
+    """Compare a transaction's existing legs with the legs it should have
+
+    Legs are matched by account. If an account appears more than once then
+    matching is ambiguous, in which case all the existing legs are replaced.
+
+    Returns:
+        tuple: (legs to create, (leg, new amount) pairs to update, legs to delete)
+    """
+    existing_by_account = {leg.account_id: leg for leg in existing_legs}
+    target_by_account = {leg.account_id: leg for leg in target_legs}
+    if len(existing_by_account) != len(existing_legs) or len(target_by_account) != len(target_legs):
+        return list(target_legs), [], list(existing_legs)
+
+    to_create = [leg for account_id, leg in target_by_account.items() if account_id not in existing_by_account]
+    to_delete = [leg for account_id, leg in existing_by_account.items() if account_id not in target_by_account]
+    to_update = [
+        (leg, target_by_account[account_id].amount)
+        for account_id, leg
+        in existing_by_account.items()
+        if account_id in target_by_account and leg.amount != target_by_account[account_id].amount
+    ]
+    return to_create, to_update, to_delete
+
+
+def _update_leg_amounts(updates):
+    """Update the amounts of many legs using a single UPDATE
+
+    Only the amount is changed. The currency of each leg must remain the same.
+
+    Args:
+        updates (list): (leg, new amount) pairs, as returned by _diff_legs()
+    """
+    if not updates:
+        return
+
+    rows = []
+    params = []
+    for leg, amount in updates:
+        rows.append('(%s::integer, %s::numeric)')
+        params.extend([leg.pk, amount.amount])
+        leg.amount = amount
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE {table} AS leg
+            SET amount = updated.amount
+            FROM (VALUES {rows}) AS updated (id, amount)
+            WHERE leg.id = updated.id
+        """.format(table=Leg._meta.db_table, rows=', '.join(rows)), params)
+
+
+def reconcile_billing_cycle(billing_cycle):
+    """Bring a billing cycle's existing enactment into line with its recurring costs
+
+    The ledger the billing cycle should have is calculated (as per
+    :meth:`BillingCycle.enact_all_costs()`) and compared with the existing
+    RecurredCosts, transactions and legs. Only rows which differ are inserted,
+    updated or deleted. Costs which have been corrected since the billing cycle
+    was enacted therefore keep their existing transactions where possible.
+
+    Costs are re-enabled if they are to be enacted. The caller should run
+    `RecurringCost.objects.disable_if_done()` afterwards.
+
+    Returns:
+        dict: The number of RecurredCosts created, updated, deleted & unchanged,
+        and the number of legs created, updated & deleted.
+    """
+    summary = dict(
+        recurred_costs_created=0,
+        recurred_costs_updated=0,
+        recurred_costs_deleted=0,
+        recurred_costs_unchanged=0,
+        legs_created=0,
+        legs_updated=0,
+        legs_deleted=0,
+    )
+
+    with db_transaction.atomic():
+        existing_recurred_costs = RecurredCost.objects.filter(billing_cycle=billing_cycle)
+        recurred_costs = {
+            recurred_cost.recurring_cost_id: recurred_cost
+            for recurred_cost
+            in existing_recurred_costs.select_related('transaction').prefetch_related('transaction__legs')
+        }
+
+        # Calculate amounts as though this billing cycle had not yet been enacted
+        RecurringCost.objects.add_billed({
+            recurring_cost_id: (-amount, -cycles)
+            for recurring_cost_id, (amount, cycles)
+            in existing_recurred_costs.billed_totals().items()
+        })
+        enactor = BatchEnactor(billing_cycle, include_disabled=True, include_enacted=True)
+        planned = {planned_cost.recurring_cost.pk: planned_cost for planned_cost in enactor.plan()}
+        RecurringCost.objects.filter(pk__in=list(planned), disabled=True).update(disabled=False)
+
+        recurred_costs_to_delete = []
+        transaction_ids_to_delete = []
+        detached_recurred_costs = []
+        attached_recurred_costs = []
+        legs_to_create = []
+        legs_to_update = []
+        legs_to_delete = []
+
+        for recurring_cost_id, recurred_cost in recurred_costs.items():
+            planned_cost = planned.get(recurring_cost_id)
+            transaction = recurred_cost.transaction
+
+            if not planned_cost:
+                # The cost should no longer be enacted for this billing cycle
+                recurred_costs_to_delete.append(recurred_cost.pk)
+                if transaction:
+                    transaction_ids_to_delete.append(transaction.pk)
+                    summary['legs_deleted'] += len(transaction.legs.all())
+                summary['recurred_costs_deleted'] += 1
+                continue
+
+            if not transaction and not planned_cost.amount:
+                summary['recurred_costs_unchanged'] += 1
+            elif not planned_cost.amount:
+                # Nothing to bill any more, so remove the transaction
+                detached_recurred_costs.append(recurred_cost.pk)
+                transaction_ids_to_delete.append(transaction.pk)
+                summary['legs_deleted'] += len(transaction.legs.all())
+                summary['recurred_costs_updated'] += 1
+            elif not transaction:
+                # Previously there was nothing to bill
+                attached_recurred_costs.append((recurred_cost, planned_cost))
+                summary['recurred_costs_updated'] += 1
+            else:
+                to_create, to_update, to_delete = _diff_legs(
+                    list(transaction.legs.all()), planned_cost.make_legs(transaction)
+                )
+                legs_to_create.extend(to_create)
+                legs_to_delete.extend(leg.pk for leg in to_delete)
+                legs_to_update.extend(to_update)
+
+                summary['legs_updated'] += len(to_update)
+                summary['legs_deleted'] += len(to_delete)
+                if to_create or to_update or to_delete:
+                    summary['recurred_costs_updated'] += 1
+                else:
+                    summary['recurred_costs_unchanged'] += 1
+
+        # RecurredCost.transaction is protected, so remove references
+        # before deleting any transactions
+        RecurredCost.objects.filter(pk__in=recurred_costs_to_delete).delete()
+        RecurredCost.objects.filter(pk__in=detached_recurred_costs).update(transaction=None)
+        Transaction.objects.filter(pk__in=transaction_ids_to_delete).delete()
+        Leg.objects.filter(pk__in=legs_to_delete).delete()
+        _update_leg_amounts(legs_to_update)
+
+        if attached_recurred_costs:
+            transactions = [planned_cost.make_transaction() for _, planned_cost in attached_recurred_costs]
+            Transaction.objects.bulk_create(transactions)
+            for (recurred_cost, planned_cost), transaction in zip(attached_recurred_costs, transactions):
+                legs_to_create.extend(planned_cost.make_legs(transaction))
+            RecurredCost.objects.set_transactions({
+                recurred_cost.pk: transaction.pk
+                for (recurred_cost, _), transaction
+                in zip(attached_recurred_costs, transactions)
+            })
+
+        Leg.objects.bulk_create(legs_to_create)
+        summary['legs_created'] = len(legs_to_create)
+
+        # Restore the billing for the costs which remain enacted...
+        RecurringCost.objects.add_billed({
+            recurring_cost_id: (abs(planned_cost.amount), 1)
+            for recurring_cost_id, planned_cost
+            in planned.items()
+            if recurring_cost_id in recurred_costs
+        })
+
+        # ...and enact any costs which were not previously enacted
+        new_planned = [
+            planned_cost for recurring_cost_id, planned_cost
+            in planned.items()
+            if recurring_cost_id not in recurred_costs
+        ]
+        created_ids = {recurred_cost.recurring_cost_id for recurred_cost in enactor.write(new_planned)}
+        summary['recurred_costs_created'] = len(created_ids)
+        summary['legs_created'] += sum(
+            planned_cost.leg_count
+            for planned_cost in new_planned
+            if planned_cost.recurring_cost.pk in created_ids
+        )
+
+    return summary
+
+
+class EnactmentPreview(object):
+    """The charges which enacting a billing cycle would create, calculated without writing anything
+
+    Amounts & splits are calculated by the :class:`BatchEnactor`, so this will
+    exactly match what would be created by :meth:`BillingCycle.enact_all_costs()`.
+    Only costs which have not yet been enacted for the billing cycle are included.
+
+    Attributes:
+        planned (list[PlannedCost]): The costs which would be enacted
+        account_totals (list[(Account, Balance)]): The sum of the legs which would be
+            created in each account, ordered by account name
+        housemate_totals (list[(Housemate, Balance)]): The amount each housemate would
+            be charged, ordered by account name
+    """
+
+    def __init__(self, billing_cycle, recurring_costs=None):
+        from swiftwind.housemates.models import Housemate
+
+        self.billing_cycle = billing_cycle
+        self.planned = BatchEnactor(billing_cycle, recurring_costs).plan()
+
+        totals = {}
+        charges = {}
+        for planned_cost in self.planned:
+            if not planned_cost.amount:
+                continue
+            currency = planned_cost.currency
+            to_account_id = planned_cost.recurring_cost.to_account_id
+            totals[to_account_id] = totals.get(to_account_id, Balance()) + Balance(planned_cost.amount, currency)
+            for split, split_amount in planned_cost.splits:
+                if not split_amount:
+                    continue
+                from_account_id = split.from_account_id
+                totals[from_account_id] = totals.get(from_account_id, Balance()) - Balance(split_amount, currency)
+                charges[from_account_id] = charges.get(from_account_id, Balance()) + Balance(split_amount, currency)
+
+        accounts = Account.objects.in_bulk(list(totals))
+        self.account_totals = sorted(
+            [(accounts[account_id], total) for account_id, total in totals.items()],
+            key=lambda account_total: account_total[0].name,
+        )
+
+        housemates = Housemate.objects.filter(account_id__in=list(charges)).select_related('account', 'user')
+        self.housemate_totals = sorted(
+            [(housemate, charges[housemate.account_id]) for housemate in housemates],
+            key=lambda housemate_total: housemate_total[0].account.name,
+        )
+
+    @property
+    def total(self):
+        """The total amount which would be billed"""
+        return sum((Balance(planned_cost.amount, planned_cost.currency) for planned_cost in self.planned), Balance())
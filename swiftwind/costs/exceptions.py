@@ -13,3 +13,6 @@ class ProvidedBillingCycleBeginsBeforeInitialBillingCycle(Exception): pass
 
 
 class RecurringCostAlreadyEnactedForBillingCycle(Exception): pass
+
+
+class ParallelEnactmentAbandoned(Exception): pass
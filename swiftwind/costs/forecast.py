@@ -0,0 +1,171 @@
+"""Forecasting of the charges housemates will receive in future billing cycles
+
+Rather than calling :meth:`RecurringCost.get_amount()` for every cost in every
+future billing cycle, the forecast is built from two matrices:
+
+* ``amounts``: billing cycles × costs, the amount each cost will bill in each cycle
+* ``charges``: billing cycles × housemates, each amount split between housemates
+
+Both are calculated in a single pass over data loaded using a constant number of
+queries. Amounts are split using :func:`ratio_split`, exactly as enactment does,
+so forecasted charges match what will eventually be billed. As amounts rarely
+vary between cycles, each distinct amount is only split once per cost.
+
+Arrears costs cannot be known in advance, so are estimated as the average
+amount billed per billing cycle so far.
+"""
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import F, Prefetch, Sum
+from hordak.models import Leg
+
+from swiftwind.billing_cycle.models import BillingCycle
+from swiftwind.housemates.models import Housemate
+from .models import RecurringCost, RecurringCostSplit, SplitPlanCache
+
+
+class Forecast(object):
+    """Forecasted charges for each housemate in each future billing cycle
+
+    Attributes:
+        billing_cycles (list[BillingCycle]): The forecasted billing cycles, in date order
+        costs (list[RecurringCost]): The costs included in the forecast
+        housemates (list[Housemate]): The housemates included in the forecast
+        amounts (list[list[Decimal]]): billing cycles × costs
+        charges (list[list[Decimal]]): billing cycles × housemates
+    """
+
+    def __init__(self, as_of=None):
+        self.as_of = as_of or date.today()
+        self.load()
+        self.amounts = self.calculate_amounts()
+        self.charges = self.calculate_charges()
+
+    def load(self):
+        self.billing_cycles = list(
+            BillingCycle.objects.filter(transactions_created=False, end_date__gt=self.as_of).order_by('date_range')
+        )
+        self.costs = list(
+            RecurringCost.objects
+            .filter(disabled=False, archived=False)
+            .select_related('initial_billing_cycle')
+            .prefetch_related(Prefetch('splits', queryset=RecurringCostSplit.objects.order_by('pk')))
+            .order_by('pk')
+        )
+        self.housemates = list(
+            Housemate.objects
+            .filter(account__outbound_costs__in=self.costs)
+            .select_related('account')
+            .distinct()
+            .order_by('account__name')
+        )
+
+        self.billed_arrears = self.load_billed_arrears()
+
+    def load_billed_arrears(self):
+        """Get the signed total billed so far by each arrears cost, using a single query
+
+        Arrears amounts are signed according to the to_account's root account (see
+        get_arrears_amounts()), so may be negative, in which case housemates are credited.
+        RecurringCost.billed_amount only holds the absolute amount, so the total is
+        instead taken from the legs each enactment posted to the cost's to_account.
+
+        Returns:
+            dict: RecurringCost primary keys mapped to the (Decimal) total
+        """
+        arrears_cost_ids = [cost.pk for cost in self.costs if cost.type != RecurringCost.TYPES.normal]
+        if not arrears_cost_ids:
+            return {}
+        return dict(
+            Leg.objects
+            .filter(
+                transaction__recurred_cost__recurring_cost__in=arrears_cost_ids,
+                account=F('transaction__recurred_cost__recurring_cost__to_account'),
+            )
+            .order_by()
+            .values_list('transaction__recurred_cost__recurring_cost')
+            .annotate(total=Sum('amount'))
+        )
+
+    def estimate_amount(self, recurring_cost):
+        """Estimate the per-cycle amount of an arrears cost from its billing history"""
+        if not recurring_cost.billed_cycles:
+            return Decimal('0')
+        billed = self.billed_arrears.get(recurring_cost.pk, Decimal('0'))
+        return (billed / recurring_cost.billed_cycles).quantize(Decimal('0.01'))
+
+    def calculate_amounts(self):
+        amounts = [[Decimal('0')] * len(self.costs) for _ in self.billing_cycles]
+        for j, recurring_cost in enumerate(self.costs):
+            if recurring_cost.type != RecurringCost.TYPES.normal:
+                column = [self.estimate_amount(recurring_cost)] * len(self.billing_cycles)
+            elif not recurring_cost.is_one_off():
+                column = [recurring_cost.fixed_amount] * len(self.billing_cycles)
+            else:
+                # Index the stored installment schedule by billing cycle number
+                initial_sequence = recurring_cost.initial_billing_cycle.sequence
+                column = [
+                    recurring_cost.get_installment(billing_cycle.sequence - initial_sequence + 1)
+                    if billing_cycle.sequence >= initial_sequence else Decimal('0')
+                    for billing_cycle in self.billing_cycles
+                ]
+
+            for k, amount in enumerate(column):
+                amounts[k][j] = amount
+        return amounts
+
+    def calculate_charges(self):
+        """Split each cost's amounts between housemates, summing the results for each billing cycle"""
+        housemate_index = {housemate.account_id: h for h, housemate in enumerate(self.housemates)}
+        charges = [[Decimal('0')] * len(self.housemates) for _ in self.billing_cycles]
+        split_plans = SplitPlanCache(self.costs)
+
+        for j, recurring_cost in enumerate(self.costs):
+            if not split_plans.get_splits(recurring_cost):
+                continue
+
+            for k in range(len(self.billing_cycles)):
+                amount = self.amounts[k][j]
+                if not amount:
+                    continue
+                for split, split_amount in split_plans.split(recurring_cost, amount):
+                    # Splits to accounts which do not belong to a housemate are ignored
+                    h = housemate_index.get(split.from_account_id)
+                    if h is not None:
+                        charges[k][h] += split_amount
+        return charges
+
+    def housemate_totals(self):
+        """The total each housemate will be charged over all forecasted cycles
+
+        Returns:
+            list[(Housemate, Decimal)]
+        """
+        return [
+            (housemate, sum((row[h] for row in self.charges), Decimal('0')))
+            for h, housemate in enumerate(self.housemates)
+        ]
+
+    def rows(self):
+        """Get (billing cycle, charges) pairs, for ease of use in templates"""
+        return list(zip(self.billing_cycles, self.charges))
+
+    def as_dict(self):
+        """Get the forecast in a JSON-serialisable form"""
+        return dict(
+            as_of=str(self.as_of),
+            housemates=[
+                dict(uuid=str(housemate.uuid), name=housemate.account.name)
+                for housemate in self.housemates
+            ],
+            billing_cycles=[
+                dict(
+                    start_date=str(billing_cycle.date_range.lower),
+                    end_date=str(billing_cycle.date_range.upper),
+                    charges=[str(charge) for charge in charges],
+                )
+                for billing_cycle, charges in self.rows()
+            ],
+            totals=[str(total) for _, total in self.housemate_totals()],
+        )
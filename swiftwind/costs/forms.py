@@ -81,7 +81,7 @@ class OneOffCostForm(AbstractCostForm):
             return amount
 
         balance = Balance(amount, currency)
-        billed_amount = self.instance.get_billed_amount()
+        billed_amount = Balance(self.instance.billed_amount, currency)
 
         if balance < billed_amount:
             raise ValidationError(
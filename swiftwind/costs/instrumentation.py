@@ -0,0 +1,233 @@
+"""Instrumentation of billing cycle enactment
+
+Each enactment is recorded as an :class:`EnactmentRun`, along with an
+:class:`EnactmentRunCost` for every cost considered. These record the time
+taken, the number of SQL queries executed, the number of rows written and,
+for costs which were not enacted, the reason why. Use the ``enactment_report``
+management command (or the admin) to find the slowest cycles and costs.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from time import perf_counter
+
+from django.db import connection, connections, DatabaseError
+
+from .models import EnactmentRun, EnactmentRunCost
+
+logger = logging.getLogger(__name__)
+
+
+class _CountingCursor(object):
+    """Wraps a cursor, counting its queries & inserted rows on behalf of a QueryCounter"""
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def execute(self, sql, params=None):
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.counter.record(sql, self.cursor.rowcount)
+
+    def executemany(self, sql, param_list):
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.counter.record(sql, self.cursor.rowcount)
+
+
+class QueryCounter(object):
+    """Count the queries executed on a database connection, and the rows they insert
+
+    Unlike django.test.utils.CaptureQueriesContext this does not rely upon the debug
+    query log, which is limited to 9000 queries. Rows are counted using each cursor's
+    rowcount, so a bulk insert counts every row it inserts.
+
+    Django 1.11 has no connection.execute_wrapper(), so every cursor created by the
+    connection while counting is wrapped instead.
+
+    Usage::
+
+        with QueryCounter(connection) as counter:
+            ...
+        print(counter.queries, counter.rows_inserted)
+    """
+
+    def __init__(self, connection):
+        # Resolve django.db.connection, which is a proxy, to the connection itself
+        self.connection = connections[connection.alias]
+        self.queries = 0
+        self.rows_inserted = 0
+
+    def __enter__(self):
+        self._patched = {}
+        for name in ('make_cursor', 'make_debug_cursor'):
+            self._patched[name] = vars(self.connection).get(name)
+            make_cursor = getattr(self.connection, name)
+            setattr(self.connection, name, self._wrap(make_cursor))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, original in self._patched.items():
+            if original is None:
+                delattr(self.connection, name)
+            else:
+                setattr(self.connection, name, original)
+        return False
+
+    def _wrap(self, make_cursor):
+        return lambda cursor: _CountingCursor(make_cursor(cursor), self)
+
+    def record(self, sql, rowcount):
+        self.queries += 1
+        if sql.lstrip().upper().startswith('INSERT') and rowcount > 0:
+            self.rows_inserted += rowcount
+
+
+@contextmanager
+def _independent_connection(alias):
+    """Use a new database connection for the given alias within this block
+
+    Queries within the block are therefore outside of any transaction
+    open on the current connection, and autocommit.
+    """
+    current = connections[alias]
+    independent = current.__class__(current.settings_dict, alias)
+    connections[alias] = independent
+    try:
+        yield
+    finally:
+        connections[alias] = current
+        independent.close()
+
+
+class EnactmentRecorder(object):
+    """Record an enactment of a billing cycle as an EnactmentRun
+
+    Usage::
+
+        with EnactmentRecorder(billing_cycle, EnactmentRun.MODES.per_cost) as recorder:
+            for recurring_cost in recurring_costs:
+                with recorder.time_cost(recurring_cost) as cost_record:
+                    ...
+                    cost_record.skip_reason = 'disabled'
+
+    The run is saved upon exiting the context, even if the enactment failed. The
+    recorder should be entered outside of the enactment's atomic block. Should the
+    enactment fail within an enclosing transaction (such as that of the enact_costs
+    task, or a batch of ``enact_costs --catch-up``), that transaction will be rolled
+    back, so the run is saved using a separate database connection.
+
+    Runs older than settings.SWIFTWIND_ENACTMENT_RUN_RETENTION_DAYS are deleted
+    whenever a new run is saved. See EnactmentRunQuerySet.prune().
+
+    Args:
+        billing_cycle (BillingCycle): The billing cycle being enacted
+        mode (str): One of EnactmentRun.MODES
+    """
+
+    def __init__(self, billing_cycle, mode):
+        self.billing_cycle = billing_cycle
+        self.mode = mode
+        self.cost_records = []
+        self.run = None
+
+    def __enter__(self):
+        self._counter = QueryCounter(connection)
+        self._counter.__enter__()
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = timedelta(seconds=perf_counter() - self._started)
+        self._counter.__exit__(exc_type, exc_value, traceback)
+
+        if exc_type is None or not connection.in_atomic_block:
+            self._save(duration, succeeded=exc_type is None)
+            return False
+
+        # Failed within an enclosing transaction, which is about to be rolled back
+        try:
+            with _independent_connection(connection.alias):
+                self._save(duration, succeeded=False)
+        except DatabaseError:
+            # Such as when the billing cycle was itself created within the enclosing
+            # transaction. Don't obscure the enactment's own error.
+            logger.exception('Failed to record failed enactment of {}'.format(self.billing_cycle))
+        return False
+
+    def _save(self, duration, succeeded):
+        self.run = EnactmentRun.objects.create(
+            billing_cycle=self.billing_cycle,
+            mode=self.mode,
+            succeeded=succeeded,
+            duration=duration,
+            query_count=self._counter.queries,
+            rows_written=sum(cost_record.rows_written for cost_record in self.cost_records),
+            costs_enacted=len([c for c in self.cost_records if not c.skip_reason]),
+            costs_skipped=len([c for c in self.cost_records if c.skip_reason]),
+        )
+        for cost_record in self.cost_records:
+            cost_record.run = self.run
+        EnactmentRunCost.objects.bulk_create(self.cost_records)
+        EnactmentRun.objects.prune()
+
+    def record_cost(self, recurring_cost, **kwargs):
+        """Record the outcome of a single cost
+
+        Args:
+            recurring_cost (RecurringCost):
+            **kwargs: Any other EnactmentRunCost fields
+
+        Returns:
+            EnactmentRunCost: The (unsaved) record
+        """
+        cost_record = EnactmentRunCost(recurring_cost=recurring_cost, **kwargs)
+        self.cost_records.append(cost_record)
+        return cost_record
+
+    @contextmanager
+    def time_cost(self, recurring_cost):
+        """Time the enactment of a single cost, including the queries it executes
+
+        Yields an EnactmentRunCost upon which skip_reason may be set.
+        """
+        cost_record = self.record_cost(recurring_cost)
+        queries, rows_inserted = self._counter.queries, self._counter.rows_inserted
+        started = perf_counter()
+        yield cost_record
+        cost_record.duration = timedelta(seconds=perf_counter() - started)
+        cost_record.query_count = self._counter.queries - queries
+        cost_record.rows_written = self._counter.rows_inserted - rows_inserted
+
+    def record_batch(self, enactor, planned):
+        """Record the outcome of a BatchEnactor
+
+        Per-cost timings are not available as all costs are processed together,
+        so only rows written and skip reasons are recorded.
+
+        Args:
+            enactor (BatchEnactor): The enactor, after write() has been called
+            planned (list[PlannedCost]): The costs passed to write()
+        """
+        rows_written = {planned_cost.recurring_cost.pk: planned_cost.rows_written for planned_cost in planned}
+        for recurring_cost in enactor.costs:
+            skip_reason = enactor.skip_reasons.get(recurring_cost.pk)
+            if skip_reason:
+                self.record_cost(recurring_cost, skip_reason=skip_reason)
+            else:
+                self.record_cost(recurring_cost, rows_written=rows_written[recurring_cost.pk])
@@ -1,6 +1,8 @@
+import time
 from datetime import date
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
 from swiftwind.billing_cycle.models import BillingCycle
 
@@ -17,11 +19,66 @@ class Command(BaseCommand):
             default=None,
             help="Enact for billing cycles up until this date, in format YYYY-MM-DD. Defaults to today's date.",
         )
+        parser.add_argument(
+            '--catch-up',
+            action='store_true',
+            dest='catch_up',
+            default=False,
+            help="Work through a backlog of billing cycles in date order, committing as we go. "
+                 "If interrupted, running again will resume from the last committed billing cycle.",
+        )
+        parser.add_argument(
+            '--cycles-per-commit',
+            action='store',
+            dest='cycles_per_commit',
+            type=int,
+            default=1,
+            help="When catching up, the number of billing cycles to enact in each database transaction.",
+        )
 
     def handle(self, *args, **options):
         if options.get('as_of'):
             as_of = date(*map(int, options['as_of'].split('-')))
         else:
             as_of = date.today()
+
+        if options.get('catch_up'):
+            self.catch_up(as_of, options.get('cycles_per_commit') or 1)
+            return
+
         for billing_cycle in BillingCycle.objects.filter(start_date__lt=as_of, transactions_created=False):
             billing_cycle.enact_all_costs()
+
+    def catch_up(self, as_of, cycles_per_commit):
+        """Enact all pending billing cycles, `cycles_per_commit` at a time
+
+        Only one batch of billing cycles is held in memory at a time. Progress is
+        tracked by each cycle's `transactions_created` flag, so an interrupted
+        run can simply be restarted.
+        """
+        pending = BillingCycle.objects.filter(start_date__lt=as_of, transactions_created=False).order_by('date_range')
+        total = pending.count()
+        enacted = 0
+        started = time.time()
+
+        self.stdout.write('{} billing cycles to enact'.format(total))
+
+        while True:
+            with transaction.atomic():
+                billing_cycles = list(pending[:cycles_per_commit])
+                for billing_cycle in billing_cycles:
+                    billing_cycle.enact_all_costs()
+
+            if not billing_cycles:
+                break
+
+            enacted += len(billing_cycles)
+            elapsed = time.time() - started
+            self.stdout.write('Enacted {}/{} billing cycles, up to {}. {:.2f} cycles/second'.format(
+                enacted,
+                total,
+                billing_cycles[-1].date_range.lower,
+                enacted / elapsed if elapsed else 0,
+            ))
+
+        self.stdout.write('Done. Enacted {} billing cycles in {:.1f} seconds'.format(enacted, time.time() - started))
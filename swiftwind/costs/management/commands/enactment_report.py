@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Max, Count, DurationField
+
+from swiftwind.costs.models import EnactmentRun, EnactmentRunCost
+
+
+class Command(BaseCommand):
+    help = 'Show the slowest billing cycle enactments and the slowest recurring costs within them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            dest='limit',
+            default=10,
+            help="The number of billing cycles and costs to show.",
+        )
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+
+        runs = EnactmentRun.objects.select_related('billing_cycle').order_by('-duration')[:limit]
+        self.stdout.write('Slowest billing cycle enactments:')
+        if not runs:
+            self.stdout.write('  No enactments have been recorded')
+        for run in runs:
+            self.stdout.write(
+                '  {billing_cycle}: {duration:.3f}s, {queries} queries, {rows} rows written, '
+                '{enacted} costs enacted, {skipped} skipped ({mode}{failed})'.format(
+                    billing_cycle=run.billing_cycle,
+                    duration=run.duration.total_seconds(),
+                    queries=run.query_count,
+                    rows=run.rows_written,
+                    enacted=run.costs_enacted,
+                    skipped=run.costs_skipped,
+                    mode=run.get_mode_display(),
+                    failed=', failed' if not run.succeeded else '',
+                )
+            )
+
+        # Per-cost timings are only recorded when costs are enacted individually
+        costs = (
+            EnactmentRunCost.objects
+            .filter(duration__isnull=False, recurring_cost__isnull=False)
+            .values('recurring_cost__uuid', 'recurring_cost__to_account__name')
+            .annotate(
+                max_duration=Max('duration'),
+                avg_duration=Avg('duration', output_field=DurationField()),
+                avg_queries=Avg('query_count'),
+                runs=Count('run', distinct=True),
+            )
+            .order_by('-max_duration')[:limit]
+        )
+        self.stdout.write('Slowest recurring costs:')
+        if not costs:
+            self.stdout.write('  No per-cost timings have been recorded')
+        for cost in costs:
+            self.stdout.write(
+                '  {uuid} ({account}): max {max:.3f}s, average {avg:.3f}s, '
+                'average {queries:.1f} queries over {runs} enactment(s)'.format(
+                    uuid=cost['recurring_cost__uuid'],
+                    account=cost['recurring_cost__to_account__name'],
+                    max=cost['max_duration'].total_seconds(),
+                    avg=cost['avg_duration'].total_seconds(),
+                    queries=cost['avg_queries'],
+                    runs=cost['runs'],
+                )
+            )
@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from swiftwind.costs.models import RecurringCost, RecurredCost
+
+
+class Command(BaseCommand):
+    help = 'Check the stored billed amount of each recurring cost against the ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            dest='fix',
+            default=False,
+            help="Correct any recurring costs whose stored values do not match the ledger.",
+        )
+
+    def handle(self, *args, **options):
+        ledger_totals = RecurredCost.objects.all().billed_totals()
+        mismatched = 0
+
+        for recurring_cost in RecurringCost.objects.order_by('pk'):
+            amount, cycles = ledger_totals.get(recurring_cost.pk, (Decimal('0'), 0))
+            if recurring_cost.billed_amount == amount and recurring_cost.billed_cycles == cycles:
+                continue
+
+            mismatched += 1
+            self.stdout.write(
+                'Recurring cost {} ({}) has billed_amount={}, billed_cycles={}. '
+                'Ledger has amount={}, cycles={}'.format(
+                    recurring_cost.uuid,
+                    recurring_cost.to_account,
+                    recurring_cost.billed_amount,
+                    recurring_cost.billed_cycles,
+                    amount,
+                    cycles,
+                )
+            )
+            if options['fix']:
+                RecurringCost.objects.filter(pk=recurring_cost.pk).update(
+                    billed_amount=amount,
+                    billed_cycles=cycles,
+                )
+
+        if mismatched and not options['fix']:
+            raise CommandError('{} recurring cost(s) do not match the ledger'.format(mismatched))
+        elif mismatched:
+            self.stdout.write('Fixed {} recurring cost(s)'.format(mismatched))
+        else:
+            self.stdout.write('All recurring costs match the ledger')
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costs', '0017_recurringcost_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringcost',
+            name='billed_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=13),
+        ),
+        migrations.AddField(
+            model_name='recurringcost',
+            name='billed_cycles',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE costs_recurringcost AS cost
+            SET billed_amount = COALESCE((
+                    SELECT SUM(L.amount)
+                    FROM hordak_leg L
+                    INNER JOIN costs_recurredcost RC ON RC.transaction_id = L.transaction_id
+                    WHERE RC.recurring_cost_id = cost.id AND L.amount > 0
+                ), 0),
+                billed_cycles = (
+                    SELECT COUNT(*) FROM costs_recurredcost RC WHERE RC.recurring_cost_id = cost.id
+                )
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+from hordak.utilities.money import ratio_split
+
+
+def calculate_installments(apps, schema_editor):
+    RecurringCost = apps.get_model('costs', 'RecurringCost')
+    one_off_costs = RecurringCost.objects.filter(total_billing_cycles__isnull=False, fixed_amount__isnull=False)
+    for recurring_cost in one_off_costs:
+        recurring_cost.installments = ratio_split(
+            amount=recurring_cost.fixed_amount,
+            ratios=[Decimal('1')] * recurring_cost.total_billing_cycles,
+        )
+        recurring_cost.save(update_fields=['installments'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costs', '0018_recurringcost_billed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringcost',
+            name='installments',
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.DecimalField(decimal_places=2, max_digits=13),
+                blank=True, editable=False, null=True, size=None
+            ),
+        ),
+        migrations.RunPython(calculate_installments, migrations.RunPython.noop),
+    ]
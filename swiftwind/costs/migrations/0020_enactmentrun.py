@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import django_smalluuid.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing_cycle', '0007_billingcycle_sequence'),
+        ('costs', '0019_recurringcost_installments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnactmentRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', django_smalluuid.models.SmallUUIDField(default=django_smalluuid.models.UUIDDefault(), editable=False, unique=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('mode', models.CharField(choices=[('batch', 'Batch'), ('per_cost', 'Per-cost')], max_length=10)),
+                ('succeeded', models.BooleanField(default=True)),
+                ('duration', models.DurationField()),
+                ('query_count', models.PositiveIntegerField()),
+                ('rows_written', models.PositiveIntegerField(default=0)),
+                ('costs_enacted', models.PositiveIntegerField(default=0)),
+                ('costs_skipped', models.PositiveIntegerField(default=0)),
+                ('billing_cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enactment_runs', to='billing_cycle.BillingCycle')),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EnactmentRunCost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('query_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('rows_written', models.PositiveIntegerField(default=0)),
+                ('skip_reason', models.CharField(blank=True, choices=[('disabled', 'Disabled'), ('archived', 'Archived'), ('finished', 'All billing cycles complete'), ('not_ready', 'Initial billing cycle not yet reached'), ('billing_complete', 'Full amount already billed'), ('already_enacted', 'Already enacted for this billing cycle')], max_length=20)),
+                ('recurring_cost', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='enactment_run_costs', to='costs.RecurringCost')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='costs', to='costs.EnactmentRun')),
+            ],
+        ),
+    ]
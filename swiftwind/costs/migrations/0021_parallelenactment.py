@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import django_smalluuid.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing_cycle', '0007_billingcycle_sequence'),
+        ('costs', '0020_enactmentrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParallelEnactment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', django_smalluuid.models.SmallUUIDField(default=django_smalluuid.models.UUIDDefault(), editable=False, unique=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('as_of', models.DateField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('chunks_remaining', models.PositiveIntegerField()),
+                ('failed', models.BooleanField(default=False)),
+                ('billing_cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parallel_enactments', to='billing_cycle.BillingCycle')),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+    ]
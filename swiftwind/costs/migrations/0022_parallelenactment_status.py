@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costs', '0021_parallelenactment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parallelenactment',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('finalised', 'Finalised'), ('compensated', 'Compensated')], default='running', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='parallelenactment',
+            name='last_progress',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='parallelenactment',
+            name='recurred_cost_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE costs_parallelenactment
+            SET status = CASE
+              WHEN chunks_remaining > 0 THEN 'running'
+              WHEN failed THEN 'compensated'
+              ELSE 'finalised'
+            END;
+
+            -- Only the latest enactment of a billing cycle may still be running
+            UPDATE costs_parallelenactment AS enactment
+            SET status = 'compensated', failed = TRUE
+            WHERE status = 'running' AND EXISTS (
+              SELECT 1 FROM costs_parallelenactment AS later
+              WHERE later.billing_cycle_id = enactment.billing_cycle_id AND later.id > enactment.id
+            );
+
+            CREATE UNIQUE INDEX costs_parallelenactment_running_uniq
+              ON costs_parallelenactment (billing_cycle_id)
+              WHERE status = 'running';
+            """,
+            "DROP INDEX costs_parallelenactment_running_uniq;"
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costs', '0022_parallelenactment_status'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recurringcostsplit',
+            options={'base_manager_name': 'objects', 'ordering': ['pk']},
+        ),
+    ]
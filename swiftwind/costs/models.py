@@ -1,8 +1,11 @@
+from datetime import timedelta
 from decimal import Decimal
 
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db import models, connection
 from django.db import transaction as db_transaction
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Count, Sum
 from django.utils import timezone
 from django_smalluuid.models import SmallUUIDField
 from django_smalluuid.models import uuid_default
@@ -10,22 +13,29 @@ from moneyed import Money
 
 from hordak.models import Transaction, Leg
 from hordak.utilities.currency import Balance
-from model_utils import Choices
-from psycopg2._range import DateRange
+from model_utils import Choices, FieldTracker
 
 from swiftwind.billing_cycle.models import BillingCycle
 from .exceptions import CannotEnactUnenactableRecurringCostError, CannotRecreateTransactionOnRecurredCost, \
     NoSplitsFoundForRecurringCost, ProvidedBillingCycleBeginsBeforeInitialBillingCycle, \
-    RecurringCostAlreadyEnactedForBillingCycle
+    RecurringCostAlreadyEnactedForBillingCycle, ParallelEnactmentAbandoned
 from hordak.utilities.money import ratio_split
 
 
 class RecurringCostQuerySet(models.QuerySet):
 
     def disable_if_done(self):
-        """Disable any recurring costs that have completed all their billing cycles"""
-        for cost in self:
-            cost.disable_if_done()
+        """Disable any recurring costs that have completed all their billing cycles
+
+        Only one-off costs are affected. This is performed using a single UPDATE.
+
+        Returns:
+            int: The number of costs which were disabled
+        """
+        return self.one_off().filter(
+            disabled=False,
+            billed_amount__gte=models.F('fixed_amount'),
+        ).update(disabled=True)
 
     def one_off(self):
         """Filter for one-off costs"""
@@ -35,6 +45,33 @@ class RecurringCostQuerySet(models.QuerySet):
         """Filter for recurring costs"""
         return self.filter(total_billing_cycles__isnull=True)
 
+    def add_billed(self, billed):
+        """Add to the billed_amount & billed_cycles of many recurring costs using a single UPDATE
+
+        The values are incremented within the database, so concurrent updates will not be lost.
+        Negative values may be given in order to reverse previous billing.
+
+        Args:
+            billed (dict): Mapping of recurring cost primary keys to (amount, cycles) tuples
+        """
+        if not billed:
+            return
+
+        rows = []
+        params = []
+        for pk, (amount, cycles) in billed.items():
+            rows.append('(%s::integer, %s::numeric, %s::integer)')
+            params.extend([pk, amount, cycles])
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE {table} AS cost
+                SET billed_amount = cost.billed_amount + billed.amount,
+                    billed_cycles = cost.billed_cycles + billed.cycles
+                FROM (VALUES {rows}) AS billed (id, amount, cycles)
+                WHERE cost.id = billed.id
+            """.format(table=self.model._meta.db_table, rows=', '.join(rows)), params)
+
 
 class RecurringCost(models.Model):
     """ Represents recurring costs and one-off costs
@@ -94,15 +131,53 @@ class RecurringCost(models.Model):
     type = models.CharField(max_length=20, choices=TYPES, default=TYPES.normal)
     initial_billing_cycle = models.ForeignKey('billing_cycle.BillingCycle')
     transactions = models.ManyToManyField(Transaction, through='costs.RecurredCost')
+    #: The total amount billed so far, and the number of billing cycles for which this cost
+    #: has been enacted. These mirror what can be calculated from the ledger (see
+    #: get_billed_amount()), but are stored to avoid aggregating over all legs every time
+    #: we need to know if billing is complete. Maintained by RecurringCost.enact(),
+    #: the BatchEnactor, and BillingCycle.unenact_all_costs() / reenact_all_costs().
+    billed_amount = models.DecimalField(max_digits=13, decimal_places=2, default=0, editable=False)
+    billed_cycles = models.PositiveIntegerField(default=0, editable=False)
+    #: The amount to bill in each billing cycle of a one-off cost, i.e. `fixed_amount` split
+    #: across `total_billing_cycles`. Recalculated upon save when either of those fields change.
+    installments = ArrayField(models.DecimalField(max_digits=13, decimal_places=2),
+                              null=True, blank=True, editable=False)
+
+    tracker = FieldTracker(fields=['fixed_amount', 'total_billing_cycles'])
 
     objects = models.Manager.from_queryset(RecurringCostQuerySet)()
 
+    BILLED_FIELDS = ('billed_amount', 'billed_cycles')
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if self._state.adding or self.tracker.has_changed('fixed_amount') or \
+                self.tracker.has_changed('total_billing_cycles'):
+            self.installments = self._calculate_installments()
+
+        if update_fields is None and not force_insert and not self._state.adding and self.pk is not None:
+            # The billed fields are updated in-database (see add_billed()), so
+            # don't overwrite them with the potentially stale values on this instance
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.BILLED_FIELDS
+            ]
+        return super(RecurringCost, self).save(
+            force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields
+        )
+
     @property
     def currency(self):
         # This is a simplification, but probably ok for now as swiftwind probably won't
         # need to deal with multiple currencies given its target audience
         return self.to_account.currencies[0]
 
+    @property
+    def billed_balance(self):
+        """The stored billed_amount as a Balance. Empty if nothing has been billed"""
+        if not self.billed_amount:
+            return Balance()
+        return Balance(self.billed_amount, self.currency)
+
     def get_amount(self, billing_cycle):
         amount = {
             RecurringCost.TYPES.normal: self.get_amount_normal,
@@ -126,23 +201,40 @@ class RecurringCost(models.Model):
         billing_cycle.
         """
         if self.is_one_off():
-            billing_cycle_number = self._get_billing_cycle_number(billing_cycle)
-
-            if billing_cycle_number > self.total_billing_cycles:
-                # A future billing cycle after this one has ended
-                return Decimal('0')
-            else:
-                # This is a current cycle. Split the amount into
-                # equal parts then return the part for this cycle
-                splits = ratio_split(
-                    amount=self.fixed_amount,
-                    ratios=[Decimal('1')] * self.total_billing_cycles,
-                )
-                return splits[billing_cycle_number - 1]
+            return self.get_installment(self._get_billing_cycle_number(billing_cycle))
         else:
             # This is a none-one-off recurring cost, so the logic is simple
             return self.fixed_amount
 
+    def get_installment(self, billing_cycle_number):
+        """Get the amount a one-off cost should bill in the given billing cycle
+
+        Args:
+            billing_cycle_number (int): The 1-indexed billing cycle number, relative
+                                        to the initial billing cycle
+
+        Returns:
+            Decimal: The installment, or zero if the cost has already ended
+        """
+        if billing_cycle_number > self.total_billing_cycles:
+            # A future billing cycle after this one has ended
+            return Decimal('0')
+
+        installments = self.installments
+        if installments is None:
+            # Not yet saved
+            installments = self._calculate_installments()
+        return installments[billing_cycle_number - 1]
+
+    def _calculate_installments(self):
+        """Split fixed_amount into equal parts, one for each billing cycle"""
+        if not self.is_one_off() or self.fixed_amount is None:
+            return None
+        return ratio_split(
+            amount=Decimal(self.fixed_amount),
+            ratios=[Decimal('1')] * self.total_billing_cycles,
+        )
+
     def get_amount_arrears_balance(self, billing_cycle):
         """Get the balance of to_account at the end of billing_cycle"""
         return self.to_account.balance(
@@ -160,16 +252,34 @@ class RecurringCost(models.Model):
         )
 
     def get_billed_amount(self):
-        """Get the total amount billed so far"""
+        """Get the total amount billed so far, as calculated from the ledger
+
+        This is somewhat expensive. Use `billed_amount` unless you need to
+        check the stored value is correct.
+        """
         return Leg.objects.filter(transaction__recurred_cost__recurring_cost=self, amount__gt=0).sum_to_balance()
 
-    def enact(self, billing_cycle, disable_if_done=True):
+    def record_billed(self, amount, cycles=1):
+        """Add the given amount to billed_amount (and cycles to billed_cycles)
+
+        The database is updated immediately, as is this instance.
+        """
+        RecurringCost.objects.add_billed({self.pk: (amount, cycles)})
+        self.billed_amount += amount
+        self.billed_cycles += cycles
+
+    def enact(self, billing_cycle, disable_if_done=True, split_plans=None):
         """Enact this RecurringCost for the given billing cycle
 
         This will:
 
           - Create a RecurredCost and the relevant Transactions & Transaction Legs
           - Mark this RecurringCost as disabled if this is its final billing cycle
+
+        Args:
+            billing_cycle (BillingCycle): The billing cycle to enact this cost for
+            disable_if_done (bool): Disable this cost if it has finished billing
+            split_plans (SplitPlanCache): Optional cache of splits, for use when enacting many costs
         """
         as_of = billing_cycle.date_range.lower
         if not self.is_enactable(as_of):
@@ -177,18 +287,22 @@ class RecurringCost(models.Model):
                 "RecurringCost {} is unenactable.".format(self.uuid)
             )
 
-        if self.has_enacted(billing_cycle):
-            raise RecurringCostAlreadyEnactedForBillingCycle(
-                'RecurringCost cost {} already enacted for {}'.format(self, billing_cycle)
-            )
-
         with db_transaction.atomic():
-            recurred_cost = RecurredCost(
-                recurring_cost=self,
-                billing_cycle=billing_cycle,
-            )
-            recurred_cost.make_transaction()
-            recurred_cost.save()
+            # Claiming the enactment up-front means concurrent enactments
+            # cannot both bill this cost for the same billing cycle
+            recurred_cost = RecurredCost.objects.claim(billing_cycle, [self]).get(self.pk)
+            if not recurred_cost:
+                raise RecurringCostAlreadyEnactedForBillingCycle(
+                    'RecurringCost cost {} already enacted for {}'.format(self, billing_cycle)
+                )
+
+            amount = self.get_amount(billing_cycle)
+            if recurred_cost.make_transaction(split_plans=split_plans, amount=amount):
+                recurred_cost.save(update_fields=['transaction'])
+
+            # The billed amount is the sum of the positive legs, which will be
+            # the absolute amount regardless of the direction of the transaction
+            self.record_billed(abs(amount))
 
         if disable_if_done:
             self.disable_if_done(billing_cycle)
@@ -216,12 +330,26 @@ class RecurringCost(models.Model):
 
     def is_enactable(self, as_of):
         """Can this RecurringCost be enacted"""
-        return \
-            not self.disabled and \
-            not self.archived and \
-            not self._is_finished(as_of) and \
-            self._is_ready(as_of) and \
-            not self._is_billing_complete()
+        return self.get_unenactable_reason(as_of) is None
+
+    def get_unenactable_reason(self, as_of):
+        """Get the reason this RecurringCost cannot be enacted
+
+        Returns:
+            str: One of EnactmentRunCost.SKIP_REASONS, or None if the cost can be enacted
+        """
+        reasons = EnactmentRunCost.SKIP_REASONS
+        if self.disabled:
+            return reasons.disabled
+        if self.archived:
+            return reasons.archived
+        if self._is_finished(as_of):
+            return reasons.finished
+        if not self._is_ready(as_of):
+            return reasons.not_ready
+        if self._is_billing_complete():
+            return reasons.billing_complete
+        return None
 
     def has_enacted(self, billing_cycle):
         """Has this recurring cost already enacted transactions for given billing cycle?"""
@@ -253,7 +381,12 @@ class RecurringCost(models.Model):
         If so, we should not be enacting this RecurringCost.
         """
         if self.is_one_off():
-            last_billing_cycle = self.get_billing_cycles()[self.total_billing_cycles - 1]
+            last_billing_cycle = BillingCycle.objects.filter(
+                sequence=self.initial_billing_cycle.sequence + self.total_billing_cycles - 1
+            ).first()
+            if not last_billing_cycle:
+                # The cost extends beyond the billing cycles which currently exist
+                return False
             return last_billing_cycle.date_range.upper <= as_of
         else:
             return False
@@ -264,7 +397,7 @@ class RecurringCost(models.Model):
         If so, we should not be enacting this RecurringCost.
         """
         if self.is_one_off():
-            return self.get_billed_amount() >= Balance(self.fixed_amount, self.currency)
+            return self.billed_amount >= self.fixed_amount
         else:
             return False
 
@@ -276,20 +409,17 @@ class RecurringCost(models.Model):
                 '{} precedes initial cycle {}'.format(billing_cycle, self.initial_billing_cycle)
             )
 
-        billing_cycle_number = BillingCycle.objects.filter(
-            date_range__contained_by=DateRange(
-                self.initial_billing_cycle.date_range.lower,
-                billing_cycle.date_range.upper,
-                bounds='[]',
-            ),
-        ).count()
-
-        return billing_cycle_number
+        # Billing cycles are adjacent, so the difference in sequence numbers
+        # tells us how many cycles have passed
+        return billing_cycle.sequence - self.initial_billing_cycle.sequence + 1
 
     def get_billing_cycles(self):
-        return BillingCycle.objects.filter(
-            start_date__gte=self.initial_billing_cycle.date_range.lower
-        )[:self.total_billing_cycles]
+        billing_cycles = BillingCycle.objects.filter(sequence__gte=self.initial_billing_cycle.sequence)
+        if self.is_one_off():
+            billing_cycles = billing_cycles.filter(
+                sequence__lt=self.initial_billing_cycle.sequence + self.total_billing_cycles
+            )
+        return billing_cycles
 
     def can_delete(self):
         return not self.transactions.exists()
@@ -306,7 +436,9 @@ class RecurringCostSplitQuerySet(QuerySet):
         Returns:
             list[(RecurringCostSplit, Decimal)]: A list with elements in the form (RecurringCostSplit, Decimal)
         """
-        split_objs = list(self.all())
+        # Iterate over self rather than self.all(), so that any
+        # prefetched splits are used rather than querying again
+        split_objs = list(self)
         if not split_objs:
             raise NoSplitsFoundForRecurringCost()
 
@@ -331,11 +463,185 @@ class RecurringCostSplit(models.Model):
 
     class Meta:
         base_manager_name = 'objects'
+        # The order determines which splits receive any remainder when the amount
+        # cannot be divided exactly. See ratio_split()
+        ordering = ['pk']
         unique_together = (
             ('recurring_cost', 'from_account'),
         )
 
 
+class SplitPlanCache(object):
+    """Caches how recurring costs are split, for use throughout an enactment run
+
+    The splits for all the given costs are loaded using a single query (costs
+    with prefetched splits are used as-is), and the results of ratio_split()
+    are memoised for each cost & amount.
+
+    Usage::
+
+        split_plans = SplitPlanCache(recurring_costs)
+        split_plans.split(recurring_cost, amount)
+
+    Args:
+        recurring_costs (iterable[RecurringCost]): The costs which will be split
+    """
+
+    def __init__(self, recurring_costs=()):
+        self._splits = {}
+        self._split_amounts = {}
+        self.add(recurring_costs)
+
+    def add(self, recurring_costs):
+        """Load the splits for the given costs, if not already loaded"""
+        to_load = []
+        for recurring_cost in recurring_costs:
+            if recurring_cost.pk in self._splits:
+                continue
+            if 'splits' in getattr(recurring_cost, '_prefetched_objects_cache', {}):
+                # May have been prefetched in any order
+                self._splits[recurring_cost.pk] = sorted(recurring_cost.splits.all(), key=lambda split: split.pk)
+            else:
+                to_load.append(recurring_cost.pk)
+
+        if to_load:
+            for recurring_cost_id in to_load:
+                self._splits[recurring_cost_id] = []
+            for split in RecurringCostSplit.objects.filter(recurring_cost_id__in=to_load).order_by('pk'):
+                self._splits[split.recurring_cost_id].append(split)
+
+    def get_splits(self, recurring_cost):
+        """Get the RecurringCostSplits for the given cost, in primary key order"""
+        if recurring_cost.pk not in self._splits:
+            self.add([recurring_cost])
+        return self._splits[recurring_cost.pk]
+
+    def split(self, recurring_cost, amount):
+        """Split amount between the cost's splits. Equivalent to RecurringCostSplitQuerySet.split()
+
+        Returns:
+            list[(RecurringCostSplit, Decimal)]
+        """
+        key = (recurring_cost.pk, amount)
+        if key not in self._split_amounts:
+            split_objs = self.get_splits(recurring_cost)
+            if not split_objs:
+                raise NoSplitsFoundForRecurringCost()
+            split_amounts = ratio_split(amount, [split_obj.portion for split_obj in split_objs])
+            self._split_amounts[key] = list(zip(split_objs, split_amounts))
+        return self._split_amounts[key]
+
+
+class RecurredCostQuerySet(QuerySet):
+
+    def claim(self, billing_cycle, recurring_costs):
+        """Atomically claim the enactment of the given costs for a billing cycle
+
+        A RecurredCost (without a transaction) is inserted for each cost using
+        INSERT ... ON CONFLICT DO NOTHING. Costs which have already been enacted for the
+        billing cycle, including by a concurrent enactment, are skipped rather than
+        raising an error. The caller should create the transactions within the same
+        database transaction.
+
+        Args:
+            billing_cycle (BillingCycle):
+            recurring_costs (list[RecurringCost]):
+
+        Returns:
+            dict: Recurring cost primary keys mapped to the claimed (saved) RecurredCosts
+        """
+        recurring_costs = {recurring_cost.pk: recurring_cost for recurring_cost in recurring_costs}
+        if not recurring_costs:
+            return {}
+
+        uuid_field = self.model._meta.get_field('uuid')
+        timestamp = timezone.now()
+        uuids = {}
+        rows = []
+        params = []
+        for recurring_cost_id in recurring_costs:
+            uuids[recurring_cost_id] = uuid_field.get_default()
+            rows.append('(%s, %s, %s, %s)')
+            params.extend([
+                uuid_field.get_db_prep_value(uuids[recurring_cost_id], connection),
+                timestamp,
+                recurring_cost_id,
+                billing_cycle.pk,
+            ])
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO {table} (uuid, {timestamp}, recurring_cost_id, billing_cycle_id)
+                VALUES {rows}
+                ON CONFLICT (recurring_cost_id, billing_cycle_id) DO NOTHING
+                RETURNING id, recurring_cost_id
+            """.format(
+                table=self.model._meta.db_table,
+                timestamp=connection.ops.quote_name('timestamp'),
+                rows=', '.join(rows),
+            ), params)
+            claimed = cursor.fetchall()
+
+        return {
+            recurring_cost_id: self.model(
+                pk=pk,
+                uuid=uuids[recurring_cost_id],
+                timestamp=timestamp,
+                recurring_cost=recurring_costs[recurring_cost_id],
+                billing_cycle=billing_cycle,
+            )
+            for pk, recurring_cost_id
+            in claimed
+        }
+
+    def set_transactions(self, transaction_ids):
+        """Set the transaction of many RecurredCosts using a single UPDATE
+
+        Args:
+            transaction_ids (dict): RecurredCost primary keys mapped to transaction primary keys
+        """
+        if not transaction_ids:
+            return
+
+        rows = []
+        params = []
+        for pk, transaction_id in transaction_ids.items():
+            rows.append('(%s::integer, %s::integer)')
+            params.extend([pk, transaction_id])
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE {table} AS recurred_cost
+                SET transaction_id = linked.transaction_id
+                FROM (VALUES {rows}) AS linked (id, transaction_id)
+                WHERE recurred_cost.id = linked.id
+            """.format(table=self.model._meta.db_table, rows=', '.join(rows)), params)
+
+    def billed_totals(self):
+        """Get the amount billed & number of billing cycles for each recurring cost
+
+        Only the recurred costs within this queryset are considered.
+
+        Returns:
+            dict: Mapping of recurring cost primary keys to (amount, cycles) tuples
+        """
+        cycles = dict(
+            self.values('recurring_cost').annotate(cycles=Count('pk')).values_list('recurring_cost', 'cycles')
+        )
+        amounts = dict(
+            Leg.objects
+            .filter(transaction__recurred_cost__in=self, amount__gt=0)
+            .values('transaction__recurred_cost__recurring_cost')
+            .annotate(total=Sum('amount'))
+            .values_list('transaction__recurred_cost__recurring_cost', 'total')
+        )
+        return {
+            recurring_cost_id: (amounts.get(recurring_cost_id, Decimal('0')), total_cycles)
+            for recurring_cost_id, total_cycles
+            in cycles.items()
+        }
+
+
 class RecurredCost(models.Model):
     """A record of a recurring cost which has been enacted.
 
@@ -348,26 +654,39 @@ class RecurredCost(models.Model):
     transaction = models.OneToOneField(Transaction, related_name='recurred_cost', unique=True, null=True,
                                        on_delete=models.PROTECT)
 
+    objects = models.Manager.from_queryset(RecurredCostQuerySet)()
+
     class Meta:
         unique_together = (
             # A RecurringCost should only be enacted once per billing cycle
             ('recurring_cost', 'billing_cycle'),
         )
 
-    def make_transaction(self):
+    def make_transaction(self, split_plans=None, amount=None):
         """Create the transaction for this RecurredCost
 
-        May only be used to create the RecurredCost's initial transaction.
+        May only be used to create the RecurredCost's initial transaction. The
+        RecurredCost itself may either be unsaved, or claimed via RecurredCostQuerySet.claim().
+
+        The recurring cost's billed amount is not updated, that is the responsibility
+        of the caller (see RecurringCost.enact()).
+
+        Args:
+            split_plans (SplitPlanCache): Optional cache of splits. If not given the
+                cost's splits will be queried (unless they have been prefetched).
+            amount (Decimal): The amount to bill, if already known. Calculated
+                using RecurringCost.get_amount() if not given.
 
         Returns:
             Transaction: The created transaction, also assigned to self.transaction. None if the amount is zero.
         """
-        if self.pk:
+        if self.transaction_id:
             raise CannotRecreateTransactionOnRecurredCost(
                 'The transaction for this recurred cost has already been created. You cannot create it again.'
             )
 
-        amount = self.recurring_cost.get_amount(self.billing_cycle)
+        if amount is None:
+            amount = self.recurring_cost.get_amount(self.billing_cycle)
 
         # It is quite possible that there will be nothing to bill, in which
         # case we cannot create a transaction with no legs, nor can we create
@@ -380,28 +699,191 @@ class RecurredCost(models.Model):
             date=self.billing_cycle.date_range.lower
         )
 
-        # Use the SplitManager's custom queryset's split() method to get the
-        # amount to be billed for each split
-        splits = self.recurring_cost.splits.all().split(amount)
+        if split_plans is not None:
+            splits = split_plans.split(self.recurring_cost, amount)
+        else:
+            # Use the SplitManager's custom queryset's split() method to get the
+            # amount to be billed for each split
+            splits = self.recurring_cost.splits.all().split(amount)
 
         # Create the transaction leg for the outbound funds
         # (normally to an expense account)
-        self.transaction.legs.add(Leg.objects.create(
+        Leg.objects.create(
             transaction=self.transaction,
             amount=Money(amount, self.recurring_cost.currency),
-            account=self.recurring_cost.to_account,
-        ))
+            account_id=self.recurring_cost.to_account_id,
+        )
 
         for split, split_amount in splits:
             # Create the transaction legs for the inbound funds
             # (from housemate accounts)
             if split_amount:
-                self.transaction.legs.add(Leg.objects.create(
+                Leg.objects.create(
                     transaction=self.transaction,
                     amount=Money(split_amount * -1, self.recurring_cost.currency),
-                    account=split.from_account,
-                ))
+                    account_id=split.from_account_id,
+                )
 
         return self.transaction
 
 
+class EnactmentRunQuerySet(models.QuerySet):
+
+    def prune(self, as_of=None):
+        """Delete runs older than settings.SWIFTWIND_ENACTMENT_RUN_RETENTION_DAYS
+
+        Does nothing if the setting is None, in which case runs are kept indefinitely.
+
+        Args:
+            as_of (datetime): The time to measure the age of runs from. Defaults to now.
+        """
+        retention_days = settings.SWIFTWIND_ENACTMENT_RUN_RETENTION_DAYS
+        if retention_days is None:
+            return
+        cutoff = (as_of or timezone.now()) - timedelta(days=retention_days)
+        return self.filter(timestamp__lt=cutoff).delete()
+
+
+class EnactmentRun(models.Model):
+    """A record of a billing cycle's enactment, used to diagnose slow enactments
+
+    See swiftwind.costs.instrumentation.EnactmentRecorder
+    """
+    MODES = Choices(
+        ('batch', 'Batch'),
+        ('per_cost', 'Per-cost'),
+    )
+
+    uuid = SmallUUIDField(default=uuid_default(), editable=False)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    billing_cycle = models.ForeignKey('billing_cycle.BillingCycle', related_name='enactment_runs')
+    mode = models.CharField(max_length=10, choices=MODES)
+    succeeded = models.BooleanField(default=True)
+    duration = models.DurationField()
+    query_count = models.PositiveIntegerField()
+    rows_written = models.PositiveIntegerField(default=0)
+    costs_enacted = models.PositiveIntegerField(default=0)
+    costs_skipped = models.PositiveIntegerField(default=0)
+
+    objects = EnactmentRunQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-timestamp']
+
+    def __str__(self):
+        return 'Enactment of {} at {}'.format(self.billing_cycle, self.timestamp)
+
+
+class EnactmentRunCost(models.Model):
+    """A record of a single cost within an EnactmentRun"""
+    SKIP_REASONS = Choices(
+        ('disabled', 'Disabled'),
+        ('archived', 'Archived'),
+        ('finished', 'All billing cycles complete'),
+        ('not_ready', 'Initial billing cycle not yet reached'),
+        ('billing_complete', 'Full amount already billed'),
+        ('already_enacted', 'Already enacted for this billing cycle'),
+    )
+
+    run = models.ForeignKey(EnactmentRun, related_name='costs', on_delete=models.CASCADE)
+    recurring_cost = models.ForeignKey(RecurringCost, related_name='enactment_run_costs',
+                                       null=True, on_delete=models.SET_NULL)
+    #: Timings & query counts are only available when costs are enacted one at a time,
+    #: as the batch enactor processes all costs together
+    duration = models.DurationField(null=True, blank=True)
+    query_count = models.PositiveIntegerField(null=True, blank=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    skip_reason = models.CharField(max_length=20, choices=SKIP_REASONS, blank=True)
+
+
+class ParallelEnactmentQuerySet(models.QuerySet):
+
+    def running(self):
+        return self.filter(status=ParallelEnactment.STATUSES.running)
+
+    def stale(self, as_of=None):
+        """Get running enactments which have made no progress for settings.SWIFTWIND_PARALLEL_ENACTMENT_TIMEOUT_MINUTES
+
+        Most likely a worker died mid-chunk, in which case the enactment
+        would otherwise never be finalised or compensated.
+
+        Args:
+            as_of (datetime): The time to measure progress from. Defaults to now.
+        """
+        timeout = timedelta(minutes=settings.SWIFTWIND_PARALLEL_ENACTMENT_TIMEOUT_MINUTES)
+        return self.running().filter(last_progress__lt=(as_of or timezone.now()) - timeout)
+
+
+class ParallelEnactment(models.Model):
+    """Tracks a billing cycle being enacted in chunks by many workers
+
+    See swiftwind.costs.tasks.enact_costs_parallel(). Each chunk decrements
+    `chunks_remaining` as it completes, and the final chunk to complete either
+    finalises the billing cycle or, if any chunk failed, compensates for it.
+    Stale enactments are compensated by `reap_parallel_enactments`.
+
+    Only one enactment may be running for each billing cycle. This is enforced
+    by a partial unique index, see migration 0022.
+    """
+    STATUSES = Choices(
+        ('running', 'Running'),
+        ('finalised', 'Finalised'),
+        ('compensated', 'Compensated'),
+    )
+
+    uuid = SmallUUIDField(default=uuid_default(), editable=False)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    billing_cycle = models.ForeignKey('billing_cycle.BillingCycle', related_name='parallel_enactments')
+    #: The as_of & chunk_size the enactment was started with, used to enact the following billing cycle
+    as_of = models.DateField()
+    chunk_size = models.PositiveIntegerField()
+    chunks_remaining = models.PositiveIntegerField()
+    failed = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUSES, default=STATUSES.running)
+    #: Updated as each chunk completes. See ParallelEnactmentQuerySet.stale()
+    last_progress = models.DateTimeField(default=timezone.now)
+    #: The RecurredCosts created by completed chunks, which are deleted should the enactment be compensated
+    recurred_cost_ids = ArrayField(models.IntegerField(), default=list)
+
+    objects = ParallelEnactmentQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-timestamp']
+
+    def __str__(self):
+        return 'Parallel enactment of {} at {}'.format(self.billing_cycle, self.timestamp)
+
+    def complete_chunk(self, failed=False, recurred_cost_ids=()):
+        """Record the completion of a chunk
+
+        Should be called within the same database transaction as the chunk's enactment,
+        so that the billing cycle cannot be finalised before the chunk is committed.
+        The row remains locked until that transaction ends.
+
+        Args:
+            failed (bool): The chunk failed
+            recurred_cost_ids (list[int]): The RecurredCosts created by the chunk
+
+        Returns:
+            bool: True if this was the final chunk to complete
+
+        Raises:
+            ParallelEnactmentAbandoned: The enactment is no longer running, having been
+                compensated in the meantime. The chunk's enactment must be rolled back.
+        """
+        updates = dict(chunks_remaining=models.F('chunks_remaining') - 1, last_progress=timezone.now())
+        if failed:
+            updates['failed'] = True
+        if recurred_cost_ids:
+            updates['recurred_cost_ids'] = models.Func(
+                models.F('recurred_cost_ids'), models.Value(list(recurred_cost_ids)),
+                function='array_cat', output_field=ArrayField(models.IntegerField()),
+            )
+
+        with db_transaction.atomic():
+            if not ParallelEnactment.objects.running().filter(pk=self.pk).update(**updates):
+                raise ParallelEnactmentAbandoned('{} is no longer running'.format(self))
+            self.chunks_remaining, self.failed = (
+                ParallelEnactment.objects.filter(pk=self.pk).values_list('chunks_remaining', 'failed').get()
+            )
+        return self.chunks_remaining == 0
@@ -1,10 +1,18 @@
+import logging
 from datetime import date
 
 from celery import shared_task
-from django.db import transaction
+from django.db import transaction, IntegrityError
 
+from swiftwind.accounts.models import StatementSnapshot
 from swiftwind.billing_cycle.models import BillingCycle
-from swiftwind.costs.models import RecurringCost
+from swiftwind.costs.exceptions import ParallelEnactmentAbandoned
+from swiftwind.costs.models import RecurringCost, ParallelEnactment
+
+logger = logging.getLogger(__name__)
+
+#: The number of recurring costs each worker should enact when enacting in parallel
+ENACT_CHUNK_SIZE = 50
 
 
 @shared_task
@@ -19,7 +27,179 @@ def enact_costs(as_of=None):
 @shared_task
 @transaction.atomic()
 def disable_costs():
-    """Disable any costs that have completed all their billing cycles"""
-    RecurringCost.objects.all().disable_if_done()
+    """Disable any costs that have completed all their billing cycles
+
+    Returns:
+        int: The number of costs which were disabled
+    """
+    return RecurringCost.objects.disable_if_done()
+
+
+def _parse_date(value):
+    # Dates arrive as strings when passed through the (JSON) message broker
+    if isinstance(value, str):
+        return date(*map(int, value.split('-')))
+    return value
+
+
+@shared_task
+def enact_costs_parallel(as_of=None, chunk_size=ENACT_CHUNK_SIZE):
+    """Enact costs as per enact_costs(), but spread each billing cycle's costs across many workers
+
+    Billing cycles are still enacted one at a time, in date order, as arrears costs
+    depend upon the transactions created in the previous billing cycle. Each cycle's
+    costs are split into chunks which are enacted in parallel by `enact_cost_chunk`.
+    Progress is tracked by a ParallelEnactment, so no Celery result backend is needed.
+    Once all chunks have succeeded `finalise_billing_cycle` marks the cycle as complete
+    and moves on to the next cycle.
+
+    If any chunk fails then `compensate_billing_cycle` deletes whatever the other
+    chunks created for the cycle, and no further cycles are enacted. Should a worker
+    die mid-chunk, `reap_parallel_enactments` compensates once the enactment is stale.
+
+    Does nothing if the billing cycle is already being enacted in parallel.
+
+    Args:
+        as_of (date): Enact billing cycles which start before this date. Defaults to today.
+        chunk_size (int): The maximum number of costs to be enacted by each worker
+    """
+    as_of = _parse_date(as_of) or date.today()
+    billing_cycle = BillingCycle.objects.filter(
+        start_date__lt=as_of,
+        transactions_created=False,
+    ).order_by('date_range').first()
+    if not billing_cycle:
+        return
+
+    cost_ids = list(
+        RecurringCost.objects.filter(disabled=False, archived=False).order_by('pk').values_list('pk', flat=True)
+    )
+    chunks = [cost_ids[i:i + chunk_size] for i in range(0, len(cost_ids), chunk_size)]
+    try:
+        with transaction.atomic():
+            enactment = ParallelEnactment.objects.create(
+                billing_cycle=billing_cycle,
+                as_of=as_of,
+                chunk_size=chunk_size,
+                chunks_remaining=len(chunks),
+            )
+    except IntegrityError:
+        # Only one enactment may run per billing cycle
+        logger.warning('{} is already being enacted in parallel'.format(billing_cycle))
+        return
+
+    if not chunks:
+        finalise_billing_cycle.delay(enactment.pk)
+        return
+
+    for chunk in chunks:
+        enact_cost_chunk.delay(enactment.pk, chunk)
+
+
+@shared_task
+def enact_cost_chunk(parallel_enactment_id, recurring_cost_ids):
+    """Enact the given recurring costs for a billing cycle
+
+    The final chunk to complete will finalise or compensate the billing cycle.
+
+    Returns:
+        list[int]: The primary keys of the RecurredCosts created
+    """
+    from swiftwind.costs.enactment import BatchEnactor
+
+    enactment = ParallelEnactment.objects.select_related('billing_cycle').get(pk=parallel_enactment_id)
+    recurred_costs = []
+    try:
+        with transaction.atomic():
+            # No point enacting anything if another chunk has already failed
+            if enactment.status == ParallelEnactment.STATUSES.running and not enactment.failed:
+                recurring_costs = RecurringCost.objects.filter(pk__in=recurring_cost_ids)
+                recurred_costs = BatchEnactor(enactment.billing_cycle, recurring_costs).enact()
+            # Rolls back this chunk should the enactment have been compensated meanwhile
+            is_final_chunk = enactment.complete_chunk(
+                recurred_cost_ids=[recurred_cost.pk for recurred_cost in recurred_costs]
+            )
+    except ParallelEnactmentAbandoned:
+        raise
+    except Exception:
+        try:
+            if enactment.complete_chunk(failed=True):
+                compensate_billing_cycle.delay(enactment.pk)
+        except ParallelEnactmentAbandoned:
+            pass
+        raise
+
+    if is_final_chunk:
+        if enactment.failed:
+            compensate_billing_cycle.delay(enactment.pk)
+        else:
+            finalise_billing_cycle.delay(enactment.pk)
+
+    return [recurred_cost.pk for recurred_cost in recurred_costs]
+
+
+@shared_task
+def finalise_billing_cycle(parallel_enactment_id):
+    """Mark a billing cycle as enacted once all its chunks have succeeded, then enact the next cycle"""
+    with transaction.atomic():
+        enactment = ParallelEnactment.objects.select_for_update().get(pk=parallel_enactment_id)
+        if enactment.status != ParallelEnactment.STATUSES.running:
+            # Reaped meanwhile
+            return
+        enactment.status = ParallelEnactment.STATUSES.finalised
+        enactment.save(update_fields=['status'])
+
+        billing_cycle = BillingCycle.objects.select_for_update().get(pk=enactment.billing_cycle_id)
+        billing_cycle.transactions_created = True
+        billing_cycle.save()
+        StatementSnapshot.objects.invalidate(billing_cycle)
+        RecurringCost.objects.disable_if_done()
+
+    enact_costs_parallel.delay(as_of=str(enactment.as_of), chunk_size=enactment.chunk_size)
+
+
+def _compensate(enactment):
+    # The enactment must be locked by the caller
+    if enactment.status != ParallelEnactment.STATUSES.running:
+        return
+    enactment.status = ParallelEnactment.STATUSES.compensated
+    enactment.failed = True
+    enactment.save(update_fields=['status', 'failed'])
+
+    billing_cycle = BillingCycle.objects.select_for_update().get(pk=enactment.billing_cycle_id)
+    if not billing_cycle.transactions_created:
+        billing_cycle.delete_partial_enactment(enactment.recurred_cost_ids)
+
+
+@shared_task
+def compensate_billing_cycle(parallel_enactment_id):
+    """Undo a partially enacted billing cycle after one of its chunks has failed
+
+    Only the RecurredCosts created by this enactment's chunks are deleted.
+    """
+    with transaction.atomic():
+        _compensate(ParallelEnactment.objects.select_for_update().get(pk=parallel_enactment_id))
+
+
+@shared_task
+def reap_parallel_enactments():
+    """Compensate for parallel enactments which have stopped making progress
 
+    Should a worker die mid-chunk, its enactment's chunks_remaining never reaches
+    zero, so it is neither finalised nor compensated. The dead chunk's transaction
+    will have been rolled back, so only the completed chunks need compensating.
+    See ParallelEnactmentQuerySet.stale().
 
+    Returns:
+        int: The number of enactments which were compensated
+    """
+    reaped = 0
+    for enactment_id in ParallelEnactment.objects.stale().values_list('pk', flat=True):
+        with transaction.atomic():
+            # Checked again once locked, as a chunk may have completed meanwhile
+            enactment = ParallelEnactment.objects.stale().select_for_update().filter(pk=enactment_id).first()
+            if enactment:
+                logger.warning('Compensating for stale {}'.format(enactment))
+                _compensate(enactment)
+                reaped += 1
+    return reaped
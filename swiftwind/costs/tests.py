@@ -1,13 +1,20 @@
 from decimal import Decimal
 
-from datetime import date
+from datetime import date, timedelta
+from io import StringIO
+from unittest.mock import patch
+from celery import current_app
+from django.core.management.base import CommandError
+from django.db.models import F
 from django.db.utils import IntegrityError
-from django.db import transaction as db_transaction, transaction
+from django.db import transaction as db_transaction, transaction, connection
 from django.test import TestCase
 from django.test.testcases import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
+from django.utils import timezone
 from hordak.models import Account
-from hordak.models.core import Transaction
+from hordak.models.core import Transaction, Leg
 from hordak.tests.utils import BalanceUtils
 from hordak.utilities.currency import Balance
 from moneyed import Money
@@ -15,13 +22,18 @@ from moneyed import Money
 from swiftwind.billing_cycle.models import BillingCycle
 from swiftwind.costs import tasks
 from swiftwind.costs.exceptions import ProvidedBillingCycleBeginsBeforeInitialBillingCycle, \
-    CannotEnactUnenactableRecurringCostError, RecurringCostAlreadyEnactedForBillingCycle
+    CannotEnactUnenactableRecurringCostError, RecurringCostAlreadyEnactedForBillingCycle, ParallelEnactmentAbandoned
+from swiftwind.costs.enactment import BatchEnactor, get_arrears_amounts
+from swiftwind.costs.forecast import Forecast
+from swiftwind.costs.instrumentation import QueryCounter
 from swiftwind.costs.management.commands.enact_costs import Command as EnactCostsCommand
-from swiftwind.costs.models import RecurredCost
+from swiftwind.costs.management.commands.enactment_report import Command as EnactmentReportCommand
+from swiftwind.costs.management.commands.verify_billed_amounts import Command as VerifyBilledAmountsCommand
+from swiftwind.costs.models import RecurredCost, ParallelEnactment
 from swiftwind.housemates.models import Housemate
 from swiftwind.utilities.testing import DataProvider
 from .forms import RecurringCostForm, OneOffCostForm, CreateRecurringCostForm, CreateOneOffCostForm
-from .models import RecurringCost, RecurringCostSplit
+from .models import RecurringCost, RecurringCostSplit, SplitPlanCache, EnactmentRun, EnactmentRunCost
 
 
 class RecurringCostModelTriggerTestCase(DataProvider, TransactionTestCase):
@@ -203,6 +215,39 @@ class RecurringCostModelTestCase(DataProvider, BalanceUtils, TestCase):
         self.assertEqual(recurring_cost.get_amount(self.billing_cycle_3), Decimal('33.34'))
         self.assertEqual(recurring_cost.get_amount(self.billing_cycle_4), Decimal('0'))
 
+    def test_installments(self):
+        recurring_cost = RecurringCost.objects.create(
+            to_account=self.to_account,
+            fixed_amount=100,
+            type=RecurringCost.TYPES.normal,
+            initial_billing_cycle=self.billing_cycle_1,
+            total_billing_cycles=3,
+        )
+        self.add_split(recurring_cost)
+        recurring_cost.refresh_from_db()
+        self.assertEqual(recurring_cost.installments, [Decimal('33.33'), Decimal('33.33'), Decimal('33.34')])
+
+        recurring_cost.total_billing_cycles = 2
+        recurring_cost.save()
+        recurring_cost.refresh_from_db()
+        self.assertEqual(recurring_cost.installments, [Decimal('50'), Decimal('50')])
+
+        recurring_cost.fixed_amount = 10
+        recurring_cost.save()
+        recurring_cost.refresh_from_db()
+        self.assertEqual(recurring_cost.installments, [Decimal('5'), Decimal('5')])
+
+    def test_installments_recurring(self):
+        recurring_cost = RecurringCost.objects.create(
+            to_account=self.to_account,
+            fixed_amount=100,
+            type=RecurringCost.TYPES.normal,
+            initial_billing_cycle=self.billing_cycle_1,
+        )
+        self.add_split(recurring_cost)
+        recurring_cost.refresh_from_db()
+        self.assertEqual(recurring_cost.installments, None)
+
     def test_one_off_arrears_balance_get_amount(self):
         """type=arrears_balance cannot have arrears_transactions set"""
         with self.assertRaises(IntegrityError):
@@ -403,6 +448,27 @@ class RecurringCostModelTransactionTestCase(DataProvider, BalanceUtils, Transact
         self.assertBalanceEqual(split1.from_account.balance(), -100)
         self.assertBalanceEqual(split2.from_account.balance(), -100)
 
+    def test_enact_splits_in_pk_order(self):
+        with db_transaction.atomic():
+            recurring_cost = RecurringCost.objects.create(
+                to_account=self.to_account,
+                fixed_amount=100,
+                type=RecurringCost.TYPES.normal,
+                initial_billing_cycle=self.billing_cycle_1,
+            )
+            splits = [self.add_split(recurring_cost, account_currency='GBP') for _ in range(3)]
+        # Updating a row moves it to the end of the table, so an unordered query would return it last
+        splits[0].save()
+
+        # As split by the BatchEnactor
+        expected = {
+            split.from_account_id: split_amount
+            for split, split_amount in SplitPlanCache([recurring_cost]).split(recurring_cost, Decimal('100'))
+        }
+        RecurringCost.objects.get(pk=recurring_cost.pk).enact(self.billing_cycle_1)
+        for split in splits:
+            self.assertBalanceEqual(split.from_account.balance(), -expected[split.from_account_id])
+
     def test_one_off_enact(self):
         with db_transaction.atomic():
             recurring_cost = RecurringCost.objects.create(
@@ -574,6 +640,33 @@ class RecurringCostModelTransactionTestCase(DataProvider, BalanceUtils, Transact
         self.assertEqual(self.billing_cycle_3.transactions_created, False)
         self.assertEqual(self.billing_cycle_4.transactions_created, False)
 
+    def test_enact_costs_command_catch_up(self):
+        with db_transaction.atomic():
+            recurring_cost = RecurringCost.objects.create(
+                to_account=self.to_account,
+                fixed_amount=100,
+                type=RecurringCost.TYPES.normal,
+                initial_billing_cycle=self.billing_cycle_1,
+            )
+            split1 = self.add_split(recurring_cost, account_currency='GBP')
+            split2 = self.add_split(recurring_cost, account_currency='GBP')
+
+        # Simulate a previous run which was interrupted after the first cycle
+        self.billing_cycle_1.enact_all_costs()
+
+        stdout = StringIO()
+        EnactCostsCommand(stdout=stdout).handle(as_of='2000-03-05', catch_up=True, cycles_per_commit=1)
+
+        self.assertBalanceEqual(self.to_account.balance(), -300)
+        self.assertBalanceEqual(split1.from_account.balance(), -150)
+        self.assertBalanceEqual(split2.from_account.balance(), -150)
+
+        self.billing_cycle_3.refresh_from_db()
+        self.billing_cycle_4.refresh_from_db()
+        self.assertEqual(self.billing_cycle_3.transactions_created, True)
+        self.assertEqual(self.billing_cycle_4.transactions_created, False)
+        self.assertIn('Enacted 2/2 billing cycles', stdout.getvalue())
+
     def test_enact_costs_command_default_as_of(self):
         with db_transaction.atomic():
             recurring_cost = RecurringCost.objects.create(
@@ -602,6 +695,341 @@ class RecurringCostModelTransactionTestCase(DataProvider, BalanceUtils, Transact
         self.assertEqual(self.billing_cycle_4.transactions_created, True)
 
 
+class BatchEnactorTestCase(DataProvider, BalanceUtils, TransactionTestCase):
+
+    def setUp(self):
+        self.bank = self.account(type=Account.TYPES.asset, currencies=['GBP'])
+        self.expense_account = self.account(type=Account.TYPES.expense, currencies=['GBP'])
+        self.to_account = self.account(type=Account.TYPES.liability, currencies=['GBP'])
+        self.housemate_account_1 = self.account(type=Account.TYPES.income, currencies=['GBP'])
+        self.housemate_account_2 = self.account(type=Account.TYPES.income, currencies=['GBP'])
+        self.housemate_account_3 = self.account(type=Account.TYPES.income, currencies=['GBP'])
+
+        self.billing_cycle_1 = BillingCycle.objects.create(date_range=('2000-01-01', '2000-02-01'))
+        self.billing_cycle_2 = BillingCycle.objects.create(date_range=('2000-02-01', '2000-03-01'))
+        self.billing_cycle_3 = BillingCycle.objects.create(date_range=('2000-03-01', '2000-04-01'))
+        self.billing_cycle_1.refresh_from_db()
+        self.billing_cycle_2.refresh_from_db()
+        self.billing_cycle_3.refresh_from_db()
+
+        self.bank.transfer_to(self.expense_account, Money(100, 'GBP'), date='2000-01-15')
+        self.bank.transfer_to(self.expense_account, Money(50, 'GBP'), date='2000-02-15')
+
+        self.recurring = self.create_cost(fixed_amount=100, type=RecurringCost.TYPES.normal)
+        self.one_off = self.create_cost(fixed_amount=100, type=RecurringCost.TYPES.normal, total_billing_cycles=3)
+        self.arrears_balance = self.create_cost(to_account=self.expense_account,
+                                                type=RecurringCost.TYPES.arrears_balance)
+        self.arrears_transactions = self.create_cost(to_account=self.expense_account,
+                                                     type=RecurringCost.TYPES.arrears_transactions)
+
+    def create_cost(self, **kwargs):
+        kwargs.setdefault('to_account', self.to_account)
+        with db_transaction.atomic():
+            recurring_cost = RecurringCost.objects.create(initial_billing_cycle=self.billing_cycle_1, **kwargs)
+            RecurringCostSplit.objects.create(recurring_cost=recurring_cost, from_account=self.housemate_account_1,
+                                              portion=Decimal('1'))
+            RecurringCostSplit.objects.create(recurring_cost=recurring_cost, from_account=self.housemate_account_2,
+                                              portion=Decimal('1'))
+            RecurringCostSplit.objects.create(recurring_cost=recurring_cost, from_account=self.housemate_account_3,
+                                              portion=Decimal('0.5'))
+        return recurring_cost
+
+    def get_ledger(self, billing_cycle):
+        legs = Leg.objects.filter(transaction__recurred_cost__billing_cycle=billing_cycle)
+        recurred_costs = RecurredCost.objects.filter(billing_cycle=billing_cycle)
+        return (
+            sorted(legs.values_list('transaction__recurred_cost__recurring_cost_id', 'account_id',
+                                    'amount', 'amount_currency', 'transaction__date', 'transaction__description')),
+            sorted(recurred_costs.values_list('recurring_cost_id', 'transaction__isnull')),
+        )
+
+    def test_same_ledger_as_per_cost_enactment(self):
+        self.billing_cycle_1.enact_all_costs(batch=False)
+        self.billing_cycle_2.enact_all_costs(batch=False)
+        per_cost_ledger = self.get_ledger(self.billing_cycle_2)
+
+        self.billing_cycle_2.unenact_all_costs()
+        self.assertEqual(self.get_ledger(self.billing_cycle_2), ([], []))
+
+        self.billing_cycle_2.enact_all_costs(batch=True)
+        self.assertEqual(self.get_ledger(self.billing_cycle_2), per_cost_ledger)
+        self.assertEqual(len(per_cost_ledger[1]), 4)
+
+    def test_enact(self):
+        BatchEnactor(self.billing_cycle_1).enact()
+
+        # 100 recurring + 33.33 one-off. Arrears costs have nothing to bill yet
+        self.assertBalanceEqual(self.to_account.balance(), Decimal('133.33'))
+        self.assertBalanceEqual(self.housemate_account_1.balance(), Decimal('-53.33'))
+        self.assertBalanceEqual(self.housemate_account_2.balance(), Decimal('-53.33'))
+        self.assertBalanceEqual(self.housemate_account_3.balance(), Decimal('-26.67'))
+        self.assertEqual(RecurredCost.objects.filter(billing_cycle=self.billing_cycle_1).count(), 4)
+        self.assertEqual(Transaction.objects.filter(recurred_cost__isnull=False).count(), 2)
+
+    def test_skips_enacted_and_unenactable(self):
+        self.recurring.enact(self.billing_cycle_1)
+        self.one_off.archive()
+
+        recurred_costs = BatchEnactor(self.billing_cycle_1).enact()
+        self.assertEqual(
+            {recurred_cost.recurring_cost for recurred_cost in recurred_costs},
+            {self.arrears_balance, self.arrears_transactions},
+        )
+
+        # Running again has nothing left to do
+        self.assertEqual(BatchEnactor(self.billing_cycle_1).enact(), [])
+
+    def test_write_skips_claimed(self):
+        # Plan, but have something else enact one of the costs before we write
+        enactor = BatchEnactor(self.billing_cycle_1)
+        planned = enactor.plan()
+        self.recurring.enact(self.billing_cycle_1)
+
+        recurred_costs = enactor.write(planned)
+        self.assertEqual(len(recurred_costs), 3)
+        self.assertNotIn(self.recurring.pk, [recurred_cost.recurring_cost_id for recurred_cost in recurred_costs])
+
+        # Not billed twice
+        self.assertBalanceEqual(self.to_account.balance(), Decimal('133.33'))
+        self.assertEqual(RecurredCost.objects.filter(billing_cycle=self.billing_cycle_1).count(), 4)
+        self.assertBilledMatchesLedger()
+
+    def test_claim(self):
+        claimed = RecurredCost.objects.claim(self.billing_cycle_1, [self.recurring, self.one_off])
+        self.assertEqual(set(claimed), {self.recurring.pk, self.one_off.pk})
+        self.assertEqual(claimed[self.recurring.pk], RecurredCost.objects.get(recurring_cost=self.recurring))
+
+        claimed = RecurredCost.objects.claim(self.billing_cycle_1, [self.recurring, self.arrears_balance])
+        self.assertEqual(set(claimed), {self.arrears_balance.pk})
+
+    def test_get_arrears_amounts(self):
+        # Account balances include child accounts
+        child_account = self.account(parent=self.expense_account, currencies=['GBP'])
+        self.bank.transfer_to(child_account, Money(25, 'GBP'), date='2000-02-20')
+
+        for billing_cycle in (self.billing_cycle_1, self.billing_cycle_2, self.billing_cycle_3):
+            amounts = get_arrears_amounts(RecurringCost.objects.all(), billing_cycle)
+            self.assertEqual(set(amounts), {self.arrears_balance.pk, self.arrears_transactions.pk})
+            for recurring_cost in (self.arrears_balance, self.arrears_transactions):
+                self.assertEqual(amounts[recurring_cost.pk], recurring_cost.get_amount(billing_cycle))
+
+        amounts = get_arrears_amounts(RecurringCost.objects.all(), self.billing_cycle_3)
+        self.assertEqual(amounts[self.arrears_balance.pk], 175)
+        self.assertEqual(amounts[self.arrears_transactions.pk], 75)
+
+    def assertBilledMatchesLedger(self):
+        for recurring_cost in RecurringCost.objects.all():
+            ledger_amount = recurring_cost.get_billed_amount()
+            self.assertEqual(recurring_cost.billed_balance, ledger_amount)
+            self.assertEqual(recurring_cost.billed_cycles, recurring_cost.recurrences.count())
+
+    def test_billed_amount_maintained(self):
+        self.billing_cycle_1.enact_all_costs(batch=True)
+        self.billing_cycle_2.enact_all_costs(batch=False)
+        self.assertBilledMatchesLedger()
+
+        self.one_off.refresh_from_db()
+        self.assertEqual(self.one_off.billed_amount, Decimal('66.67'))
+        self.assertEqual(self.one_off.billed_cycles, 2)
+
+        self.billing_cycle_2.reenact_all_costs()
+        self.assertBilledMatchesLedger()
+
+        self.billing_cycle_2.unenact_all_costs()
+        self.assertBilledMatchesLedger()
+
+        self.one_off.refresh_from_db()
+        self.assertEqual(self.one_off.billed_amount, Decimal('33.33'))
+        self.assertEqual(self.one_off.billed_cycles, 1)
+
+    def test_save_does_not_overwrite_billed_amount(self):
+        stale = RecurringCost.objects.get(pk=self.one_off.pk)
+        self.one_off.enact(self.billing_cycle_1)
+        stale.save()
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.billed_amount, Decimal('33.33'))
+
+    def test_save_copy(self):
+        self.one_off.enact(self.billing_cycle_1)
+        self.one_off.refresh_from_db()
+        self.one_off.pk = None
+        self.one_off.uuid = RecurringCost._meta.get_field('uuid').get_default()
+        self.one_off.save()
+
+        # Inserted in full, billed fields included
+        copy = RecurringCost.objects.get(pk=self.one_off.pk)
+        self.assertEqual(copy.billed_amount, Decimal('33.33'))
+        self.assertEqual(copy.billed_cycles, 1)
+
+    def test_unenact_reenact_constant_queries(self):
+        def count_queries(operation):
+            with CaptureQueriesContext(connection) as context:
+                operation()
+            return len(context.captured_queries)
+
+        self.billing_cycle_1.enact_all_costs()
+        unenact_queries = count_queries(self.billing_cycle_1.unenact_all_costs)
+        reenact_queries = count_queries(self.billing_cycle_1.reenact_all_costs)
+
+        for _ in range(5):
+            self.create_cost(fixed_amount=10, type=RecurringCost.TYPES.normal, total_billing_cycles=1)
+        self.billing_cycle_1.reenact_all_costs()
+
+        self.assertEqual(count_queries(self.billing_cycle_1.unenact_all_costs), unenact_queries)
+        self.assertEqual(count_queries(self.billing_cycle_1.reenact_all_costs), reenact_queries)
+
+        # The one-off costs were completed by the reenactment
+        self.assertEqual(RecurringCost.objects.filter(disabled=True).count(), 5)
+        self.assertEqual(RecurredCost.objects.filter(billing_cycle=self.billing_cycle_1).count(), 9)
+        self.assertBilledMatchesLedger()
+
+    def test_reenact_changed_amounts_constant_queries(self):
+        def reenact_changed():
+            RecurringCost.objects.recurring().filter(type=RecurringCost.TYPES.normal).update(
+                fixed_amount=F('fixed_amount') + 10
+            )
+            with CaptureQueriesContext(connection) as context:
+                summary = self.billing_cycle_1.reenact_all_costs()
+            return len(context.captured_queries), summary['legs_updated']
+
+        self.billing_cycle_1.enact_all_costs()
+        few_queries, few_legs_updated = reenact_changed()
+
+        for _ in range(5):
+            self.create_cost(fixed_amount=10, type=RecurringCost.TYPES.normal)
+        self.billing_cycle_1.reenact_all_costs()
+
+        many_queries, many_legs_updated = reenact_changed()
+        self.assertEqual(many_legs_updated, few_legs_updated * 6)
+        self.assertEqual(many_queries, few_queries)
+        self.assertBilledMatchesLedger()
+
+    def test_verify_billed_amounts_command(self):
+        self.billing_cycle_1.enact_all_costs()
+        VerifyBilledAmountsCommand().handle(fix=False)
+
+        RecurringCost.objects.filter(pk=self.one_off.pk).update(billed_amount=0)
+        with self.assertRaises(CommandError):
+            VerifyBilledAmountsCommand().handle(fix=False)
+
+        VerifyBilledAmountsCommand().handle(fix=True)
+        self.assertBilledMatchesLedger()
+
+    def test_enactment_run_batch(self):
+        self.one_off.archive()
+        self.billing_cycle_1.enact_all_costs(batch=True)
+
+        run = EnactmentRun.objects.get()
+        self.assertEqual(run.billing_cycle, self.billing_cycle_1)
+        self.assertEqual(run.mode, EnactmentRun.MODES.batch)
+        self.assertTrue(run.succeeded)
+        self.assertGreater(run.query_count, 0)
+        self.assertEqual(run.costs_enacted, 3)
+        self.assertEqual(run.costs_skipped, 1)
+        # Recurring cost: recurred cost, transaction & 4 legs. Arrears costs: just a recurred cost each
+        self.assertEqual(run.rows_written, 8)
+
+        cost_record = run.costs.get(recurring_cost=self.one_off)
+        self.assertEqual(cost_record.skip_reason, EnactmentRunCost.SKIP_REASONS.archived)
+        self.assertIsNone(cost_record.duration)
+
+    def test_enactment_run_failed(self):
+        with patch.object(BatchEnactor, 'write', side_effect=ValueError('Enactment failed')):
+            with self.assertRaises(ValueError):
+                self.billing_cycle_1.enact_all_costs(batch=True)
+
+        run = EnactmentRun.objects.get()
+        self.assertFalse(run.succeeded)
+
+    def test_enactment_run_failed_within_transaction(self):
+        # As per the enact_costs task & enact_costs --catch-up
+        with patch.object(BatchEnactor, 'write', side_effect=ValueError('Enactment failed')):
+            with self.assertRaises(ValueError):
+                with db_transaction.atomic():
+                    self.billing_cycle_1.enact_all_costs(batch=True)
+
+        # Survived the rollback
+        run = EnactmentRun.objects.get()
+        self.assertEqual(run.billing_cycle, self.billing_cycle_1)
+        self.assertFalse(run.succeeded)
+        self.assertEqual(run.costs.count(), 0)
+
+    def test_enactment_run_per_cost(self):
+        self.recurring.enact(self.billing_cycle_1)
+        self.billing_cycle_1.enact_all_costs(batch=False)
+
+        run = EnactmentRun.objects.get()
+        self.assertEqual(run.mode, EnactmentRun.MODES.per_cost)
+        self.assertEqual(run.costs_enacted, 3)
+        self.assertEqual(run.costs_skipped, 1)
+
+        cost_record = run.costs.get(recurring_cost=self.recurring)
+        self.assertEqual(cost_record.skip_reason, EnactmentRunCost.SKIP_REASONS.already_enacted)
+        self.assertEqual(cost_record.rows_written, 0)
+
+        cost_record = run.costs.get(recurring_cost=self.one_off)
+        self.assertEqual(cost_record.skip_reason, '')
+        self.assertIsNotNone(cost_record.duration)
+        self.assertGreater(cost_record.query_count, 0)
+        self.assertGreaterEqual(cost_record.rows_written, 6)
+
+        cost_record = run.costs.get(recurring_cost=self.arrears_balance)
+        self.assertEqual(cost_record.rows_written, 1)
+
+    def test_get_unenactable_reason(self):
+        as_of = self.billing_cycle_1.date_range.lower
+        self.assertIsNone(self.recurring.get_unenactable_reason(as_of))
+        self.recurring.archive()
+        self.assertEqual(self.recurring.get_unenactable_reason(as_of), EnactmentRunCost.SKIP_REASONS.archived)
+
+        self.one_off.enact(self.billing_cycle_1)
+        self.one_off.enact(self.billing_cycle_2)
+        self.one_off.enact(self.billing_cycle_3)
+        self.one_off.refresh_from_db()
+        self.assertEqual(self.one_off.get_unenactable_reason(as_of), EnactmentRunCost.SKIP_REASONS.billing_complete)
+
+    def test_query_counter(self):
+        with QueryCounter(connection) as counter:
+            RecurringCost.objects.count()
+            ParallelEnactment.objects.bulk_create([
+                ParallelEnactment(billing_cycle=self.billing_cycle_1, as_of=date(2000, 1, 1), chunk_size=10,
+                                  chunks_remaining=0, status=ParallelEnactment.STATUSES.finalised)
+                for _ in range(3)
+            ])
+        self.assertEqual(counter.queries, 2)
+        self.assertEqual(counter.rows_inserted, 3)
+
+        # No longer counting
+        RecurringCost.objects.count()
+        self.assertEqual(counter.queries, 2)
+
+    def test_prune_enactment_runs(self):
+        self.billing_cycle_1.enact_all_costs(batch=True)
+        old_run = EnactmentRun.objects.get()
+        EnactmentRun.objects.filter(pk=old_run.pk).update(timestamp=timezone.now() - timedelta(days=400))
+
+        # Pruned when the next run is recorded
+        self.billing_cycle_2.enact_all_costs(batch=True)
+        self.assertEqual(list(EnactmentRun.objects.values_list('billing_cycle', flat=True)), [self.billing_cycle_2.pk])
+        self.assertFalse(EnactmentRunCost.objects.filter(run_id=old_run.pk).exists())
+
+        with self.settings(SWIFTWIND_ENACTMENT_RUN_RETENTION_DAYS=None):
+            self.assertIsNone(EnactmentRun.objects.prune(as_of=timezone.now() + timedelta(days=1000)))
+        self.assertEqual(EnactmentRun.objects.count(), 1)
+
+    def test_enactment_report_command(self):
+        self.billing_cycle_1.enact_all_costs(batch=False)
+        self.billing_cycle_2.enact_all_costs(batch=True)
+
+        output = StringIO()
+        EnactmentReportCommand(stdout=output).handle(limit=10)
+        output = output.getvalue()
+        self.assertIn('Slowest billing cycle enactments', output)
+        self.assertIn(str(self.billing_cycle_2), output)
+        self.assertIn(str(self.one_off.uuid), output)
+
+
 class RecurringCostSplitModelTestCase(DataProvider, TestCase):
 
     def setUp(self):
@@ -636,6 +1064,29 @@ class RecurringCostSplitModelTestCase(DataProvider, TestCase):
         self.assertEqual(objs_dict[self.split2], 25)
         self.assertEqual(objs_dict[self.split3], 25)
 
+    def test_queryset_split_prefetched(self):
+        recurring_cost = RecurringCost.objects.prefetch_related('splits').get()
+        with self.assertNumQueries(0):
+            splits = recurring_cost.splits.all().split(100)
+        self.assertEqual(len(splits), 3)
+
+    def test_split_plan_cache(self):
+        split_plans = SplitPlanCache([self.recurring_cost])
+        with self.assertNumQueries(0):
+            splits = split_plans.split(self.recurring_cost, Decimal('100'))
+            self.assertIs(split_plans.split(self.recurring_cost, Decimal('100')), splits)
+
+        self.assertEqual(
+            [(obj.pk, amount) for obj, amount in splits],
+            [(self.split1.pk, 50), (self.split2.pk, 25), (self.split3.pk, 25)],
+        )
+
+    def test_split_plan_cache_prefetched(self):
+        recurring_cost = RecurringCost.objects.prefetch_related('splits').get()
+        with self.assertNumQueries(0):
+            split_plans = SplitPlanCache([recurring_cost])
+            split_plans.split(recurring_cost, Decimal('100'))
+
 
 class RecurredCostModelTestCase(DataProvider, TestCase):
 
@@ -682,6 +1133,12 @@ class RecurredCostModelTestCase(DataProvider, TestCase):
         self.assertEqual(transaction.legs.count(), 4)  # 3 splits (from accounts) + 1 to account
         self.assertEqual(str(transaction.date), '2000-01-01')
 
+    def test_make_transaction_does_not_record_billed(self):
+        self.recurred_cost.make_transaction()
+        self.recurring_cost.refresh_from_db()
+        self.assertEqual(self.recurring_cost.billed_amount, 0)
+        self.assertEqual(self.recurring_cost.billed_cycles, 0)
+
 
 class CreateRecurringCostFormTestCase(DataProvider, TestCase):
 
@@ -1073,6 +1530,97 @@ class CreateOneOffCostViewTestCase(DataProvider, TransactionTestCase):
         self.assertFalse(form.is_valid())
 
 
+class ForecastTestCase(DataProvider, TestCase):
+
+    def setUp(self):
+        self.login()
+
+        self.housemate1 = self.housemate(account_kwargs=dict(currencies=['GBP'], name='Housemate 1'))
+        self.housemate2 = self.housemate(account_kwargs=dict(currencies=['GBP'], name='Housemate 2'))
+        self.to_account = self.account(currencies=['GBP'])
+        self.expense_account = self.account(type=Account.TYPES.expense, currencies=['GBP'])
+
+        self.billing_cycle_1 = BillingCycle.objects.create(date_range=('2000-01-01', '2000-02-01'))
+        self.billing_cycle_2 = BillingCycle.objects.create(date_range=('2000-02-01', '2000-03-01'))
+        self.billing_cycle_3 = BillingCycle.objects.create(date_range=('2000-03-01', '2000-04-01'))
+        self.billing_cycle_1.refresh_from_db()
+        self.billing_cycle_2.refresh_from_db()
+
+        self.create_cost(fixed_amount=100, initial_billing_cycle=self.billing_cycle_1)
+        self.create_cost(fixed_amount=100, total_billing_cycles=3, initial_billing_cycle=self.billing_cycle_2)
+        self.bank = self.account(type=Account.TYPES.asset, currencies=['GBP'])
+        arrears_cost = self.create_cost(to_account=self.expense_account, type=RecurringCost.TYPES.arrears_balance,
+                                        initial_billing_cycle=self.billing_cycle_1)
+        # Bills 10, then 20
+        self.bank.transfer_to(self.expense_account, Money(10, 'GBP'), date='1999-12-15')
+        arrears_cost.enact(self.billing_cycle_1)
+        self.bank.transfer_to(self.expense_account, Money(20, 'GBP'), date='2000-01-15')
+        arrears_cost.enact(self.billing_cycle_2)
+
+    def create_cost(self, **kwargs):
+        kwargs.setdefault('to_account', self.to_account)
+        recurring_cost = RecurringCost.objects.create(**kwargs)
+        RecurringCostSplit.objects.create(recurring_cost=recurring_cost, from_account=self.housemate1.account)
+        RecurringCostSplit.objects.create(recurring_cost=recurring_cost, from_account=self.housemate2.account)
+        return recurring_cost
+
+    def test_forecast(self):
+        forecast = Forecast(as_of=date(2000, 1, 15))
+
+        self.assertEqual(forecast.housemates, [self.housemate1, self.housemate2])
+        self.assertEqual(len(forecast.billing_cycles), 3)
+        self.assertEqual(forecast.charges, [
+            # 50 recurring + 7.50 estimated arrears
+            [Decimal('57.50'), Decimal('57.50')],
+            # Plus the first two installments of the one-off cost
+            [Decimal('74.16'), Decimal('74.17')],
+            [Decimal('74.16'), Decimal('74.17')],
+        ])
+        self.assertEqual(forecast.housemate_totals(), [
+            (self.housemate1, Decimal('205.82')),
+            (self.housemate2, Decimal('205.84')),
+        ])
+
+    def test_arrears_estimate_credit_normal_account(self):
+        income_account = self.account(type=Account.TYPES.income, currencies=['GBP'])
+        arrears_cost = self.create_cost(to_account=income_account, type=RecurringCost.TYPES.arrears_balance,
+                                        initial_billing_cycle=self.billing_cycle_1)
+        # A debit to a credit-normal account, so the balance is negative and housemates are credited
+        txn = Transaction.objects.create(date='1999-12-15')
+        Leg.objects.create(transaction=txn, account=income_account, amount=Money(-30, 'GBP'))
+        Leg.objects.create(transaction=txn, account=self.bank, amount=Money(30, 'GBP'))
+
+        billed = arrears_cost.get_amount(self.billing_cycle_1)
+        self.assertEqual(billed, Decimal('-30'))
+        arrears_cost.enact(self.billing_cycle_1)
+        self.assertEqual(arrears_cost.billed_amount, Decimal('30'))
+
+        forecast = Forecast(as_of=date(2000, 1, 15))
+        self.assertEqual(forecast.estimate_amount(arrears_cost), billed)
+
+    def test_forecast_excludes_enacted_cycles(self):
+        BillingCycle.objects.filter(pk=self.billing_cycle_1.pk).update(transactions_created=True)
+        forecast = Forecast(as_of=date(2000, 1, 15))
+        self.assertEqual(forecast.billing_cycles, [self.billing_cycle_2, self.billing_cycle_3])
+
+    def test_view(self):
+        response = self.client.get(reverse('costs:forecast'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('forecast', response.context)
+
+    def test_json_view(self):
+        response = self.client.get(reverse('costs:forecast_json'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([housemate['name'] for housemate in data['housemates']], ['Housemate 1', 'Housemate 2'])
+
+    def test_json_view_no_housemates(self):
+        Housemate.objects.all().delete()
+        response = self.client.get(reverse('costs:forecast_json'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'housemates/housemates_required_error.html')
+
+
 class EnactCostsTaskTestCase(DataProvider, TestCase):
 
     def setUp(self):
@@ -1099,6 +1647,197 @@ class EnactCostsTaskTestCase(DataProvider, TestCase):
         self.assertEqual(self.billing_cycle.transactions_created, True)
         self.assertEqual(Transaction.objects.count(), 1)  # One transaction per recurring cost
 
+    def test_disable_costs(self):
+        with transaction.atomic():
+            one_off_cost = RecurringCost.objects.create(
+                to_account=self.to_account,
+                fixed_amount=100,
+                type=RecurringCost.TYPES.normal,
+                initial_billing_cycle=self.billing_cycle,
+                total_billing_cycles=1,
+            )
+            RecurringCostSplit.objects.create(recurring_cost=one_off_cost, from_account=self.housemate1.account)
+
+        self.assertEqual(tasks.disable_costs(), 0)
+
+        RecurringCost.objects.add_billed({
+            one_off_cost.pk: (Decimal('100'), 1),
+            self.recurring_cost.pk: (Decimal('100'), 1),
+        })
+        self.assertEqual(tasks.disable_costs(), 1)
+        self.assertEqual(tasks.disable_costs(), 0)
+
+        one_off_cost.refresh_from_db()
+        self.recurring_cost.refresh_from_db()
+        self.assertEqual(one_off_cost.disabled, True)
+        self.assertEqual(self.recurring_cost.disabled, False)
+
+    def eager_tasks(self):
+        # As per CELERY_TASK_ALWAYS_EAGER, tasks are run inline rather than by a worker
+        always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        self.addCleanup(setattr, current_app.conf, 'task_always_eager', always_eager)
+
+    def create_costs(self, count):
+        with transaction.atomic():
+            for _ in range(count):
+                recurring_cost = RecurringCost.objects.create(
+                    to_account=self.to_account,
+                    fixed_amount=10,
+                    type=RecurringCost.TYPES.normal,
+                    initial_billing_cycle=self.billing_cycle,
+                )
+                RecurringCostSplit.objects.create(recurring_cost=recurring_cost, from_account=self.housemate1.account)
+
+    def test_enact_costs_parallel(self):
+        self.eager_tasks()
+        self.create_costs(2)
+        tasks.enact_costs_parallel(as_of=date(2016, 4, 15), chunk_size=1)
+
+        self.billing_cycle.refresh_from_db()
+        self.assertEqual(self.billing_cycle.transactions_created, True)
+        self.assertEqual(Transaction.objects.count(), 3)
+
+        enactment = ParallelEnactment.objects.get()
+        self.assertEqual(enactment.chunks_remaining, 0)
+        self.assertEqual(enactment.failed, False)
+
+    def test_enact_costs_parallel_failure(self):
+        self.eager_tasks()
+        self.create_costs(2)
+        with transaction.atomic():
+            # Disabled before this enactment, so should remain disabled
+            disabled_cost = RecurringCost.objects.create(
+                to_account=self.to_account,
+                fixed_amount=10,
+                type=RecurringCost.TYPES.normal,
+                initial_billing_cycle=self.billing_cycle,
+                disabled=True,
+            )
+            RecurringCostSplit.objects.create(recurring_cost=disabled_cost, from_account=self.housemate1.account)
+
+        enact = BatchEnactor.enact
+        calls = []
+
+        def fail_second_chunk(enactor):
+            calls.append(enactor)
+            if len(calls) == 2:
+                raise ValueError('Chunk failed')
+            return enact(enactor)
+
+        with patch.object(BatchEnactor, 'enact', autospec=True, side_effect=fail_second_chunk):
+            tasks.enact_costs_parallel(as_of=date(2016, 4, 15), chunk_size=1)
+
+        # The third chunk was skipped, and the first compensated for
+        self.assertEqual(len(calls), 2)
+        self.billing_cycle.refresh_from_db()
+        self.assertEqual(self.billing_cycle.transactions_created, False)
+        self.assertEqual(Transaction.objects.count(), 0)
+        self.assertEqual(RecurredCost.objects.count(), 0)
+        self.assertEqual(ParallelEnactment.objects.get().failed, True)
+
+        disabled_cost.refresh_from_db()
+        self.assertEqual(disabled_cost.disabled, True)
+        self.recurring_cost.refresh_from_db()
+        self.assertEqual(self.recurring_cost.billed_amount, 0)
+
+    def create_enactment(self, chunks_remaining=1):
+        return ParallelEnactment.objects.create(
+            billing_cycle=self.billing_cycle,
+            as_of=date(2016, 4, 15),
+            chunk_size=10,
+            chunks_remaining=chunks_remaining,
+        )
+
+    def test_enact_cost_chunk(self):
+        enactment = self.create_enactment(chunks_remaining=2)
+        with patch('swiftwind.costs.tasks.finalise_billing_cycle.delay') as delay:
+            recurred_cost_ids = tasks.enact_cost_chunk(enactment.pk, [self.recurring_cost.pk])
+        self.assertEqual(len(recurred_cost_ids), 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        # The billing cycle is not complete until all chunks are complete
+        delay.assert_not_called()
+        enactment.refresh_from_db()
+        self.assertEqual(enactment.chunks_remaining, 1)
+
+    def test_enact_final_cost_chunk(self):
+        enactment = self.create_enactment()
+        with patch('swiftwind.costs.tasks.finalise_billing_cycle.delay') as delay:
+            tasks.enact_cost_chunk(enactment.pk, [self.recurring_cost.pk])
+        delay.assert_called_once_with(enactment.pk)
+
+    def test_finalise_billing_cycle(self):
+        enactment = self.create_enactment()
+        with patch('swiftwind.costs.tasks.enact_costs_parallel.delay') as delay:
+            tasks.finalise_billing_cycle(enactment.pk)
+
+        # Moves on to the next billing cycle
+        delay.assert_called_once_with(as_of='2016-04-15', chunk_size=10)
+        self.billing_cycle.refresh_from_db()
+        self.assertEqual(self.billing_cycle.transactions_created, True)
+
+    def test_compensate_billing_cycle(self):
+        enactment = self.create_enactment(chunks_remaining=2)
+        tasks.enact_cost_chunk(enactment.pk, [self.recurring_cost.pk])
+        tasks.compensate_billing_cycle(enactment.pk)
+        self.assertEqual(Transaction.objects.count(), 0)
+        self.assertEqual(RecurredCost.objects.count(), 0)
+        enactment.refresh_from_db()
+        self.assertEqual(enactment.status, ParallelEnactment.STATUSES.compensated)
+
+    def test_compensate_billing_cycle_only_own_costs(self):
+        self.create_costs(1)
+        other_cost = RecurringCost.objects.exclude(pk=self.recurring_cost.pk).get()
+        other_cost.enact(self.billing_cycle)
+
+        enactment = self.create_enactment(chunks_remaining=2)
+        tasks.enact_cost_chunk(enactment.pk, [self.recurring_cost.pk])
+        tasks.compensate_billing_cycle(enactment.pk)
+        self.assertEqual(list(RecurredCost.objects.values_list('recurring_cost', flat=True)), [other_cost.pk])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_enact_costs_parallel_once_per_cycle(self):
+        self.create_enactment()
+        with patch('swiftwind.costs.tasks.enact_cost_chunk.delay') as delay:
+            tasks.enact_costs_parallel(as_of=date(2016, 4, 15))
+        delay.assert_not_called()
+        self.assertEqual(ParallelEnactment.objects.count(), 1)
+
+        # Another may be started once the first is no longer running
+        ParallelEnactment.objects.update(status=ParallelEnactment.STATUSES.compensated)
+        with patch('swiftwind.costs.tasks.enact_cost_chunk.delay') as delay:
+            tasks.enact_costs_parallel(as_of=date(2016, 4, 15))
+        delay.assert_called_once_with(ParallelEnactment.objects.running().get().pk, [self.recurring_cost.pk])
+
+    def test_reap_parallel_enactments(self):
+        enactment = self.create_enactment(chunks_remaining=2)
+        tasks.enact_cost_chunk(enactment.pk, [self.recurring_cost.pk])
+        self.assertEqual(tasks.reap_parallel_enactments(), 0)
+
+        # The worker enacting the second chunk died
+        ParallelEnactment.objects.update(last_progress=timezone.now() - timedelta(minutes=61))
+        self.assertEqual(tasks.reap_parallel_enactments(), 1)
+        self.assertEqual(Transaction.objects.count(), 0)
+        enactment.refresh_from_db()
+        self.assertEqual(enactment.status, ParallelEnactment.STATUSES.compensated)
+        self.assertEqual(tasks.reap_parallel_enactments(), 0)
+
+    def test_chunk_rolled_back_if_reaped(self):
+        enactment = self.create_enactment()
+        enact = BatchEnactor.enact
+
+        def enact_and_reap(enactor):
+            recurred_costs = enact(enactor)
+            # As if reaped by another process while the chunk was enacting
+            ParallelEnactment.objects.update(status=ParallelEnactment.STATUSES.compensated)
+            return recurred_costs
+
+        with patch.object(BatchEnactor, 'enact', autospec=True, side_effect=enact_and_reap):
+            with self.assertRaises(ParallelEnactmentAbandoned):
+                tasks.enact_cost_chunk(enactment.pk, [self.recurring_cost.pk])
+        self.assertEqual(Transaction.objects.count(), 0)
+
 
 class DeleteArchiveMixin(object):
 
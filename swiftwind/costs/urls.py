@@ -13,4 +13,6 @@ urlpatterns = [
     url(r'^oneoff/archive/(?P<uuid>.+)/$', views.ArchiveOneOffCostView.as_view(), name='archive_one_off'),
     url(r'^recurring/unarchive/(?P<uuid>.+)/$', views.UnarchiveRecurringCostView.as_view(), name='unarchive_recurring'),
     url(r'^oneoff/unarchive/(?P<uuid>.+)/$', views.UnarchiveOneOffCostView.as_view(), name='unarchive_one_off'),
+    url(r'^forecast/$', views.ForecastView.as_view(), name='forecast'),
+    url(r'^forecast/json/$', views.ForecastJsonView.as_view(), name='forecast_json'),
 ]
@@ -1,13 +1,15 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import transaction
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse, reverse_lazy
-from django.views.generic import DetailView
+from django.views import View
+from django.views.generic import DetailView, TemplateView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 
 from swiftwind.housemates.views import HousematesRequiredMixin
 from .forms import RecurringCostFormSet, OneOffCostFormSet, CreateOneOffCostForm, \
     CreateRecurringCostForm
+from .forecast import Forecast
 from .models import RecurringCost
 
 
@@ -150,3 +152,19 @@ class UnarchiveRecurringCostView(LoginRequiredMixin, HousematesRequiredMixin, De
 class UnarchiveOneOffCostView(UnarchiveRecurringCostView):
     success_url = reverse_lazy('costs:one_off')
     queryset = RecurringCost.objects.one_off()
+
+
+class ForecastView(LoginRequiredMixin, HousematesRequiredMixin, TemplateView):
+    """Show what each housemate will be charged in future billing cycles"""
+    template_name = 'costs/forecast.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(ForecastView, self).get_context_data(**kwargs)
+        context['forecast'] = Forecast()
+        return context
+
+
+class ForecastJsonView(LoginRequiredMixin, HousematesRequiredMixin, View):
+
+    def get(self, request):
+        return JsonResponse(Forecast().as_dict())
@@ -8,3 +8,5 @@ def set_default(setting, value):
 
 set_default('SWIFTWIND_BILLING_CYCLE', 'swiftwind.billing_cycle.cycles.Monthly')
 set_default('SWIFTWIND_BILLING_CYCLE_YEARS', 1)
+set_default('SWIFTWIND_ENACTMENT_RUN_RETENTION_DAYS', 365)
+set_default('SWIFTWIND_PARALLEL_ENACTMENT_TIMEOUT_MINUTES', 60)
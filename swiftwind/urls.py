@@ -16,6 +16,7 @@ Including another URLconf
 from django.conf.urls import url, include
 
 from hordak import views as hordak_views
+from swiftwind.accounts import views as account_views
 
 
 # All the following will appear in the 'hordak' namespace (i.e. 'hordak:accounts_transactions')
@@ -28,7 +29,7 @@ hordak_urls = [
     url(r'^extra/accounts/$', hordak_views.AccountListView.as_view(), name='accounts_list'),
     url(r'^extra/accounts/create/$', hordak_views.AccountCreateView.as_view(), name='accounts_create'),
     url(r'^extra/accounts/update/(?P<uuid>.+)/$', hordak_views.AccountUpdateView.as_view(), name='accounts_update'),
-    url(r'^extra/accounts/(?P<uuid>.+)/$', hordak_views.AccountTransactionsView.as_view(), name='accounts_transactions'),
+    url(r'^extra/accounts/(?P<uuid>.+)/$', account_views.AccountTransactionsView.as_view(), name='accounts_transactions'),
 
     url(r'^import/$', hordak_views.CreateImportView.as_view(), name='import_create'),
     url(r'^import/(?P<uuid>.*)/setup/$', hordak_views.SetupImportView.as_view(), name='import_setup'),
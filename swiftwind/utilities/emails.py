@@ -1,7 +1,16 @@
+import logging
+
+from django.core.mail import get_connection
 from django.test import RequestFactory
 
 from .site import get_site_root
 
+logger = logging.getLogger(__name__)
+
+#: The number of messages to send over a single SMTP connection before reconnecting.
+#: Many SMTP servers limit the number of messages accepted per connection.
+DEFAULT_BATCH_SIZE = 50
+
 
 class EmailViewMixin(object):
 
@@ -17,3 +26,58 @@ class EmailViewMixin(object):
         response = view(fake_request, **kwargs)
         response.render()
         return response.content.decode('utf8')
+
+
+def send_messages(messages, batch_size=DEFAULT_BATCH_SIZE, connection=None):
+    """Send many email messages, reusing a single connection for each batch
+
+    Messages should be fully built before calling this, and this should not be called
+    within a database transaction, as sending may be slow.
+
+    A failure to send one message does not prevent the remaining messages from being
+    sent. Failures are logged and returned. Should the connection be lost, it will be
+    reopened for the next message. Should the connection fail to open, every message
+    in the batch is returned as a failure.
+
+    For local testing, run a debugging SMTP server (``python -m smtpd -n -c DebuggingServer
+    localhost:1025``) and set ``EMAIL_PORT = 1025``.
+
+    Args:
+        messages (list[EmailMessage]): The messages to send
+        batch_size (int): The number of messages to send over each connection
+        connection: The email backend to use. Defaults to that returned by get_connection()
+
+    Returns:
+        list[(EmailMessage, Exception)]: The messages which could not be sent
+    """
+    connection = connection or get_connection()
+    failures = []
+
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        try:
+            connection.open()
+        except Exception as e:
+            # Unable to connect or authenticate, so none of the batch can be sent
+            logger.exception('Failed to open email connection')
+            failures.extend((message, e) for message in batch)
+            continue
+
+        try:
+            for message in batch:
+                try:
+                    connection.send_messages([message])
+                except Exception as e:
+                    logger.exception('Failed to send email to {}'.format(', '.join(message.recipients())))
+                    failures.append((message, e))
+                    # The connection may now be unusable, so start afresh
+                    connection.close()
+                    try:
+                        connection.open()
+                    except Exception:
+                        # Will be retried when sending the next message
+                        pass
+        finally:
+            connection.close()
+
+    return failures
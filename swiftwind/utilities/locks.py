@@ -0,0 +1,46 @@
+from zlib import crc32
+
+from django.db import connection, TransactionManagementError
+
+
+def get_lock_key(name):
+    """Get a stable 32-bit Postgres advisory lock key for the given name"""
+    key = crc32(name.encode('utf8'))
+    # Postgres' two-key advisory lock functions take signed 32-bit integers
+    return key - 2 ** 32 if key >= 2 ** 31 else key
+
+
+def _check_in_transaction():
+    # Transaction-level locks are released at the end of the transaction, which
+    # in autocommit mode would be immediately
+    if not connection.in_atomic_block:
+        raise TransactionManagementError('Advisory locks may only be taken within a transaction')
+
+
+def advisory_xact_lock(name, id=0):
+    """Wait for a Postgres advisory lock, held until the end of the current transaction
+
+    Args:
+        name (str): The name of the lock
+        id (int): Optional identifier within the name, e.g. the primary key of the
+            object being locked. Must fit within a signed 32-bit integer.
+    """
+    _check_in_transaction()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [get_lock_key(name), id])
+
+
+def try_advisory_xact_lock(name, id=0):
+    """Take a Postgres advisory lock without waiting, held until the end of the current transaction
+
+    Args:
+        name (str): The name of the lock
+        id (int): Optional identifier within the name. See advisory_xact_lock().
+
+    Returns:
+        bool: True if the lock was acquired, False if it is already held elsewhere
+    """
+    _check_in_transaction()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s, %s)', [get_lock_key(name), id])
+        return cursor.fetchone()[0]
@@ -0,0 +1,141 @@
+"""Keyset (cursor) pagination of account legs
+
+Offset pagination gets slower the deeper the page, as the database must still
+read every row being skipped. Keyset pagination instead resumes from the
+position of the last leg on the previous page. This position is passed between
+requests as a signed cursor, so it cannot be tampered with.
+
+Legs are paginated newest first, ordered by transaction date, then transaction,
+then leg.
+"""
+import datetime
+
+from django.core import signing
+from django.core.exceptions import SuspiciousOperation
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+
+CURSOR_SALT = 'swiftwind.utilities.pagination'
+
+ORDERING = ('-transaction__date', '-transaction_id', '-pk')
+
+
+class InvalidCursor(SuspiciousOperation):
+    """The cursor was malformed or has been tampered with
+
+    Being a SuspiciousOperation, this will result in a 400 response.
+    """
+
+
+def encode_cursor(leg):
+    """Get a cursor for the page following the given leg"""
+    return signing.dumps([str(leg.transaction.date), leg.transaction_id, leg.pk], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    """Get the (date, transaction id, leg id) position encoded within a cursor
+
+    Raises:
+        InvalidCursor
+    """
+    try:
+        date, transaction_id, leg_id = signing.loads(cursor, salt=CURSOR_SALT)
+        return datetime.date(*map(int, date.split('-'))), int(transaction_id), int(leg_id)
+    except (signing.BadSignature, ValueError, TypeError, AttributeError):
+        raise InvalidCursor('Invalid pagination cursor')
+
+
+class LegPage(object):
+    """A single page of legs
+
+    Attributes:
+        object_list (list[Leg]): The legs on this page
+        next_cursor (str): The cursor for the following page, or None if this is the last page
+    """
+
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _after_cursor(cursor):
+    date, transaction_id, leg_id = decode_cursor(cursor)
+    return (
+        Q(transaction__date__lt=date) |
+        Q(transaction__date=date, transaction_id__lt=transaction_id) |
+        Q(transaction__date=date, transaction_id=transaction_id, pk__lt=leg_id)
+    )
+
+
+def filter_after_cursor(queryset, cursor):
+    """Filter legs to those following the given cursor, i.e. those on its page and all later pages
+
+    Args:
+        queryset (QuerySet): The legs to filter
+        cursor (str): A cursor, as given by a page's ``next_cursor``. No filtering
+            is done if not specified.
+
+    Returns:
+        QuerySet
+
+    Raises:
+        InvalidCursor
+    """
+    if not cursor:
+        return queryset
+    return queryset.filter(_after_cursor(cursor))
+
+
+def filter_before_cursor(queryset, cursor):
+    """Filter legs to those preceding the given cursor, i.e. those on all earlier pages
+
+    Args:
+        queryset (QuerySet): The legs to filter
+        cursor (str): A cursor, as given by a page's ``next_cursor``. No legs
+            precede the first page, so none are returned if not specified.
+
+    Returns:
+        QuerySet
+
+    Raises:
+        InvalidCursor
+    """
+    if not cursor:
+        return queryset.none()
+    return queryset.exclude(_after_cursor(cursor))
+
+
+def paginate_legs(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Get a page of legs, newest first
+
+    Args:
+        queryset (QuerySet): The legs to paginate. Any existing ordering will be replaced.
+        cursor (str): The cursor of the page to get, as given by a previous page's
+            ``next_cursor``. Gets the first page if not specified.
+        page_size (int): The maximum number of legs on the page
+
+    Returns:
+        LegPage
+
+    Raises:
+        InvalidCursor
+    """
+    queryset = filter_after_cursor(queryset.order_by(*ORDERING), cursor)
+
+    # Fetch one more leg than needed to find out if there is a following page
+    legs = list(queryset[:page_size + 1])
+    if len(legs) > page_size:
+        return LegPage(legs[:page_size], next_cursor=encode_cursor(legs[page_size - 1]))
+    else:
+        return LegPage(legs)